@@ -0,0 +1,247 @@
+"""
+Batch rendering of many databases and schemas described in a manifest.
+
+$ python batch.py --manifest MANIFEST --jobs JOBS --report REPORT --cache_dir CACHE_DIR --cache_size CACHE_SIZE
+
+The manifest is a JSON file with a list of items (or an object with the key "items" and optional "jobs"):
+
+[
+    {"host": "localhost", "port": 5432, "user": "USER", "password": "PASSWORD", "db_name": "DB_NAME",
+     "schema_name": "SCHEMA_NAME", "engines": ["dot-r", "plantuml"], "output_path": "PATH", "direction": "1"}
+]
+
+"engines", "output_path", "direction" and "format" are optional, by default diagrams are built
+by all engines in png-format.
+Every database is opened once and all of its schemas are read in one pass over the catalog.
+Diagrams are built by a bounded pool of workers, the result of every item is reported at the end.
+All PlantUML diagrams of one format are rendered by one long-lived PlantUML process.
+With a cache, diagrams of schemas which have not changed are taken from it and such schemas are not read.
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pg8000
+from postgres_handler import PostgreSQL_handler
+from main import ENGINES, FORMATS, cache_key, render
+from diagram_cache import DiagramCache
+from plantuml_process import PlantUMLProcess
+
+
+class ConnectionPool():
+    """
+    The class keeps one open connection per database and gives it to everyone who asks.
+    """
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, host, port, user, password, db_name):
+        key = (host, str(port), user, db_name)
+        with self.lock:
+            if key not in self.connections:
+                self.connections[key] = pg8000.connect(
+                    database=db_name, user=user, password=password, host=host, port=port
+                )
+            return self.connections[key]
+
+    def discard(self, host, port, user, db_name):
+        """
+        Func closes the connection to the database (for example, after it was broken), the next 'get' opens a new one.
+        """
+        with self.lock:
+            connection = self.connections.pop((host, str(port), user, db_name), None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections.values():
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            self.connections = {}
+
+
+class BatchRunner():
+    """
+    The class builds diagrams for all items of the manifest.
+    Databases are read first (one pass per database), then every (item, engine) is built by the pool.
+    """
+    def __init__(self, items: list, jobs: int = 4, pool: ConnectionPool = None, cache: DiagramCache = None):
+        self.items = items
+        self.jobs = jobs
+        self.cache = cache
+        self.pool = pool or ConnectionPool()
+        self.plantuml_processes = {}
+        self.lock = threading.Lock()
+        self.report = []
+
+    @staticmethod
+    def database_key(item: dict) -> tuple:
+        return item['host'], str(item.get('port', 5432)), item['user'], item['password'], item['db_name']
+
+    @staticmethod
+    def item_engines(item: dict) -> list:
+        return item.get('engines') or list(ENGINES)
+
+    def is_cached(self, item: dict, fingerprint: str) -> bool:
+        return bool(fingerprint) and all(
+            self.cache.contains(cache_key(fingerprint, engine, item.get('direction', '1'), item.get('format', 'png')))
+            for engine in self.item_engines(item)
+        )
+
+    def introspect(self, key: tuple, items: list):
+        """
+        Func reads all schemas of one database in one pass.
+        Schemas whose diagrams are all in the cache are not read.
+        return: dict (schema: schema model), dict (schema: fingerprint).
+        """
+        host, port, user, password, db_name = key
+        connection = self.pool.get(host, port, user, password, db_name)
+        schemas = list(dict.fromkeys(item['schema_name'] for item in items))
+        fingerprints = {}
+        if self.cache:
+            fingerprints = PostgreSQL_handler(
+                host, port, user, password, db_name, schemas, connection=connection
+            ).get_fingerprints()
+            schemas = list(dict.fromkeys(
+                item['schema_name'] for item in items if not self.is_cached(item, fingerprints.get(item['schema_name']))
+            ))
+        models = {}
+        if schemas:
+            models = PostgreSQL_handler(
+                host, port, user, password, db_name, schemas, connection=connection
+            ).collect_models()
+        return models, fingerprints
+
+    def plantuml_process(self, image_format: str) -> PlantUMLProcess:
+        """
+        Func returns the PlantUML process for the format, the process is started once per run.
+        """
+        with self.lock:
+            if image_format not in self.plantuml_processes:
+                self.plantuml_processes[image_format] = PlantUMLProcess(image_format=image_format)
+            return self.plantuml_processes[image_format]
+
+    def render_item(self, engine: str, model, item: dict, name: str, fingerprint: str = None) -> bool:
+        work_dir = tempfile.mkdtemp(prefix=f'{engine}_')
+        image_format = item.get('format', 'png')
+        try:
+            return render(
+                engine, model, name, item.get('direction', '1'), item.get('output_path'), work_dir,
+                self.plantuml_process(image_format), image_format, self.cache, fingerprint
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def add_result(self, item: dict, engine, ok: bool, error: str = None):
+        self.report.append({
+            'db_name': item.get('db_name'), 'schema_name': item.get('schema_name'), 'engine': engine,
+            'output_path': item.get('output_path'), 'status': 'ok' if ok else 'failed', 'error': error
+        })
+
+    def run(self) -> list:
+        """
+        Func builds all diagrams and returns the report: one record per item and engine.
+        """
+        databases = {}
+        for item in self.items:
+            databases.setdefault(self.database_key(item), []).append(item)
+
+        names = set()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            introspection = {
+                executor.submit(self.introspect, key, items): key for key, items in databases.items()
+            }
+            rendering = {}
+            for task in as_completed(introspection):
+                key = introspection[task]
+                try:
+                    models, fingerprints = task.result()
+                    error = None
+                except Exception as e:
+                    models, fingerprints = {}, {}
+                    error = f'Failed to get database data: {e}'
+
+                for item in databases[key]:
+                    model = models.get(item['schema_name'])
+                    fingerprint = fingerprints.get(item['schema_name'])
+                    if model is None and not (self.cache and self.is_cached(item, fingerprint)):
+                        self.add_result(item, None, False, error or 'Schema does not exist or has no tables.')
+                        continue
+                    for engine in self.item_engines(item):
+                        if engine not in ENGINES:
+                            self.add_result(item, engine, False, 'Unknown engine.')
+                            continue
+                        if item.get('format', 'png') not in FORMATS:
+                            self.add_result(item, engine, False, 'Unknown format.')
+                            continue
+                        # Images are named by database and schema, the name must be unique in the run.
+                        name = f"{item['db_name']}_{item['schema_name']}"
+                        while (name, engine) in names:
+                            name += '_'
+                        names.add((name, engine))
+                        task = executor.submit(self.render_item, engine, model, item, name, fingerprint)
+                        rendering[task] = (item, engine)
+
+            for task in as_completed(rendering):
+                item, engine = rendering[task]
+                try:
+                    self.add_result(item, engine, bool(task.result()))
+                except Exception as e:
+                    self.add_result(item, engine, False, str(e))
+
+        self.pool.close()
+        for process in self.plantuml_processes.values():
+            process.close()
+        return self.report
+
+    def print_report(self):
+        failed = [record for record in self.report if record['status'] != 'ok']
+        for record in self.report:
+            line = f"{record['status']:>6}  {record['db_name']}.{record['schema_name']}  {record['engine'] or '-'}"
+            if record['error']:
+                line += f"  ({record['error']})"
+            print(line)
+        print(f'Diagrams built: {len(self.report) - len(failed)}, failed: {len(failed)}.')
+
+
+def load_manifest(path: str):
+    """
+    Func reads the manifest. return: list of items and the number of workers from the manifest (or None).
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        return manifest, None
+    return manifest['items'], manifest.get('jobs')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagram Builder for many databases")
+    parser.add_argument("--manifest", required=True, help="JSON file with databases, schemas and engines.")
+    parser.add_argument("--jobs", required=False, type=int, help="Number of workers. By default 4.")
+    parser.add_argument("--report", required=False, help="Save the report in this JSON file.")
+    parser.add_argument("--cache_dir", required=False, help="Folder for the cache of diagrams.")
+    parser.add_argument(
+        "--cache_size", required=False, type=int, default=512, help="Maximum size of the cache in MB. By default 512."
+    )
+
+    args = parser.parse_args()
+    items, jobs = load_manifest(args.manifest)
+    cache = DiagramCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+    runner = BatchRunner(items, args.jobs or jobs or 4, cache=cache)
+    report = runner.run()
+    runner.print_report()
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if any(record['status'] != 'ok' for record in report):
+        raise SystemExit(1)
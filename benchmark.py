@@ -0,0 +1,235 @@
+"""
+Benchmark of introspection, code generation and rendering on synthetic schemas.
+
+$ python benchmark.py --tables 100,1000,5000 --columns 8 --fk_density 1.5 --composite 0.1 --hubs 3
+--repeat 3 --render dot-r,plantuml --output RESULTS.json --ddl SCHEMA.sql
+
+Every stage is timed separately:
+- introspection by PostgreSQL_handler against a fake cursor, by DumpHandler from the DDL in a file,
+  or against a local PostgreSQL (--host, --port, --user, --password, --db_name): the DDL is loaded
+  into a new schema '<schema_name>_<random>', which is created by the benchmark and dropped after;
+- generation of the code (DSL) by PlantUMLBilder, Graphviz_handler, DBMLRenderer and of the MetaData for ERAlchemy;
+- rendering by the engines listed in --render (external tools must be installed).
+Results are saved as JSON: one record per (size, stage) with the minimum and the median of the runs.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from diagram_builder import PlantUMLBilder
+from graphviz_dot_handler import Graphviz_handler
+from dbml_renderer_handler import DBMLRenderer
+from postgres_handler import ERAlchemyHandler, PostgreSQL_handler
+from dump_handler import DumpHandler
+from synthetic_schema import FakeCatalogConnection, SyntheticSchema
+from main import ENGINES, render
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Func quotes a name for SQL: 'bench' -> '"bench"'.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    Func runs 'func' 'repeat' times. return: dict with times of the runs and the result of the last run.
+    """
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return {
+        'seconds_min': min(runs), 'seconds_median': statistics.median(runs), 'runs': runs, 'result': result
+    }
+
+
+class Benchmark():
+    """
+    The class runs all stages for every size of the schema and collects records.
+    """
+    def __init__(self, options: dict, repeat: int = 3, render_engines=(), database: dict = None):
+        self.options = options
+        self.repeat = repeat
+        self.render_engines = list(render_engines)
+        self.database = database
+        self.records = []
+
+    def add(self, tables: int, stage: str, measured: dict, **extra):
+        record = {'tables': tables, 'stage': stage}
+        record.update({key: value for key, value in measured.items() if key != 'result'})
+        record.update(extra)
+        self.records.append(record)
+        print(f"{tables:>7} tables  {stage:<28} {measured['seconds_min']:.4f} s")
+
+    def introspection_fake(self, schema: SyntheticSchema):
+        connection = FakeCatalogConnection(schema)
+
+        def run():
+            connection.queries = connection.rows_fetched = 0
+            handler = PostgreSQL_handler(None, None, None, None, None, schema.schema, connection=connection)
+            return handler.start_handler()
+        measured = measure(run, self.repeat)
+        self.add(
+            len(schema.tables), 'introspection (fake cursor)', measured,
+            queries=connection.queries, rows=connection.rows_fetched
+        )
+        return measured['result']
+
+    def introspection_dump(self, schema: SyntheticSchema):
+        """
+        Func reads the schema from its DDL saved in a temporary file, every run parses the file again.
+        """
+        descriptor, path = tempfile.mkstemp(prefix='bench_', suffix='.sql')
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(schema.ddl())
+            measured = measure(lambda: DumpHandler(path, schema.schema).start_handler(), self.repeat)
+            self.add(len(schema.tables), 'introspection (dump)', measured, dump_size=os.path.getsize(path))
+        finally:
+            os.remove(path)
+
+    def introspection_database(self, schema: SyntheticSchema):
+        """
+        Func loads the schema into the database and reads it back. The schema gets a new unique name
+        ('<schema_name>_<random>'), it is created by this run and only then dropped in the end.
+        """
+        import pg8000
+        name = f'{schema.schema}_{uuid.uuid4().hex[:12]}'.lower()
+        schema = SyntheticSchema(len(schema.tables), **dict(self.options, schema=name))
+        connection = pg8000.connect(
+            database=self.database['db_name'], user=self.database['user'], password=self.database['password'],
+            host=self.database['host'], port=int(self.database['port'])
+        )
+        created = False
+        try:
+            cursor = connection.cursor()
+            # Fails if the schema exists, so a schema of somebody else is never filled or dropped.
+            cursor.execute(f'CREATE SCHEMA {quote_identifier(name)}')
+            connection.commit()
+            created = True
+            for statement in schema.ddl().split(';\n'):
+                if statement.strip():
+                    cursor.execute(statement)
+            connection.commit()
+
+            def run():
+                return PostgreSQL_handler(
+                    None, None, None, None, None, schema.schema, connection=connection
+                ).start_handler()
+            self.add(len(schema.tables), 'introspection (postgresql)', measure(run, self.repeat))
+        finally:
+            connection.rollback()
+            if created:
+                cursor = connection.cursor()
+                cursor.execute(f'DROP SCHEMA {quote_identifier(name)} CASCADE')
+                connection.commit()
+            connection.close()
+
+    def code_generation(self, model):
+        tables = len(model)
+        stages = {
+            'code plantuml': lambda: PlantUMLBilder('bench', None).constructor(model, '1'),
+            'code dot-r': lambda: Graphviz_handler('bench', None).dot_constructor(model),
+            'code dbml-r': lambda: DBMLRenderer('bench', None).constructor_handler(model, '1'),
+            'intermediary eralchemy': lambda: ERAlchemyHandler('bench', None).create_intermediary(model),
+        }
+        for stage, func in stages.items():
+            measured = measure(func, self.repeat)
+            extra = {'code_size': len(measured['result'])} if isinstance(measured['result'], str) else {}
+            self.add(tables, stage, measured, **extra)
+
+    def rendering(self, model):
+        """
+        Func renders the model by every selected engine. Every run gets new folders, images are removed.
+        """
+        for engine in self.render_engines:
+            def run():
+                output_path = tempfile.mkdtemp(prefix='bench_out_')
+                work_dir = tempfile.mkdtemp(prefix=f'bench_{engine}_')
+                try:
+                    return render(engine, model, 'bench', '1', output_path, work_dir)
+                finally:
+                    shutil.rmtree(output_path, ignore_errors=True)
+                    shutil.rmtree(work_dir, ignore_errors=True)
+            measured = measure(run, self.repeat)
+            self.add(len(model), f'render {engine}', measured, ok=bool(measured['result']))
+
+    def run(self, sizes: list) -> list:
+        for tables in sizes:
+            schema = SyntheticSchema(tables, **self.options)
+            model = self.introspection_fake(schema)
+            self.introspection_dump(schema)
+            if self.database:
+                self.introspection_database(schema)
+            self.code_generation(model)
+            self.rendering(model)
+        return self.records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of Diagram Builder on synthetic schemas")
+    parser.add_argument("--tables", default="100,1000", help="Numbers of tables separated by commas.")
+    parser.add_argument("--columns", type=int, default=8, help="Ordinary columns per table.")
+    parser.add_argument("--fk_density", type=float, default=1.5, help="Average number of foreign keys per table.")
+    parser.add_argument("--composite", type=float, default=0.1, help="Share of tables with composite keys.")
+    parser.add_argument("--hubs", type=int, default=0, help="Number of hub tables.")
+    parser.add_argument("--hub_share", type=float, default=0.3, help="Share of foreign keys referring to hubs.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every stage.")
+    parser.add_argument("--render", default="", help="Engines for rendering separated by commas, by default none.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file with results.")
+    parser.add_argument("--ddl", required=False, help="Save the DDL of the largest schema in this file.")
+    parser.add_argument(
+        "--schema_name", default="bench",
+        help="Schema of the synthetic tables. In the database it is the prefix of a new schema."
+    )
+    parser.add_argument("--host", required=False, help="Host of a local PostgreSQL for introspection.")
+    parser.add_argument("--port", default="5432", help="Database port")
+    parser.add_argument("--user", required=False, help="Database user")
+    parser.add_argument("--password", required=False, help="Database password")
+    parser.add_argument("--db_name", required=False, help="Database name")
+
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.tables.split(',') if size.strip()]
+    engines = [engine.strip() for engine in args.render.split(',') if engine.strip()]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"Unknown engine '{engine}'.")
+    options = {
+        'columns': args.columns, 'fk_density': args.fk_density, 'composite': args.composite, 'hubs': args.hubs,
+        'hub_share': args.hub_share, 'schema': args.schema_name, 'seed': args.seed
+    }
+    database = None
+    if args.host:
+        database = {
+            'host': args.host, 'port': args.port, 'user': args.user, 'password': args.password,
+            'db_name': args.db_name
+        }
+
+    benchmark = Benchmark(options, args.repeat, engines, database)
+    records = benchmark.run(sizes)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': options,
+            'repeat': args.repeat,
+            'results': records
+        }, f, indent=2)
+    print(f'Results are saved in "{args.output}".')
+    if args.ddl:
+        with open(args.ddl, 'w') as f:
+            f.write(SyntheticSchema(max(sizes), **options).ddl())
@@ -2,16 +2,21 @@
 This is one way to build a diagram.
 
 The function generates DBML-code, which is fed to the input of 'dbml-renderer',
-which converts to DOT and feeds it to Graphviz. As input, we receive a diagram, which is saved in the folder
-'diagram_folder' in png-format.
+which converts to DOT and feeds it to Graphviz. As input, we receive a diagram in svg-format.
+It is saved as it is, or converted by cairosvg to png or pdf, if one of them is selected.
 
 Using this method, we cannot customize links, chart color, shape, etc. This tool is very limited.
 """
 import cairosvg
 import subprocess
 import os
+import time
 from datetime import datetime
 from saver import Saver
+from schema_model import SchemaModel, Column, Table
+from incremental import FragmentCache
+from graph_analytics import GraphAnalytics, analyze
+from metrics import metrics
 
 
 class DBMLRenderer():
@@ -20,177 +25,169 @@ class DBMLRenderer():
     It builds the dbml-code, which will then be passed to the input of the dbml-renderer.
     Unlike PlantUML Builder, the resulting diagram will show data types.
     """
-    def __init__(self, db_name: str, output_path: str):
+    def __init__(
+            self, db_name: str, output_path: str, work_dir: str = '.', image_format: str = 'png',
+            attempts: int = 5, delay: float = 0.2
+    ):
         self.name_db = db_name
         self.date_today = datetime.now().date().strftime('%Y-%m-%d')
-        self.construction_stage = {}
-        self.numeric_of_conn = {}
+        # Analytics of the graph (GraphAnalytics) shared by all engines, made here if not given.
+        self.analytics = None
         self.output_path = output_path
-        self.img_name = f'{self.name_db}_{self.date_today}.jpg'
+        # Folder for temporary files, every renderer running in parallel has its own.
+        self.work_dir = work_dir
+        self.dbml_file = os.path.join(self.work_dir, 'demo.dbml')
+        self.svg_file = os.path.join(self.work_dir, 'demo.svg')
+        # 'png', 'svg' or 'pdf'. Only png is rasterized.
+        self.image_format = image_format
+        self.img_name = f'{self.name_db}_{self.date_today}.{self.image_format}'
         self.saver = Saver(self.output_path, self.img_name)
+        # Conversion of svg is tried 'attempts' times, pauses start from 'delay' seconds and are doubled.
+        self.attempts = attempts
+        self.delay = delay
+        # Code of tables, it can be taken from the previous run (incremental rendering).
+        self.fragments = FragmentCache()
+        # If the model contains several schemas, tables of one schema are put in one group.
+        self.cluster = False
 
-    def define_column_type(self, column_types: dict, tabel: str, column: str) -> str:
+    def define_column_type(self, column: Column) -> str:
         """
         Func is define type of specific column.
         """
-        data_for_tabel = column_types[tabel]
-        type_for_column = data_for_tabel[column]
+        type_for_column = column.data_type
         type_for_column = type_for_column.replace(' ', '_')
         type_for_column = type_for_column.replace('-', '_')
         return type_for_column
 
-    def calculate_number_of_links(self, communication):
+    def table_code(self, tabel: Table) -> str:
         """
-        Here the number of links in each table is calculated.
+        Func returns the code with information about the structure of one table.
         """
-        for t_f in list(communication.keys()):
-            self.numeric_of_conn[t_f] = len(communication[t_f])
-
-        for t_f in list(communication.keys()):
-            if communication[t_f] != []:
-                for conn in communication[t_f]:
-                    self.numeric_of_conn[list(conn.keys())[0]] += 1
+        parts = [f"Table {tabel.name} "+"{\n"]
+        for column in tabel.columns:
+            column_type = self.define_column_type(column)
+            if column.name in tabel.primary_keys:
+                parts.append(f'{column.name} {column_type} [primary key]\n')
+            else:
+                parts.append(f'{column.name} {column_type}\n')
+        parts.append('}\n\n')
+        return ''.join(parts)
+
+    def tables_code(self, model: SchemaModel, analytics: GraphAnalytics):
+        """
+        Func yields the code with information about tables structure.
+        Only tables which have links are shown.
+        """
+        groups = {}
+        for tabel in model.tables.values():
+            if analytics.degree[tabel.name] > 0:
+                yield self.fragments.get(tabel, self.table_code)
+                if self.cluster and tabel.schema:
+                    groups.setdefault(tabel.schema, []).append(tabel.name)
+        for schema, tables in groups.items():
+            yield f'TableGroup {schema} ' + '{\n' + ''.join(f'{table}\n' for table in tables) + '}\n\n'
+
+    def links_code(self, direction_default: str, analytics: GraphAnalytics):
+        """
+        Func yields the code with information about connections between tables.
+        Repeated links are skipped by a set.
+        """
+        directions = analytics.directions(4, 4)
+        done_links = set()
+        for link in analytics.links:
+            table_from, key_from, tabel_to, key_to = link
+            # if direction_default = '2' is selected, then all links will be from left to right.
+            if direction_default == "2" or directions[link]:
+                conn_code = f"Ref: {table_from}.{key_from} > {tabel_to}.{key_to}\n"
+            else:
+                conn_code = f"Ref: {tabel_to}.{key_to} < {table_from}.{key_from}\n"
+            if conn_code not in done_links:
+                done_links.add(conn_code)
+                yield conn_code
 
-    def constructor_handler(
-            self, tables_structure: dict, foreign_keys_for_diagram_builder: dict, primary_keys: dict,
-            column_types: dict, direction_default: int
-    ) -> str:
+    def constructor_handler(self, model: SchemaModel, direction_default: str) -> str:
         """
         Func creates dbml-code.
         It handles data about tabel and return code for dbml-renderer.
+        The code is emitted in parts and joined once: time is O(tables + columns + links).
         """
-        self.calculate_number_of_links(foreign_keys_for_diagram_builder)
-        dbml_code = ""
-        # Creates code with information about tables structure.
-        for tabel in tables_structure.keys():
-            if self.numeric_of_conn[tabel] > 0:
-                tabel_code = f"Table {tabel} "+"{\n"
-                for column in tables_structure[tabel]:
-                    column_type = self.define_column_type(column_types, tabel, column)
-                    if tabel in primary_keys:
-                        if column in primary_keys[tabel]:
-                            tabel_code += f'{column} {column_type} [primary key]\n'
-                        else:
-                            tabel_code += f'{column} {column_type}\n'
-                    else:
-                        tabel_code += f'{column} {column_type}\n'
-                tabel_code += '}\n\n'
-                dbml_code += tabel_code
-
-        # Creates code with information about connections between tables.
-        for table_from in foreign_keys_for_diagram_builder.keys():
-            for conn_info in foreign_keys_for_diagram_builder[table_from]:
-                tabel_to = list(conn_info.keys())[0]
-                key_from = conn_info[tabel_to][0]
-                key_to = conn_info[tabel_to][1]
-
-                # if direction_default = '2' is selected, then all links will be from left to right.
-                if direction_default == "2":
-                    direction = True
-                else:
-                    direction = self.block_allocation(table_from, tabel_to)
-                if direction:
-                    conn_code = f"Ref: {table_from}.{key_from} > {tabel_to}.{key_to}\n"
-                else:
-                    conn_code = f"Ref: {tabel_to}.{key_to} < {table_from}.{key_from}\n"
-                if conn_code not in dbml_code:
-                    dbml_code += conn_code
-        return dbml_code
-
-    def block_allocation(self, table_from: str, tabel_to) -> bool:
-        """
-        Func decides on the order in which related blocks are placed.
-        return: bool.
-        """
-        if table_from not in self.construction_stage or tabel_to not in self.construction_stage:
-            if table_from not in self.construction_stage and tabel_to not in self.construction_stage:
-                self.construction_stage[table_from] = 1
-                self.construction_stage[tabel_to] = 1
-            if table_from not in self.construction_stage:
-                self.construction_stage[table_from] = 1
-                self.construction_stage[tabel_to] += 1
-            if tabel_to not in self.construction_stage:
-                self.construction_stage[tabel_to] = 1
-                self.construction_stage[table_from] += 1
-        else:
-            self.construction_stage[table_from] += 1
-            self.construction_stage[tabel_to] += 1
-        # если table_from многосвязный
-        if self.numeric_of_conn[table_from] > 4 and self.numeric_of_conn[tabel_to] <= 4:
-
-            # communication will do from right to left.
-            if self.numeric_of_conn[table_from] // 2 < self.construction_stage[table_from]:
-                return False
-            # communication will do from left to right.
-            else:
-                return True
-
-            # если tabel_to многосвязный
-        elif self.numeric_of_conn[tabel_to] > 4:
-            # communication will do from right to left.
-            if self.numeric_of_conn[tabel_to] // 2 < self.construction_stage[tabel_to]:
-                return True
-            # communication will do from left to right.
-            else:
-                return False
-        else:
-            return True
+        analytics = analyze(model, self.analytics)
+        parts = list(self.tables_code(model, analytics))
+        parts.extend(self.links_code(direction_default, analytics))
+        return ''.join(parts)
 
     def save_dbml_folder(self, dbml_code: str):
         """
         Func saves dbml file.
         """
-        with open(r"demo.dbml", "w") as f:
+        with open(self.dbml_file, "w") as f:
             f.write(dbml_code)
 
     def create_diagram_handler(self) -> bool:
         """
         Func executes a command in the console that creates a diagram in svg-format.
-        Converts to jpg-format, added white background.
+        The svg is saved as it is. For png and pdf it is converted, white background is added.
         """
-        answer = False
-        if not os.path.exists('diagram_folder'):
-            os.makedirs('diagram_folder')
-
-        command_line = [r"dbml-renderer", "-i", "demo.dbml", "-o", "demo.svg"]
+        command_line = [r"dbml-renderer", "-i", self.dbml_file, "-o", self.svg_file]
         try:
-            subprocess.run(command_line)
-        except:
+            result = metrics.run(command_line, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
             print("Failed to start 'dbml-renderer'.")
-            return
-        else:
-            print("Successfully launched 'dbml-renderer'.")
+            return False
+
+        stderr = result.stderr.decode('utf-8', 'replace').strip()
+        if result.returncode != 0:
+            print(f"Failed to start 'dbml-renderer'. {stderr}")
+            return False
+        print("Successfully launched 'dbml-renderer'.")
+        return self.convert_svg(stderr)
 
-        while answer == False:
+    def convert_svg(self, renderer_stderr: str = '') -> bool:
+        """
+        Func reads the svg made by 'dbml-renderer' and saves it in the selected format.
+        If the svg is not ready or invalid, it tries again a limited number of times, waiting longer each time.
+        """
+        error = None
+        for attempt in range(self.attempts):
+            if attempt:
+                time.sleep(self.delay * 2 ** (attempt - 1))
             try:
-                answer = cairosvg.svg2png(
-                    url=r'demo.svg',
-                    write_to=f'./diagram_folder/{self.name_db}_{self.date_today}.jpg', background_color="#FFFFFF"
-                )
-                if self.output_path:
-                    self.saver.save()
-            except:
+                with metrics.stage('convert svg', attempt=attempt + 1, format=self.image_format):
+                    if self.image_format == 'svg':
+                        with open(self.svg_file, 'rb') as f:
+                            image = f.read()
+                    elif self.image_format == 'pdf':
+                        image = cairosvg.svg2pdf(url=self.svg_file, background_color="#FFFFFF")
+                    else:
+                        image = cairosvg.svg2png(url=self.svg_file, background_color="#FFFFFF")
+            except Exception as e:
+                error = e
                 continue
-        return True
+            if image:
+                return self.saver.write(image)
+
+        print(f"Failed to convert the diagram of 'dbml-renderer' after {self.attempts} attempts: {error}. "
+              f"Output of 'dbml-renderer': {renderer_stderr or 'empty'}")
+        return False
 
     def delete_dbml_code_file(self):
         """
         Func is delete file with dbml-code.
         """
-        os.remove(r'demo.dbml')
-        os.remove(r'demo.svg')
+        for path in (self.dbml_file, self.svg_file):
+            if os.path.exists(path):
+                os.remove(path)
 
-    def start_handler(
-            self, tables_structure, foreign_keys_for_diagram_builder, primary_keys, column_types, direction
-    ):
+    def start_handler(self, model: SchemaModel, direction: str) -> bool:
         """
         Performs the functions of creating diagrams.
         """
-        dbml_code = self.constructor_handler(
-            tables_structure, foreign_keys_for_diagram_builder, primary_keys, column_types, direction
-        )
+        with metrics.stage('code dbml-r'):
+            dbml_code = self.constructor_handler(model, direction)
+        metrics.code_size('dbml-r', dbml_code)
         self.save_dbml_folder(dbml_code)
-        if self.create_diagram_handler():
-            self.delete_dbml_code_file()
+        answer = self.create_diagram_handler()
+        self.delete_dbml_code_file()
+        return answer
 
 
@@ -6,10 +6,13 @@ It allows the use of a simpler DSL markup language. The DSL code is input to the
 then it independently translates this code into the DOT language and sends it to Graphviz.
 Graphviz independently builds a diagram based on the requirements in the code.
 """
-import subprocess
 from datetime import datetime
 import os
 from saver import Saver
+from schema_model import SchemaModel, Table
+from incremental import FragmentCache
+from graph_analytics import GraphAnalytics, analyze, palette
+from metrics import metrics
 
 
 class PlantUMLBilder():
@@ -17,280 +20,213 @@ class PlantUMLBilder():
     The class performs data processing about db. Builds a chart based on this data.
     Its main task is to describe the code (diagram structure) in the DSL language.
     """
-    def __init__(self, db_name, output_path):
-        self.construction_stage = {}
+    def __init__(self, db_name, output_path, work_dir='.', plantuml_process=None, image_format='png'):
         self.date_today = datetime.now().date().strftime('%Y-%m-%d')
         self.path_to_plantuml = "third_party/plantuml.jar"
         self.db_name = db_name
         self.keys_to_bold = []
-        self.numeric_of_conn = {}
+        # Analytics of the graph (GraphAnalytics) shared by all engines, made here if not given.
+        self.analytics = None
         self.output_path = output_path
-        self.img_name = f'{self.db_name}__{self.date_today}.png'
+        # Folder for temporary files, every renderer running in parallel has its own.
+        self.work_dir = work_dir
+        self.uml_file = os.path.join(self.work_dir, f'{self.db_name}__{self.date_today}.txt')
+        # 'png', 'svg' or 'pdf' (PlantUML needs additional libraries for pdf).
+        self.image_format = image_format
+        self.img_name = f'{self.db_name}__{self.date_today}.{self.image_format}'
         self.saver = Saver(self.output_path, self.img_name)
-        # bold version.
-        self.colors_for_link = [r'[#f51505,bold]', r'[#877951,bold]', r'[#0057f7,bold]',
-                                r'[#21a105,bold]', r'[#eb8b05,bold]', r'[#d005eb,bold]',
-                                r'[#b80263,bold]', r'[#0091a1,bold]', r'[#00a173,bold]',
-                                r'[#7815cf,bold]', r'[#afb500,bold]', r'[#cf6967,bold]']
-
-    def calculate_number_of_links(self, communication):
-        """
-        Here the number of links in each table is calculated.
-        """
-        for t_f in list(communication.keys()):
-            self.numeric_of_conn[t_f] = len(communication[t_f])
-
-        for t_f in list(communication.keys()):
-            if communication[t_f] != []:
-                for conn in communication[t_f]:
-                    self.numeric_of_conn[list(conn.keys())[0]] += 1
-
-    def constructor(
-            self, tables: dict, communication: dict, keys_in_table:
-            dict, primary_key: dict, direction_default: str
-    ) -> str:
-        """
-        Func includes code development for plotting diagram.
-        tables: dict with name of the tables, name of column.
-        communication: dict with data about relationships between tables.
-        keys_in_table: dict with foreign key names.
-        primary_key: dict with primary key names.
-        """
-        tables_code = ''
-        communication_code = ''
-        self.calculate_number_of_links(communication)
-
-        for t in tables.keys():
-            columns = tables[t]
-            columns_code = ''
-            for idx, column in enumerate(columns):
-                if t in primary_key:
-                    # Checking that the column is a primary key. If yes: title will be bold.
-                    if column in primary_key[t]:
-                        if idx + 1 != len(columns):
-                            columns_code += f'**{column}**\n' + '..\n'
-                            continue
-                        else:
-                            columns_code += f'**{column}**\n'
-                            continue
-                # Checking that the table is in the dictionary where information about the foreign keys is stored.
-                if t in keys_in_table:
-                    # Checking that the column is a foreign key. If yes: title will be bold.
-                    if column in keys_in_table[t]:
-                        if idx + 1 != len(columns):
-                            columns_code += f'**{column}**\n' + '..\n'
-                        else:
-                            columns_code += f'**{column}**\n'
-                    else:
-                        if idx + 1 != len(columns):
-                            columns_code += f'{column}\n' + '..\n'
-                        else:
-                            columns_code += f'{column}\n'
-                else:
-                    if idx + 1 != len(columns):
-                        columns_code += f'{column}\n' + '..\n'
-                    else:
-                        columns_code += f'{column}\n'
-            table_code = f'class {t} << (T, transparent) >>' + '{\n' \
-                                                               f'{columns_code} \n' \
-                                                               '}\n'
-            tables_code += table_code
-
-        color_for_keys = self.link_color_selection(communication)
-        done_tabel = []
-
-        for table_from in communication.keys():
-            for conn_inform in communication[table_from]:
-                connection = ''
-                conn_inform = list(conn_inform.items())[0]
-                tabel_to = conn_inform[0]
-                key_from_start = (conn_inform[1])[0]
-                key_from_finish = (conn_inform[1])[1]
-
-                if (table_from, key_from_start, key_from_finish, tabel_to) not in done_tabel:
-                    color = color_for_keys[(table_from, key_from_start)]
-                    # if direction_default = '2' is selected, then all links will be from left to right.
-                    if direction_default == "2":
-                        from_left_to_right = self.block_allocation_by_key(communication, table_from)
-                    else:
-                        from_left_to_right = self.block_allocation(table_from, tabel_to)
-                    if from_left_to_right:
-                        relation = \
-                            f' {table_from}::{key_from_start} --{color}' \
-                            f' {tabel_to}::{key_from_finish}\n'
-                    else:
-                        relation = \
-                            f'{tabel_to}::{key_from_finish} --{color}' \
-                            f' {table_from}::{key_from_start}\n'
-                    if relation not in connection and relation not in communication_code:
-                        connection += relation
-                        communication_code += connection
-
-        uml_code = '@startuml\n' \
-                   '!define ClassFontName "Arial"\n\n' \
-                   'hide circle\n'\
-                   'left to right direction\n' \
-                   + f'\n{tables_code}\n' \
-                   + f'{communication_code}\n' \
-                   + f'remove @unlinked\n' \
-                     '@enduml'
-        return uml_code
-
-    def block_allocation_by_key(self, communication: dict, tabel_from: str) -> bool:
-        """
-        Affects the layout of tables.
-        Determines the location based on the number of relationships from a particular key.
-        """
-        data_about_communication = communication[tabel_from]
-        if len(data_about_communication) > 4:
-            if tabel_from not in self.construction_stage:
-                self.construction_stage[tabel_from] = 1
-                return True
+        # Long-lived PlantUML process (PlantUMLProcess). If not given, PlantUML is started for this diagram.
+        self.plantuml_process = plantuml_process
+        # Code of tables, it can be taken from the previous run (incremental rendering).
+        self.fragments = FragmentCache()
+        # If the model contains several schemas, tables of one schema are drawn in one package.
+        self.cluster = False
+
+    def table_code(self, table: Table) -> str:
+        """
+        Func returns the code of one table (class) of the diagram.
+        """
+        parts = [f'class {table.name} << (T, transparent) >>' + '{\n']
+        for column in table.columns:
+            # Primary and foreign keys are bold.
+            if column.name in table.primary_keys or column.name in table.key_columns:
+                parts.append(f'**{column.name}**\n')
             else:
-                self.construction_stage[tabel_from] += 1
-                # communication will do from right to left.
-                if len(data_about_communication) // 2 < self.construction_stage[tabel_from]:
-                    return False
-                # communication will do from left to right.
-                else:
-                    return True
+                parts.append(f'{column.name}\n')
+            parts.append('..\n')
+        if table.columns:
+            parts.pop()
+        parts.append(' \n}\n')
+        return ''.join(parts)
+
+    def tables_code(self, model: SchemaModel):
+        """
+        Func yields the code of every table (class) of the diagram.
+        With 'cluster' tables of every schema are put in a package.
+        """
+        if not (self.cluster and model.schemas()):
+            for table in model.tables.values():
+                yield self.fragments.get(table, self.table_code)
+            return
+        schemas = {}
+        for table in model.tables.values():
+            schemas.setdefault(table.schema, []).append(table)
+        for schema, tables in schemas.items():
+            yield f'package "{schema}" <<Rectangle>> {{\n'
+            for table in tables:
+                yield self.fragments.get(table, self.table_code)
+            yield '}\n'
+
+    def communication_code(self, model: SchemaModel, direction_default: str, analytics: GraphAnalytics):
+        """
+        Func yields the code of every link between tables. Repeated links are skipped by a set.
+        """
+        color_for_keys = self.link_color_selection(analytics)
+        # if direction_default = '2' is selected, then links are placed by links from the table only.
+        if direction_default == "2":
+            directions = analytics.directions_by_key(4)
         else:
-            return True
+            directions = analytics.directions(2, 3)
+        done_relations = set()
+
+        for link in analytics.links:
+            table_from, key_from_start, tabel_to, key_from_finish = link
+            color = color_for_keys[(table_from, key_from_start)]
+            if directions[link]:
+                relation = \
+                    f' {table_from}::{key_from_start} --{color}' \
+                    f' {tabel_to}::{key_from_finish}\n'
+            else:
+                relation = \
+                    f'{tabel_to}::{key_from_finish} --{color}' \
+                    f' {table_from}::{key_from_start}\n'
+            if relation not in done_relations:
+                done_relations.add(relation)
+                yield relation
 
-    def together_allocation(self, communication) -> str:
+    def constructor(self, model: SchemaModel, direction_default: str) -> str:
+        """
+        Func includes code development for plotting diagram.
+        model: schema model with tables, columns, primary and foreign keys.
+        The code is emitted in parts and joined once: time is O(tables + columns + links).
+        """
+        analytics = analyze(model, self.analytics)
+        parts = ['@startuml\n'
+                 '!define ClassFontName "Arial"\n\n'
+                 'hide circle\n'
+                 'left to right direction\n'
+                 '\n']
+        # Names of tables are 'schema.table', the dot must not make packages.
+        if model.schemas():
+            parts.append('set separator none\n\n')
+        parts.extend(self.tables_code(model))
+        parts.append('\n')
+        parts.extend(self.communication_code(model, direction_default, analytics))
+        parts.append('\nremove @unlinked\n'
+                     '@enduml')
+        return ''.join(parts)
+
+    def together_allocation(self, model: SchemaModel) -> str:
         """
         Can implement block grouping.
         """
+        analytics = analyze(model, self.analytics)
         code = '\n\ntogether {'
-        for tabel in communication.keys():
-            if self.numeric_of_conn[tabel] == 0:
-                code += f'\nclass {tabel}'
-        if code != '':
-            for tabel in communication.keys():
-                if self.numeric_of_conn[tabel] == max(self.numeric_of_conn.values()):
-                    code += f'\nclass {tabel}\n'
-            code += '}\n'
-            return code
+        for tabel in analytics.isolated():
+            code += f'\nclass {tabel}'
+        most = max(analytics.degree.values(), default=0)
+        for tabel, links in analytics.degree.items():
+            if links == most:
+                code += f'\nclass {tabel}\n'
+        code += '}\n'
+        return code
 
-    def block_allocation(self, tabel_from: str, tabel_to) -> bool:
-        """
-        Func decides on the order in which related blocks are placed.
-        Determines the location based on the number of relationships from specific table.
-        return: bool.
-        """
-        # Add stage of implemented link for tracking in next.
-        if tabel_from not in self.construction_stage or tabel_to not in self.construction_stage:
-            if tabel_from not in self.construction_stage and tabel_to not in self.construction_stage:
-                self.construction_stage[tabel_from] = 1
-                self.construction_stage[tabel_to] = 1
-            if tabel_from not in self.construction_stage:
-                self.construction_stage[tabel_from] = 1
-                self.construction_stage[tabel_to] += 1
-            if tabel_to not in self.construction_stage:
-                self.construction_stage[tabel_to] = 1
-                self.construction_stage[tabel_from] += 1
-        else:
-            self.construction_stage[tabel_from] += 1
-            self.construction_stage[tabel_to] += 1
-
-        # if 'tabel_from' have a lot of links
-        if self.numeric_of_conn[tabel_from] > 2 and self.numeric_of_conn[tabel_to] <= 3:
-
-            # communication will do from right to left.
-            if self.numeric_of_conn[tabel_from] // 2 < self.construction_stage[tabel_from]:
-                return False
-            # communication will do from left to right.
-            else:
-                return True
-
-            # if 'tabel_to' have a lot of links
-        elif self.numeric_of_conn[tabel_to] > 2:
-            # communication will do from right to left.
-            if self.numeric_of_conn[tabel_to] // 2 < self.construction_stage[tabel_to]:
-                return True
-            # communication will do from left to right.
-            else:
-                return False
-        else:
-            return True
-
-    def link_color_selection(self, communication) -> dict:
+    def link_color_selection(self, analytics: GraphAnalytics) -> dict:
         """
         Func selects the color for the link between two tables.
-        Each key has its own color.
-        At a certain scale, the colors of links can be repeated.
+        Each key has its own color, links of different keys on one table have different colors (bold version).
         :return: dict ((tabel, key): color).
         """
-        colors = {}
-        for tabel_from in communication:
-            connects = communication[tabel_from]
-            for tabel_info in connects:
-                tabel_to = list(tabel_info.keys())[0]
-                keys = tabel_info[tabel_to]
-                if (tabel_from, keys[0]) not in colors and (tabel_to, keys[1]) not in colors:
-                    color = self.colors_for_link[0]
-                    colors[(tabel_from, keys[0])] = color
-                    colors[(tabel_to, keys[1])] = color
-                    if len(self.colors_for_link) > 1:
-                        self.colors_for_link.remove(color)
-                elif (tabel_from, keys[0]) not in colors and (tabel_to, keys[1]) in colors:
-                    colors[(tabel_from, keys[0])] = colors[(tabel_to, keys[1])]
-                elif (tabel_from, keys[0]) in colors and (tabel_to, keys[1]) not in colors:
-                    colors[(tabel_to, keys[1])] = colors[(tabel_from, keys[0])]
-        return colors
+        numbers = analytics.link_colors()
+        colors = [f'[{color},bold]' for color in palette(max(numbers.values(), default=-1) + 1)]
+        return {key: colors[number] for key, number in numbers.items()}
 
-    def save_uml_code(self, uml_code: str, tables_structor) -> None:
+    def scale_uml_code(self, uml_code: str, model: SchemaModel) -> str:
         """
-        Func save uml-code in txt format.
+        Func adds scale to uml-code.
         scale: image quality index.
         Optimal scale: 2 (if more than 10 tables in db) or 3 (if less than 10 tables in db).
         """
-        if len(list(tables_structor.keys())) < 11:
+        if len(model) < 11:
             scale = 3
-        elif 21 > len(list(tables_structor.keys())) > 10:
+        elif 21 > len(model) > 10:
             scale = 2
         else:
             scale = 1
-        uml_code = uml_code.replace("@startuml", f"@startuml\nscale {scale}\n")
-        with open(f"{self.db_name}__{self.date_today}.txt", "w") as f:
-            f.write(uml_code)
+        return uml_code.replace("@startuml", f"@startuml\nscale {scale}\n")
+
+    def save_uml_code(self, uml_code: str, model: SchemaModel) -> None:
+        """
+        Func save uml-code in txt format.
+        """
+        with open(self.uml_file, "w") as f:
+            f.write(self.scale_uml_code(uml_code, model))
 
-    def build_diagram(self):
+    def build_diagram(self) -> bool:
         """
         Func is performing the construction of a diagram using PlantUML.
-        The diagram is saved with png format in 'diagram_folder'.
+        The diagram is saved in 'diagram_folder' in the selected format.
         """
-        if not os.path.exists('diagram_folder'):
-            os.makedirs('diagram_folder')
+        os.makedirs('diagram_folder', exist_ok=True)
 
-        subprocess.call(["java", "-jar", self.path_to_plantuml,
-                                 f"{self.db_name}__{self.date_today}.txt", f"-o{'diagram_folder'}", "-tpng"])
+        # PlantUML resolves '-o' relative to the source file, so the path must be absolute.
+        return_code = metrics.call(["java", "-jar", self.path_to_plantuml,
+                                       self.uml_file, f"-o{os.path.abspath('diagram_folder')}",
+                                       f"-t{self.image_format}"])
+        if return_code != 0:
+            print("Failed to start 'PlantUML'.")
+            return False
         if self.output_path:
             self.saver.save()
-
+        return True
+
+    def build_diagram_by_process(self, uml_code: str) -> bool:
+        """
+        Func builds the diagram by the long-lived PlantUML process, without files with uml-code.
+        The image is written straight to its destination.
+        """
+        if self.plantuml_process.image_format != self.image_format:
+            print(f"PlantUML process renders '{self.plantuml_process.image_format}', not '{self.image_format}'.")
+            return False
+        try:
+            image = self.plantuml_process.render(uml_code)
+        except (OSError, RuntimeError) as e:
+            print(f"Failed to start 'PlantUML': {e}")
+            return False
+        if not image:
+            print("Failed to start 'PlantUML'.")
+            return False
+        return self.saver.write(image)
 
     def delete_uml_code_file(self):
         """
         Func is delete file with uml-code.
         """
-        os.remove(f'./{self.db_name}__{self.date_today}.txt')
+        os.remove(self.uml_file)
 
-    def start_handler(
-            self, tables_structure: dict, foreign_keys_for_diagram_builder: dict,
-            keys_in_table: dict, primary_keys: dict, direction_default: str
-    ):
+    def start_handler(self, model: SchemaModel, direction_default: str) -> bool:
         """
         Start building a diagram based on data about the database.
         """
-        uml_code = self.constructor(
-            tables_structure, foreign_keys_for_diagram_builder, keys_in_table, primary_keys, direction_default
-        )
-        self.save_uml_code(uml_code, tables_structure)
-        self.build_diagram()
-        self.delete_uml_code_file()
-        print("Successfully launched 'PlantUMLBilder'.")
-
-
-
-
-
+        with metrics.stage('code plantuml'):
+            uml_code = self.constructor(model, direction_default)
+        metrics.code_size('plantuml', uml_code)
+        if self.plantuml_process:
+            answer = self.build_diagram_by_process(self.scale_uml_code(uml_code, model))
+        else:
+            self.save_uml_code(uml_code, model)
+            answer = self.build_diagram()
+            self.delete_uml_code_file()
+        if answer:
+            print("Successfully launched 'PlantUMLBilder'.")
+        return answer
@@ -0,0 +1,84 @@
+"""
+Cache of rendered diagrams.
+
+Images are stored on disk by a key made of the schema fingerprint, the engine and the options of rendering.
+If the schema has not changed, the diagram is taken from the cache instead of being built again.
+The size of the cache is limited, the least recently used images are removed first.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+class DiagramCache():
+    """
+    The class stores images in 'cache_dir'. The name of each file is the key of the image.
+    The time of the last use is kept as the modification time of the file.
+    """
+    def __init__(self, cache_dir: str, max_size: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(fingerprint: str, engine: str, options: dict) -> str:
+        """
+        Func makes the key of an image: (fingerprint, engine, options).
+        """
+        data = json.dumps([fingerprint, engine, options], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def get(self, key: str):
+        """
+        Func returns the cached image in bytes or None. The image is marked as recently used.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                image = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return image
+
+    def put(self, key: str, image: bytes):
+        """
+        Func saves the image. The file is written under a temporary name and renamed,
+        so other processes never read half of it.
+        """
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(image)
+        os.replace(temporary_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Func removes the least recently used images until the cache fits in 'max_size'.
+        """
+        with self.lock:
+            entries = []
+            total_size = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total_size -= size
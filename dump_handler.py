@@ -0,0 +1,506 @@
+"""
+Reading the structure of the database from a schema-only dump instead of the database.
+
+$ pg_dump --schema-only --file SCHEMA.sql DB_NAME
+
+SchemaDump reads the dump line by line, so the whole file is never kept in memory. Statements are split
+by ';' outside of strings, quoted names, dollar-quoted bodies of functions and comments, data of COPY is skipped.
+Only CREATE TABLE and ALTER TABLE are parsed: columns with their types, primary keys and foreign keys
+(in the table definition, in the column definition or added by ALTER TABLE ... ADD CONSTRAINT).
+DumpHandler returns the same models as PostgreSQL_handler, so every engine works with a dump.
+"""
+import hashlib
+import json
+import re
+from functools import lru_cache
+from postgres_handler import PostgreSQL_handler
+
+# Tokens which change the state of the splitter: dollar quotes, comments, quotes and the end of a statement.
+SPLITTER = re.compile(r"""\$[A-Za-z_]*\$|--|/\*|\*/|'|"|;""")
+TOKENS = re.compile(r"""[Ee]?'(?:[^']|'')*'|"(?:[^"]|"")*"|\$[A-Za-z_]*\$|[A-Za-z_][A-Za-z0-9_$]*|\d+|::|\S""")
+
+# Only these statements are tokenized, the rest of the dump is skipped.
+TABLE_STATEMENT = re.compile(r'(CREATE(?:\s+(?:GLOBAL|LOCAL|TEMPORARY|TEMP|UNLOGGED))*|ALTER)\s+TABLE\s', re.I)
+# Words which end the type in the definition of a column.
+COLUMN_CONSTRAINTS = {
+    'NOT', 'NULL', 'DEFAULT', 'CONSTRAINT', 'PRIMARY', 'REFERENCES', 'UNIQUE', 'CHECK', 'COLLATE', 'GENERATED',
+    'COMPRESSION', 'STORAGE'
+}
+BRACKETS = {'(', ')', '[', ']', ','}
+# A line of pg_dump with a plain column: 'name type[(modifiers)][[]] [NOT NULL],'. Other lines are tokenized.
+PLAIN_COLUMN = re.compile(
+    r' +([a-z_][a-z0-9_$]*) ([a-z_][a-z0-9_$. ]*[a-z0-9_$])(?:\([0-9,]+\))?((?:\[\])*)(?: NOT NULL)?,?'
+)
+# Types are written as format_type() of PostgreSQL shows them.
+TYPE_NAMES = {
+    'int': 'integer', 'int4': 'integer', 'serial': 'integer', 'serial4': 'integer',
+    'int2': 'smallint', 'smallserial': 'smallint', 'serial2': 'smallint',
+    'int8': 'bigint', 'bigserial': 'bigint', 'serial8': 'bigint',
+    'float4': 'real', 'float8': 'double precision', 'float': 'double precision',
+    'decimal': 'numeric', 'bool': 'boolean', 'varchar': 'character varying', 'char': 'character',
+    'bpchar': 'character', 'varbit': 'bit varying', 'timestamp': 'timestamp without time zone',
+    'timestamptz': 'timestamp with time zone', 'time': 'time without time zone', 'timetz': 'time with time zone'
+}
+
+
+def statements(lines):
+    """
+    Func yields statements of an SQL script without comments. 'lines' is any iterable of lines, for example a file.
+    """
+    buffer = []
+    # The token which closes the current string, quoted name, dollar quote or block comment.
+    closing = None
+    copy_data = False
+    for line in lines:
+        if copy_data:
+            if line.rstrip('\r\n') == '\\.':
+                copy_data = False
+            continue
+        start = 0
+        for match in SPLITTER.finditer(line):
+            token = match.group()
+            if closing is not None:
+                if token == closing:
+                    if closing == '*/':
+                        start = match.end()
+                    closing = None
+            elif token == '--':
+                buffer.append(line[start:match.start()] + '\n')
+                start = None
+                break
+            elif token == '/*':
+                buffer.append(line[start:match.start()])
+                closing = '*/'
+            elif token == ';':
+                buffer.append(line[start:match.end()])
+                start = match.end()
+                statement = ''.join(buffer).strip()
+                buffer = []
+                # Data of COPY ... FROM stdin follows the statement until the line '\.'.
+                if statement[:4].upper() == 'COPY' and statement.upper().endswith('FROM STDIN;'):
+                    copy_data = True
+                    break
+                if statement != ';':
+                    yield statement
+            elif token != '*/':
+                closing = token
+        if start is not None and closing != '*/' and not copy_data:
+            buffer.append(line[start:])
+    statement = ''.join(buffer).strip()
+    if statement:
+        yield statement
+
+
+def name_of(token: str) -> str:
+    """
+    Func returns the name written by the token: quoted names keep the case, other names are in lower case.
+    """
+    if token.startswith('"'):
+        return token[1:-1].replace('""', '"')
+    return token.lower()
+
+
+def split_by_commas(tokens: list) -> list:
+    """
+    Func splits tokens by commas which are not in parentheses.
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for index in [index for index, token in enumerate(tokens) if token in BRACKETS]:
+        token = tokens[index]
+        if token == ',':
+            if depth == 0:
+                if index > start:
+                    parts.append(tokens[start:index])
+                start = index + 1
+        elif token == '(' or token == '[':
+            depth += 1
+        else:
+            depth -= 1
+    if start < len(tokens):
+        parts.append(tokens[start:])
+    return parts
+
+
+def closing_parenthesis(tokens: list, index: int) -> int:
+    """
+    Func returns the index of the parenthesis which closes the one at 'index'.
+    """
+    depth = 0
+    for position in range(index, len(tokens)):
+        if tokens[position] == '(':
+            depth += 1
+        elif tokens[position] == ')':
+            depth -= 1
+            if depth == 0:
+                return position
+    return len(tokens)
+
+
+@lru_cache(maxsize=4096)
+def data_type(tokens: tuple) -> str:
+    """
+    Func returns the type of a column without modifiers: 'character varying(20)' is 'character varying'.
+    The same types are repeated in the whole dump, so results are cached.
+    """
+    words = []
+    depth = 0
+    array = ''
+    for token in tokens:
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth:
+            continue
+        elif token == '[':
+            array += '[]'
+        elif token not in (']', '.') and not token.isdigit():
+            words.append(name_of(token))
+    if len(words) > 1 and words[0] == 'pg_catalog':
+        words = words[1:]
+    elif len(words) == 2 and '.' in tokens:
+        # User type qualified by its schema.
+        return '.'.join(words) + array
+    name = ' '.join(words)
+    return TYPE_NAMES.get(name, name) + array
+
+
+class SchemaDump():
+    """
+    The class reads tables, primary keys and foreign keys of all schemas of a dump.
+    Data is kept in the same rows as the catalog queries of PostgreSQL_handler return
+    (see 'columns', 'primary_keys' and 'foreign_keys'). The file is read once, on the first request.
+    default_schema: schema of tables written without a schema (until SET search_path).
+    """
+    def __init__(self, path: str, default_schema: str = 'public'):
+        self.path = path
+        self.search_path = default_schema
+        self.parsed = False
+        # (schema, table): list of (column, type), in the order of the definition.
+        self.tables = {}
+        # (schema, table): list of parent tables (INHERITS, PARTITION OF).
+        self.parents = {}
+        self.keys = {}
+        # [schema, constraint, table, referenced schema, referenced table, columns, referenced columns]
+        self.references = []
+
+    def parse(self):
+        if self.parsed:
+            return
+        with open(self.path, encoding='utf-8', errors='replace') as f:
+            for statement in statements(f):
+                head = statement[:6].upper()
+                match = TABLE_STATEMENT.match(statement) if head in ('CREATE', 'ALTER ') else None
+                if match:
+                    if head == 'CREATE' and self.create_table_by_lines(statement, match):
+                        continue
+                    tokens = TOKENS.findall(statement)
+                    if head == 'CREATE':
+                        self.create_table(tokens, len(TOKENS.findall(match.group())))
+                    else:
+                        self.alter_table(tokens)
+                elif head == 'SET SE':
+                    self.set_search_path(statement)
+        self.inherit_columns()
+        self.parsed = True
+
+    def set_search_path(self, statement: str):
+        """
+        Func remembers the first schema of 'SET search_path = ...'.
+        New versions of pg_dump write names with schemas and clear the path, then the default schema is kept.
+        """
+        match = re.match(r"""SET\s+search_path\s*(?:=|TO)\s*("(?:[^"]|"")*"|[\w$]+)""", statement, re.I)
+        if match and match.group(1).lower() not in ('pg_catalog', 'default'):
+            self.search_path = name_of(match.group(1))
+
+    def qualified_name(self, tokens: list, index: int) -> tuple:
+        """
+        Func reads the name '[schema.]table' from 'index'. return: (schema, table), index after the name.
+        """
+        names = [name_of(tokens[index])]
+        index += 1
+        while index + 1 < len(tokens) and tokens[index] == '.':
+            names.append(name_of(tokens[index + 1]))
+            index += 2
+        if len(names) == 1:
+            return (self.search_path, names[0]), index
+        return (names[-2], names[-1]), index
+
+    @staticmethod
+    def column_list(tokens: list, index: int) -> tuple:
+        """
+        Func reads the list of columns '(a, b)' from 'index'. return: list of columns, index after the list.
+        """
+        if index >= len(tokens) or tokens[index] != '(':
+            return [], index
+        end = closing_parenthesis(tokens, index)
+        columns = [name_of(part[0]) for part in split_by_commas(tokens[index + 1:end])]
+        return columns, end + 1
+
+    def create_table(self, tokens: list, index: int):
+        upper = [token.upper() for token in tokens[index:index + 3]]
+        if upper == ['IF', 'NOT', 'EXISTS']:
+            index += 3
+        table, index = self.qualified_name(tokens, index)
+        if index + 1 < len(tokens) and [tokens[index].upper(), tokens[index + 1].upper()] == ['PARTITION', 'OF']:
+            # CREATE TABLE ... PARTITION OF parent: columns are the columns of the parent.
+            parent, index = self.qualified_name(tokens, index + 2)
+            self.parents[table] = [parent]
+        elif index >= len(tokens) or tokens[index] != '(':
+            # CREATE TABLE ... AS SELECT and typed tables are not supported.
+            return
+        self.tables[table] = []
+        if index < len(tokens) and tokens[index] == '(':
+            end = closing_parenthesis(tokens, index)
+            for element in split_by_commas(tokens[index + 1:end]):
+                self.table_element(table, element)
+            index = end + 1
+        if index < len(tokens) and tokens[index].upper() == 'INHERITS':
+            end = closing_parenthesis(tokens, index + 1)
+            parents = split_by_commas(tokens[index + 2:end])
+            self.parents[table] = [self.qualified_name(parent, 0)[0] for parent in parents]
+
+    def create_table_by_lines(self, statement: str, match) -> bool:
+        """
+        Func reads CREATE TABLE in the layout of pg_dump (one element per line) without tokenizing plain columns.
+        return: False if the statement has another layout, then it is read by 'create_table'.
+        """
+        lines = statement.split('\n')
+        if len(lines) < 3 or lines[-1] != ');' or not lines[0].endswith('('):
+            return False
+        header = TOKENS.findall(lines[0][match.end():])
+        if not header or header[0].upper() == 'IF':
+            return False
+        table, index = self.qualified_name(header, 0)
+        if index != len(header) - 1:
+            return False
+        columns = self.tables[table] = []
+        pending = []
+        for line in lines[1:-1]:
+            plain = None if pending else PLAIN_COLUMN.fullmatch(line)
+            if plain:
+                column, type_c, array = plain.groups()
+                columns.append((column, data_type((type_c, *array))))
+                continue
+            pending.append(line)
+            # An element ends with a comma outside of parentheses.
+            text = '\n'.join(pending)
+            if text.rstrip().endswith(',') and text.count('(') == text.count(')'):
+                for element in split_by_commas(TOKENS.findall(text)):
+                    self.table_element(table, element)
+                pending = []
+        for element in split_by_commas(TOKENS.findall('\n'.join(pending))):
+            self.table_element(table, element)
+        return True
+
+    def table_element(self, table: tuple, element: list):
+        """
+        Func reads one element of CREATE TABLE: a column or a constraint of the table.
+        """
+        keyword = element[0].upper()
+        if keyword in ('CONSTRAINT', 'PRIMARY', 'FOREIGN', 'UNIQUE', 'CHECK', 'EXCLUDE', 'LIKE'):
+            self.table_constraint(table, element)
+            return
+        column = name_of(element[0])
+        if len(element) == 2:
+            # The most common case: 'name type'.
+            self.tables[table].append((column, data_type((element[1],))))
+            return
+        index = 1
+        while index < len(element) and element[index].upper() not in COLUMN_CONSTRAINTS:
+            index += 1
+        self.tables[table].append((column, data_type(tuple(element[1:index]))))
+
+        # Constraints of the column, expressions in parentheses are skipped.
+        constraint = None
+        while index < len(element):
+            word = element[index].upper()
+            if element[index] == '(':
+                index = closing_parenthesis(element, index) + 1
+                continue
+            if word == 'CONSTRAINT' and index + 1 < len(element):
+                constraint = name_of(element[index + 1])
+                index += 2
+                continue
+            if word == 'REFERENCES' and index + 1 < len(element):
+                ref_table, index = self.qualified_name(element, index + 1)
+                ref_columns, index = self.column_list(element, index)
+                self.references.append([
+                    table[0], constraint or f'{table[1]}_{column}_fkey', table[1], *ref_table,
+                    [column], ref_columns or None
+                ])
+                constraint = None
+                continue
+            if word == 'PRIMARY':
+                self.keys[table] = [column]
+            if word in COLUMN_CONSTRAINTS:
+                # The name belongs to this constraint only.
+                constraint = None
+            index += 1
+
+    def table_constraint(self, table: tuple, element: list):
+        """
+        Func reads a constraint of the table: '[CONSTRAINT name] PRIMARY KEY (...)' or 'FOREIGN KEY (...) REFERENCES'.
+        """
+        name = None
+        index = 0
+        if element[0].upper() == 'CONSTRAINT':
+            name = name_of(element[1])
+            index = 2
+        keyword = element[index].upper() if index < len(element) else None
+        if keyword == 'PRIMARY':
+            columns, _ = self.column_list(element, index + 2)
+            if columns:
+                self.keys[table] = columns
+        elif keyword == 'FOREIGN':
+            columns, index = self.column_list(element, index + 2)
+            if index >= len(element) or element[index].upper() != 'REFERENCES':
+                return
+            ref_table, index = self.qualified_name(element, index + 1)
+            ref_columns, index = self.column_list(element, index)
+            self.references.append([
+                table[0], name or '_'.join([table[1], *columns, 'fkey']), table[1], *ref_table,
+                columns, ref_columns or None
+            ])
+
+    def alter_table(self, tokens: list):
+        """
+        Func reads 'ALTER TABLE [ONLY] [IF EXISTS] table ADD [CONSTRAINT name] ...' and 'ADD [COLUMN] ...'.
+        """
+        index = 2
+        while index < len(tokens) and tokens[index].upper() in ('ONLY', 'IF', 'EXISTS'):
+            index += 1
+        if index >= len(tokens):
+            return
+        table, index = self.qualified_name(tokens, index)
+        for action in split_by_commas(tokens[index:]):
+            if action[-1] == ';':
+                action = action[:-1]
+            if len(action) < 2 or action[0].upper() != 'ADD':
+                continue
+            action = action[1:]
+            if action[0].upper() in ('CONSTRAINT', 'PRIMARY', 'FOREIGN'):
+                self.table_constraint(table, action)
+            elif table in self.tables:
+                if action[0].upper() == 'COLUMN':
+                    action = action[1:]
+                if action and action[0].upper() == 'IF':
+                    action = action[3:]
+                if action:
+                    self.table_element(table, action)
+
+    def inherit_columns(self):
+        """
+        Func adds columns of parent tables to children (they come first, as in the catalog)
+        and resolves references without columns to the primary keys of the referenced tables.
+        """
+        done = set()
+
+        def resolve(table, path=()):
+            if table in done or table not in self.tables or table in path:
+                return self.tables.get(table, [])
+            inherited = []
+            for parent in self.parents.get(table, []):
+                inherited.extend(resolve(parent, path + (table,)))
+            own = self.tables[table]
+            names = {column for column, _ in inherited}
+            self.tables[table] = inherited + [column for column in own if column[0] not in names]
+            done.add(table)
+            return self.tables[table]
+
+        for table in list(self.tables):
+            resolve(table)
+        references = []
+        for reference in self.references:
+            if reference[6] is None:
+                reference[6] = self.keys.get((reference[3], reference[4]))
+            if reference[6] and len(reference[6]) == len(reference[5]):
+                references.append(reference)
+        self.references = references
+
+    def schemas(self) -> list:
+        self.parse()
+        return sorted({schema for schema, _ in self.tables})
+
+    def columns(self) -> list:
+        """
+        return: rows (schema, table, column, position, type) ordered by schema, table and position.
+        """
+        self.parse()
+        rows = []
+        for schema, table in sorted(self.tables):
+            columns = self.tables[(schema, table)]
+            if not columns:
+                rows.append((schema, table, None, None, None))
+            rows.extend(
+                (schema, table, column, position, type_c) for position, (column, type_c) in enumerate(columns, 1)
+            )
+        return rows
+
+    def primary_keys(self) -> list:
+        """
+        return: rows (schema, table, column) ordered by schema and table.
+        """
+        self.parse()
+        return [
+            (schema, table, column)
+            for schema, table in sorted(self.keys) if (schema, table) in self.tables
+            for column in self.keys[(schema, table)]
+        ]
+
+    def foreign_keys(self) -> list:
+        """
+        return: rows (schema, constraint, table, referenced schema, referenced table, columns, referenced columns).
+        """
+        self.parse()
+        return sorted(
+            (tuple(reference) for reference in self.references if (reference[0], reference[2]) in self.tables),
+            key=lambda row: (row[0], row[2], row[1])
+        )
+
+
+class DumpHandler(PostgreSQL_handler):
+    """
+    The class gets the structure of the schemas from a schema-only dump (SchemaDump). The database is not used.
+    Schema patterns, several schemas and focus work as in PostgreSQL_handler.
+    dump: already read SchemaDump of the file, it is shared by handlers instead of reading the file again.
+    """
+    def __init__(self, path: str, schema_name, focus=None, depth=1, dump: SchemaDump = None):
+        super().__init__(
+            None, None, None, None, None, schema_name, connection=dump or SchemaDump(path), focus=focus, depth=depth
+        )
+        self.dump = self.conn
+
+    def get_schema_list(self) -> list:
+        return self.dump.schemas()
+
+    def is_read(self, schema: str, table: str) -> bool:
+        return schema in self.schemas and (self.selected is None or f'{schema}.{table}' in self.selected)
+
+    def catalog_columns(self) -> list:
+        return [row for row in self.dump.columns() if self.is_read(row[0], row[1])]
+
+    def catalog_primary_keys(self) -> list:
+        return [row for row in self.dump.primary_keys() if self.is_read(row[0], row[1])]
+
+    def catalog_foreign_keys(self) -> list:
+        return [row for row in self.dump.foreign_keys() if row[0] in self.schemas and row[3] in self.schemas]
+
+    def get_fingerprints(self) -> dict:
+        """
+        Func computes a fingerprint of every selected schema: md5 of its tables, columns and keys in the dump.
+        Comments, formatting and other objects of the dump do not change it.
+        """
+        if not self.check_schema_names():
+            return {}
+        rows = {}
+        for row in self.dump.columns() + self.dump.primary_keys():
+            rows.setdefault(row[0], []).append(row)
+        for row in self.dump.foreign_keys():
+            rows.setdefault(row[0], []).append(row)
+        return {
+            schema: hashlib.md5(json.dumps(rows[schema]).encode('utf-8')).hexdigest()
+            for schema in self.schemas if schema in rows
+        }
@@ -0,0 +1,211 @@
+"""
+Analytics of the graph of foreign keys.
+
+Every engine needs the same facts about the graph: the number of links of every table, hubs, connected components,
+the direction in which every link is drawn and its color. They are computed here once per model,
+in O(tables + links), and shared by all engines of a run instead of being counted again by every renderer.
+"""
+import colorsys
+from collections import deque
+from schema_model import SchemaModel
+from metrics import metrics
+
+
+# Basic colors of links, further colors are generated by 'palette'.
+LINK_COLORS = [
+    '#f51505', '#877951', '#0057f7', '#21a105', '#eb8b05', '#d005eb',
+    '#b80263', '#0091a1', '#00a173', '#7815cf', '#afb500', '#cf6967'
+]
+
+
+def palette(number: int) -> list:
+    """
+    Func returns 'number' colors of links: basic colors first, then colors with hues taken by the golden ratio,
+    so that every new color is far from the previous ones. Colors are dark enough for lines on white.
+    """
+    colors = LINK_COLORS[:number]
+    hue = 0.0
+    while len(colors) < number:
+        hue = (hue + 0.618033988749895) % 1
+        level = len(colors) // len(LINK_COLORS) % 3
+        red, green, blue = colorsys.hsv_to_rgb(hue, 0.9 - 0.15 * level, 0.85 - 0.15 * level)
+        colors.append(f'#{round(red * 255):02x}{round(green * 255):02x}{round(blue * 255):02x}')
+    return colors
+
+
+def neighbors(model: SchemaModel, name: str):
+    """
+    Func yields tables linked with the table by foreign keys, one time per key.
+    """
+    table = model.tables[name]
+    for foreign_key in table.outgoing:
+        yield foreign_key.ref_table
+    for foreign_key in table.incoming:
+        yield foreign_key.table
+
+
+def components(model: SchemaModel) -> list:
+    """
+    Func finds connected components of the graph of foreign keys (breadth-first search).
+    return: list of lists of tables.
+    """
+    seen = set()
+    found = []
+    for name in model.tables:
+        if name in seen:
+            continue
+        seen.add(name)
+        component = [name]
+        queue = deque([name])
+        while queue:
+            for neighbor in neighbors(model, queue.popleft()):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    component.append(neighbor)
+                    queue.append(neighbor)
+        found.append(component)
+    return found
+
+
+class GraphAnalytics():
+    """
+    The class keeps analytics of the graph of one model.
+    'links' are links (table, column, referenced table, referenced column) without repeats, in the order of the model.
+    'degree' is the number of these links of every table, 'links_out' the number of these links from it.
+    'components' are connected components, see 'components'.
+    """
+    def __init__(self, model: SchemaModel):
+        with metrics.stage('graph analytics', tables=len(model)):
+            self.model = model
+            self.links = list(dict.fromkeys(model.links()))
+            # Degrees are counted by links without repeats, as they are drawn.
+            self.degree = dict.fromkeys(model.tables, 0)
+            self.links_out = dict.fromkeys(model.tables, 0)
+            for table_from, _, table_to, _ in self.links:
+                self.links_out[table_from] += 1
+                self.degree[table_from] += 1
+                self.degree[table_to] += 1
+            self.components = components(model)
+            # Directions are computed for every rule once: (hub, limit): {link: direction}.
+            self.decisions = {}
+            self.colors = None
+
+    def isolated(self) -> list:
+        """
+        return: tables without links.
+        """
+        return [name for name, degree in self.degree.items() if degree == 0]
+
+    def hubs(self, hub: int = 4) -> list:
+        """
+        return: tables with more than 'hub' links, in the order of the model.
+        """
+        return [name for name, degree in self.degree.items() if degree > hub]
+
+    def hub(self, names) -> str:
+        """
+        Func returns the table with the most links among 'names'.
+        """
+        return max(names, key=self.degree.get)
+
+    def directions(self, hub: int = 4, limit: int = 4) -> dict:
+        """
+        Func decides on the order in which linked tables are placed.
+        Links of a hub (a table with more than 'hub' links) are split: the first half of its links goes
+        from left to right, the rest from right to left, so linked tables are put on both sides of the hub.
+        If both tables are hubs ('table_to' has more than 'limit' links), 'table_to' decides.
+        return: dict (link: True if the link goes from left to right).
+        """
+        if (hub, limit) in self.decisions:
+            return self.decisions[(hub, limit)]
+        # Number of links of the table met so far, including the current one.
+        stage = dict.fromkeys(self.degree, 0)
+        decisions = {}
+        for link in self.links:
+            table_from, table_to = link[0], link[2]
+            stage[table_from] += 1
+            stage[table_to] += 1
+            degree_from, degree_to = self.degree[table_from], self.degree[table_to]
+            if degree_from > hub and degree_to <= limit:
+                decisions[link] = degree_from // 2 >= stage[table_from]
+            elif degree_to > hub:
+                decisions[link] = degree_to // 2 < stage[table_to]
+            else:
+                decisions[link] = True
+        self.decisions[(hub, limit)] = decisions
+        return decisions
+
+    def directions_by_key(self, hub: int = 4) -> dict:
+        """
+        Func decides on the direction by links from the table only: the first half of the links from a table
+        with more than 'hub' links goes from left to right, the rest from right to left.
+        return: dict (link: True if the link goes from left to right).
+        """
+        if ('key', hub) in self.decisions:
+            return self.decisions[('key', hub)]
+        stage = dict.fromkeys(self.degree, 0)
+        decisions = {}
+        for link in self.links:
+            table_from = link[0]
+            stage[table_from] += 1
+            decisions[link] = self.links_out[table_from] <= hub or self.links_out[table_from] // 2 >= stage[table_from]
+        self.decisions[('key', hub)] = decisions
+        return decisions
+
+    def link_colors(self) -> dict:
+        """
+        Func colors links by keys. A key and the keys linked with it make a group, all links of the group
+        have one color. Groups are colored greedily in the order of links: a group gets the first color
+        which is not used by other groups on its tables, so links of different keys on one table always differ.
+        Groups are found by union-find. Every table keeps its first free color, so a group starts the search
+        from the largest of them, and colors of a busy table are not checked again for every new group.
+        return: dict ((table, column): number of the color in 'palette').
+        """
+        if self.colors is not None:
+            return self.colors
+        parent = {}
+
+        def find(key):
+            root = parent.setdefault(key, key)
+            while parent[root] != root:
+                root = parent[root]
+            while parent[key] != root:
+                parent[key], key = root, parent[key]
+            return root
+
+        for table_from, key_from, table_to, key_to in self.links:
+            root_from, root_to = find((table_from, key_from)), find((table_to, key_to))
+            if root_from != root_to:
+                parent[root_to] = root_from
+        # Tables of every group, groups in the order of their first link.
+        groups = {}
+        for table_from, key_from, table_to, _ in self.links:
+            groups.setdefault(find((table_from, key_from)), {}).update({table_from: None, table_to: None})
+        # Colors used on every table and the first color which is free on it.
+        used = {}
+        free = {}
+        group_colors = {}
+        for root, tables in groups.items():
+            # Colors below the first free color of any table of the group are taken, they are not checked.
+            color = max(free.get(table, 0) for table in tables)
+            while any(color in used.get(table, ()) for table in tables):
+                color += 1
+            group_colors[root] = color
+            for table in tables:
+                colors = used.setdefault(table, set())
+                colors.add(color)
+                first = free.get(table, 0)
+                while first in colors:
+                    first += 1
+                free[table] = first
+        self.colors = {key: group_colors[find(key)] for key in parent}
+        return self.colors
+
+
+def analyze(model: SchemaModel, analytics: GraphAnalytics = None) -> GraphAnalytics:
+    """
+    Func returns 'analytics' if it was made for this model, otherwise analyzes the model.
+    """
+    if analytics is not None and analytics.model is model:
+        return analytics
+    return GraphAnalytics(model)
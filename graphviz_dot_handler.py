@@ -1,11 +1,31 @@
 """
 This way generates a diagram using Graphviz-only.
-The file is constructed in DOT format and transferred to Graphviz.
+The DOT-code is passed to Graphviz through stdin, the image is read back from stdout
+and written straight to its destination. Nothing else is saved on disk.
+
+For incremental rendering the positions of tables computed by 'dot' are kept. If the schema has changed a little,
+known tables are pinned to their previous positions, new tables are placed next to them,
+and the image is made by 'neato -n2', which only routes the links instead of laying out the whole graph.
+
+The time of layout by 'dot' grows faster than the size of the graph. If the schema consists of several
+connected components, they are laid out by separate 'dot' processes at the same time, packed into one graph
+by 'gvpack' and drawn by 'neato -n2' (the same way as 'ccomps | dot | gvpack | neato -n2' does).
+
+With a layout cache (LayoutCache) the computed layout is saved with routes of links. The same graph is drawn
+again in any format without layout: tables and links get their positions, 'neato -n2' only writes the image.
 """
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import json
 import os
+import re
 import subprocess
 from saver import Saver
+from schema_model import SchemaModel, Table
+from incremental import FragmentCache
+from layout_cache import layout_key, table_signature
+from graph_analytics import GraphAnalytics, analyze, palette
+from metrics import metrics
 
 
 class Graphviz_handler():
@@ -13,181 +33,386 @@ class Graphviz_handler():
     The class performs the construction of the diagram by Graphviz.
     It builds DOT-code with which contains the markup for the diagram.
     """
-    def __init__(self, db_name: str, output_path: str):
+    def __init__(self, db_name: str, output_path: str, work_dir: str = '.', image_format: str = 'png'):
         self.name_db = db_name
         self.date_today = datetime.now().date().strftime('%Y-%m-%d')
-        self.construction_stage = {}
-        self.numeric_of_conn = {}
+        # Analytics of the graph (GraphAnalytics) shared by all engines, made here if not given.
+        self.analytics = None
         self.output_path = output_path
-        self.img_name = f'{self.name_db}_{self.date_today}.png'
+        # Folder for temporary files, the same as other renderers have. Graphviz does not need them.
+        self.work_dir = work_dir
+        # 'png', 'svg' or 'pdf'. Vector formats are produced by Graphviz without rasterization.
+        self.image_format = image_format
+        self.img_name = f'{self.name_db}_{self.date_today}.{self.image_format}'
         self.saver = Saver(self.output_path, self.img_name)
+        # Code of tables, it can be taken from the previous run (incremental rendering).
+        self.fragments = FragmentCache()
+        # Positions of tables from the previous run (table: [x, y] in points) and positions of this run.
+        self.positions = {}
+        self.layout = {}
+        # If True, positions computed by 'dot' are read back, so the next run can reuse them.
+        self.keep_layout = False
+        self.layout_file = os.path.join(self.work_dir, 'layout.json')
+        # Routes of links ((table, column, table, column): route) and frames of schemas (frame: bounding box)
+        # which are still valid for the pinned positions.
+        self.edge_layout = {}
+        self.cluster_layout = {}
+        # Layouts are saved in 'layout_cache' and the last one is also saved by 'layout_name'.
+        self.layout_cache = None
+        self.layout_name = None
+        # If more than this share of tables is new, the whole schema is laid out again.
+        self.relayout_ratio = 0.2
+        # Components are laid out separately and packed. Components smaller than 'pack_batch' tables
+        # are laid out together, by 'jobs' processes at the same time (by default one per CPU).
+        self.pack = True
+        self.pack_batch = 50
+        self.jobs = None
+        # If the model contains several schemas, tables of one schema are drawn in one frame.
+        self.cluster = False
+        # Links are colored by keys, as PlantUML does (GraphAnalytics.link_colors). Colors do not change the layout.
+        self.link_colors = True
 
-    def dot_constructor(
-            self, tables_structure: dict, foreign_keys_for_diagram_builder: dict,
-            primary_keys: dict
-    ) -> str:
+    def dot_constructor(self, model: SchemaModel, analytics: GraphAnalytics = None) -> str:
         """
         This is where the DOT-code is assembled.
+        The code is emitted in parts and joined once: time is O(tables + columns + links).
+        analytics: analytics of the whole schema, if the model is a group of its connected components.
         """
-        self.calculate_number_of_links(foreign_keys_for_diagram_builder)
-        dot_code = 'digraph G { \n' \
-        'node[shape = none, margin = 0]\n' \
-        'edge[arrowtail = none]\n'
-        dot_code += self.dot_tables(tables_structure, primary_keys)
-        dot_code += self.dot_links(foreign_keys_for_diagram_builder)
-        dot_code += '\n}'
-        return dot_code
+        analytics = analytics or analyze(model, self.analytics)
+        self.layout = self.pinned_positions(model)
+        parts = ['digraph G { \n'
+                 'node[shape = none, margin = 0]\n'
+                 'edge[arrowtail = none]\n']
+        parts.extend(self.dot_tables(model))
+        if self.layout:
+            parts.extend(self.dot_positions(model))
+        parts.extend(self.dot_links(model, analytics))
+        parts.append('\n}')
+        return ''.join(parts)
 
+    @staticmethod
+    def node_id(name: str) -> str:
+        """
+        Func returns the name of the node of a table. Names like 'schema.table' are quoted.
+        """
+        node = name.title()
+        if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', node):
+            return node
+        return '"' + node.replace('"', '\\"') + '"'
 
-    def dot_links(self, foreign_keys_for_diagram_builder: dict) -> str:
+    def dot_links(self, model: SchemaModel, analytics: GraphAnalytics):
         """
         This is where links between tables are established.
+        Func yields the code of every link, repeated links are skipped by a set.
+        If the model is a group of connected components, it has all links of its tables,
+        so directions decided for the whole schema are used.
         """
-        links_code = 'rankdir=LR;\n'
-        for table_from in foreign_keys_for_diagram_builder.keys():
-            for conn_info in foreign_keys_for_diagram_builder[table_from]:
-                tabel_to = list(conn_info.keys())[0]
-                key_from = conn_info[tabel_to][0]
-                key_to = conn_info[tabel_to][1]
-                dir = self.block_allocation(table_from, tabel_to)
-                if dir:
-                    conn_code = f"{table_from.title()}:{key_from} -> {tabel_to.title()}:{key_to} [dir=none];\n"
-                else:
-                    conn_code = f"{tabel_to.title()}:{key_to} -> {table_from.title()}:{key_from} [dir=none];\n"
-                if conn_code not in links_code:
-                    links_code += conn_code
-        return links_code
-
-    def dot_tables(self, tables_structure: dict, primary_keys: dict) -> str:
+        yield 'rankdir=LR;\n'
+        directions = analytics.directions(4, 4)
+        links = analytics.links if analytics.model is model else dict.fromkeys(model.links())
+        colors = []
+        if self.link_colors:
+            numbers = analytics.link_colors()
+            colors = palette(max(numbers.values(), default=-1) + 1)
+        done_links = set()
+        for link in links:
+            table_from, key_from, tabel_to, key_to = link
+            attributes = 'dir=none'
+            if colors:
+                attributes += f', color="{colors[numbers[(table_from, key_from)]]}"'
+            if not directions[link]:
+                table_from, key_from, tabel_to, key_to = tabel_to, key_to, table_from, key_from
+            route = self.edge_layout.get((table_from, key_from, tabel_to, key_to)) if self.layout else None
+            if route:
+                attributes += f', pos="{route}"'
+            conn_code = f"{self.node_id(table_from)}:{key_from} -> {self.node_id(tabel_to)}:{key_to} [{attributes}];\n"
+            if conn_code not in done_links:
+                done_links.add(conn_code)
+                yield conn_code
+
+    def table_code(self, table: Table) -> str:
+        """
+        This is where markup for one table is created.
+        """
+        parts = [f'{self.node_id(table.name)} [label=< \n'
+                 '<table border="0" cellborder="1" cellspacing="0" cellpadding="4"> \n'
+                 f'<tr><td bgcolor="lightblue">{table.name.title()}</td></tr> \n']
+        for column in table.columns:
+            # primary keys is bold.
+            if column.name in table.primary_keys:
+                parts.append(f'<tr><td align="left" port="{column.name}"><b>{column.name}</b></td></tr>\n')
+            else:
+                parts.append(f'<tr><td align="left" port="{column.name}">{column.name}</td></tr>\n')
+        parts.append('</table>\n>]\n\n')
+        return ''.join(parts)
+
+    def dot_tables(self, model: SchemaModel):
         """
         This is where markup for tables is created.
+        Func yields the code of every table. With 'cluster' tables of every schema are put in a frame.
         """
-        code_for_all_tabels = ""
-        for table in tables_structure.keys():
-            code = f'{table.title()} [label=< \n' \
-            '<table border="0" cellborder="1" cellspacing="0" cellpadding="4"> \n' \
-            f'<tr><td bgcolor="lightblue">{table.title()}</td></tr> \n'
-            rows = ''
-            columns = tables_structure[table]
-            for column in columns:
-                # primary keys is bold.
-                if column in primary_keys[table]:
-                    rows += f'<tr><td align="left" port="{column}"><b>{column}</b></td></tr>\n'
-                else:
-                    rows += f'<tr><td align="left" port="{column}">{column}</td></tr>\n'
-            rows += '</table>\n>]\n\n'
-            code += rows
-            code_for_all_tabels += code
-
-        return code_for_all_tabels
-
-    def linear_position_distribution(self, tables_structure: dict) -> str:
-        if len(tables_structure.keys()) < 10:
+        if not (self.cluster and model.schemas()):
+            for table in model.tables.values():
+                yield self.fragments.get(table, self.table_code)
+            return
+        schemas = {}
+        for table in model.tables.values():
+            schemas.setdefault(table.schema, []).append(table)
+        for index, (schema, tables) in enumerate(schemas.items()):
+            yield f'subgraph cluster_{index} {{\nlabel="{schema}";\nstyle=rounded;\n'
+            if self.layout and f'cluster_{index}' in self.cluster_layout:
+                yield f'bb="{self.cluster_layout[f"cluster_{index}"]}";\n'
+            for table in tables:
+                yield self.fragments.get(table, self.table_code)
+            yield '}\n'
+
+    def pinned_positions(self, model: SchemaModel) -> dict:
+        """
+        Func returns positions of all tables for rendering without layout, or an empty dict,
+        if there are no previous positions or too many tables are new.
+        Tables keep their previous positions, new tables are put in a column to the right of the diagram.
+        """
+        if not self.positions:
+            return {}
+        new_tables = [table for table in model.tables.values() if table.name not in self.positions]
+        if len(new_tables) > len(model) * self.relayout_ratio:
+            return {}
+        positions = {name: self.positions[name] for name in model.tables if name in self.positions}
+        if not positions:
+            return {}
+        x = max(x for x, _ in positions.values()) + 300
+        y = max(y for _, y in positions.values())
+        for table in new_tables:
+            # Height of a row of the table is about 24 points.
+            height = 24 * (len(table.columns) + 1)
+            positions[table.name] = [x, y - height / 2]
+            y -= height + 40
+        return positions
+
+    def dot_positions(self, model: SchemaModel):
+        """
+        Func yields positions of tables for 'neato -n2'.
+        """
+        yield 'splines=true;\n'
+        for table in model.tables:
+            x, y = self.layout[table]
+            yield f'{self.node_id(table)} [pos="{x:.2f},{y:.2f}"];\n'
+
+    def read_layout(self, model: SchemaModel) -> dict:
+        """
+        Func reads the layout computed by Graphviz (json0 format, positions in points).
+        return: dict with 'nodes' (table: [x, y]), 'edges' (list of [table, column, table, column, route]),
+        'clusters' (frame: bounding box) and 'signatures' (table: signature), or an empty dict.
+        """
+        names = {name.title(): name for name in model.tables}
+        try:
+            with open(self.layout_file) as f:
+                data = json.load(f)
+            nodes = {}
+            clusters = {}
+            ids = {}
+            for item in data.get('objects', []):
+                if item.get('name', '').startswith('cluster') and 'bb' in item:
+                    clusters[item['name']] = item['bb']
+                elif item.get('name') in names and 'pos' in item:
+                    ids[item['_gvid']] = names[item['name']]
+                    x, y = item['pos'].split(',')[:2]
+                    nodes[names[item['name']]] = [float(x), float(y)]
+            edges = [
+                [ids[edge['tail']], edge.get('tailport', ''), ids[edge['head']], edge.get('headport', ''), edge['pos']]
+                for edge in data.get('edges', [])
+                if edge.get('tail') in ids and edge.get('head') in ids and 'pos' in edge
+            ]
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+        return {
+            'nodes': nodes, 'edges': edges, 'clusters': clusters,
+            'signatures': {name: table_signature(model.tables[name]) for name in nodes}
+        }
+
+    def cached_layout(self, model: SchemaModel) -> tuple:
+        """
+        Func takes the layout from the layout cache. If the same graph was laid out before, positions of tables,
+        routes of links and frames are used as they are. Otherwise the last layout of the diagram is used
+        for tables (if there are no positions yet) and for links between tables which have not changed.
+        return: key of the layout of the model and True if the layout of this graph was found.
+        """
+        key = layout_key(model, {'cluster': bool(self.cluster and model.schemas())})
+        layout = self.layout_cache.get(key)
+        exact = layout is not None
+        if not exact:
+            layout = self.layout_cache.latest(self.layout_name) if self.layout_name else None
+        if not layout or not (exact or not self.positions):
+            return key, False
+        self.positions = layout['nodes']
+        signatures = layout.get('signatures', {})
+        unchanged = {name for name, table in model.tables.items() if signatures.get(name) == table_signature(table)}
+        self.edge_layout = {
+            (table_from, key_from, table_to, key_to): route
+            for table_from, key_from, table_to, key_to, route in layout.get('edges', [])
+            if table_from in unchanged and table_to in unchanged
+        }
+        self.cluster_layout = layout.get('clusters', {}) if exact else {}
+        return key, exact
+
+    def linear_position_distribution(self, model: SchemaModel) -> str:
+        if len(model) < 10:
             coef = 3
-        elif 16 >= len(tables_structure.keys()) >= 10:
+        elif 16 >= len(model) >= 10:
             coef = 4
         else:
             coef = 5
-        code = ''
-        code_for_row = '{ rank = same; '
-        cnt = 1
-        for table in tables_structure.keys():
-            cnt += 1
-            code_for_row += f'"{table.title()}"; '
-            if cnt == coef:
-                code_for_row += '}\n'
-                code += code_for_row
-                code_for_row = '{ rank = same; '
-                cnt = 1
-        return code
-
-    def block_allocation(self, table_from: str, tabel_to) -> bool:
-        """
-        Func decides on the order in which related blocks are placed.
-        return: bool.
-        """
-        if table_from not in self.construction_stage or tabel_to not in self.construction_stage:
-            if table_from not in self.construction_stage and tabel_to not in self.construction_stage:
-                self.construction_stage[table_from] = 1
-                self.construction_stage[tabel_to] = 1
-            if table_from not in self.construction_stage:
-                self.construction_stage[table_from] = 1
-                self.construction_stage[tabel_to] += 1
-            if tabel_to not in self.construction_stage:
-                self.construction_stage[tabel_to] = 1
-                self.construction_stage[table_from] += 1
-        else:
-            self.construction_stage[table_from] += 1
-            self.construction_stage[tabel_to] += 1
-        # если table_from многосвязный
-        if self.numeric_of_conn[table_from] > 4 and self.numeric_of_conn[tabel_to] <= 4:
-
-            # communication will do from right to left.
-            if self.numeric_of_conn[table_from] // 2 < self.construction_stage[table_from]:
-                return False
-            # communication will do from left to right.
-            else:
-                return True
+        parts = []
+        row = []
+        for table in model.tables:
+            row.append(f'"{table.title()}"; ')
+            if len(row) + 1 == coef:
+                parts.append('{ rank = same; ' + ''.join(row) + '}\n')
+                row = []
+        return ''.join(parts)
 
-    def save_dot(self, dot_code: str):
+    def component_groups(self, analytics: GraphAnalytics) -> list:
         """
-        This is where the markup is saved in DOT-format.
+        Func groups connected components for separate layout, the largest first.
+        Small components are put together, so there is no process per table.
         """
-        with open(r"demo.dot", "w") as f:
-            f.write(dot_code)
+        groups = []
+        small = []
+        for component in sorted(analytics.components, key=len, reverse=True):
+            if len(component) >= self.pack_batch:
+                groups.append(component)
+                continue
+            if len(small) + len(component) > self.pack_batch:
+                groups.append(small)
+                small = []
+            small.extend(component)
+        if small:
+            groups.append(small)
+        return groups
 
-    def diagram_bilder(self):
+    def layout_code(self, dot_code: str) -> bytes:
         """
-        Diagram in progress by Graphviz.
+        Func lays out one graph by 'dot'. return: DOT-code with positions.
         """
-        if not os.path.exists('diagram_folder'):
-            os.makedirs('diagram_folder')
+        result = metrics.run(
+            ['dot', '-Tdot'], input=dot_code.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip())
+        return result.stdout
 
-        cmd = [
-            'dot', 
-            '-Tpng', 
-            'demo.dot', 
-            '-o', 
-            os.path.join("./diagram_folder", f'{self.name_db}_{self.date_today}.png')
-        ]
+    def packed_layout(self, model: SchemaModel):
+        """
+        Func lays out connected components at the same time and packs them into one graph by 'gvpack'.
+        return: DOT-code with positions of all tables, or None if the schema has one component
+        or the layout failed (then the whole schema is laid out by 'dot').
+        """
+        analytics = analyze(model, self.analytics)
+        groups = self.component_groups(analytics)
+        if len(groups) < 2:
+            return None
+        with metrics.stage('code dot-r', components=len(groups)):
+            codes = [self.dot_constructor(model.subgraph(group), analytics) for group in groups]
+        metrics.code_size('dot-r', ''.join(codes))
+        try:
+            with metrics.stage('layout components', components=len(groups)):
+                with ThreadPoolExecutor(max_workers=self.jobs or os.cpu_count()) as pool:
+                    laid_out = list(pool.map(self.layout_code, codes))
+            result = metrics.run(
+                ['gvpack'], input=b'\n'.join(laid_out), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except (OSError, RuntimeError) as e:
+            print(f"Failed to lay out components separately, the whole schema is laid out. {e}")
+            return None
+        if result.returncode != 0 or not result.stdout:
+            print(f"Failed to pack components, the whole schema is laid out. "
+                  f"{result.stderr.decode('utf-8', 'replace').strip()}")
+            return None
+        return result.stdout.decode('utf-8')
 
+    def diagram_bilder(self, dot_code: str, laid_out: bool = False) -> bool:
+        """
+        Diagram in progress by Graphviz.
+        laid_out: the code already has positions of tables (packed components).
+        """
+        if self.layout or laid_out:
+            # Positions are known, the layout is not computed.
+            command = ['neato', '-n2', f'-T{self.image_format}']
+        else:
+            command = ['dot', f'-T{self.image_format}']
+        if self.keep_layout:
+            # The first output (the layout) goes to the file, the image goes to stdout.
+            command[-1:-1] = ['-Tjson0', f'-o{self.layout_file}']
         try:
-            subprocess.run(cmd, check=True)
-        except:
+            result = metrics.run(
+                command, input=dot_code.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except OSError:
             print("Failed to start 'dot-renderer'.")
-        else:
-            if self.output_path:
-                self.saver.save()
-                print("Successfully launched 'dot-renderer'.")
-            else:
-                print("Successfully launched 'dot-renderer'.")
+            return False
 
-    def delete_dot(self):
-        os.remove(r'demo.dot')
+        if result.returncode != 0 or not result.stdout:
+            print(f"Failed to start 'dot-renderer'. {result.stderr.decode('utf-8', 'replace').strip()}")
+            return False
+        if not self.saver.write(result.stdout):
+            return False
+        print("Successfully launched 'dot-renderer'.")
+        return True
 
-    def calculate_number_of_links(self, communication):
+    def overview_constructor(self, partition) -> str:
         """
-        Here the number of links in each table is calculated.
+        Func creates DOT-code of the overview of a split schema (SchemaPartition):
+        one block per part and one link per pair of linked parts, its width shows the number of foreign keys.
         """
-        for t_f in list(communication.keys()):
-            self.numeric_of_conn[t_f] = len(communication[t_f])
+        parts = ['graph G { \n'
+                 'node[shape = box, style = filled, fillcolor = lightblue]\n']
+        for index, tables in enumerate(partition.parts):
+            parts.append(
+                f'part{index + 1} [label="Part {index + 1}\\n{len(tables)} tables\\n{partition.hub(index)}"];\n'
+            )
+        for (part_from, part_to), number in partition.cross_links().items():
+            parts.append(
+                f'part{part_from + 1} -- part{part_to + 1} '
+                f'[label="{number}", penwidth={1 + min(number, 20) / 4:.2f}];\n'
+            )
+        parts.append('}')
+        return ''.join(parts)
 
-        for t_f in list(communication.keys()):
-            if communication[t_f] != []:
-                for conn in communication[t_f]:
-                    self.numeric_of_conn[list(conn.keys())[0]] += 1
+    def start_overview(self, partition) -> bool:
+        """
+        Builds the overview diagram of a split schema.
+        """
+        return self.diagram_bilder(self.overview_constructor(partition))
 
-    def start_handler(
-            self, tables_structure: dict, foreign_keys_for_diagram_builder: dict,
-            primary_keys
-    ):
+    def start_handler(self, model: SchemaModel) -> bool:
         """
         Calls functions for rendering the diagram.
         """
-        dot_code = self.dot_constructor(
-            tables_structure, foreign_keys_for_diagram_builder, primary_keys
-        )
-        self.save_dot(dot_code)
-        self.diagram_bilder()
-        self.delete_dot()
+        self.analytics = analyze(model, self.analytics)
+        key, exact = self.cached_layout(model) if self.layout_cache else (None, False)
+        if key and not exact:
+            self.keep_layout = True
+        packed = None
+        # Frames of schemas contain tables of different components, so they are laid out together.
+        if self.pack and not (self.cluster and model.schemas()) and not self.pinned_positions(model):
+            packed = self.packed_layout(model)
+        if packed:
+            self.layout = {}
+            answer = self.diagram_bilder(packed, laid_out=True)
+        else:
+            with metrics.stage('code dot-r'):
+                dot_code = self.dot_constructor(model)
+            metrics.code_size('dot-r', dot_code)
+            answer = self.diagram_bilder(dot_code)
+        if answer and self.keep_layout:
+            layout = self.read_layout(model)
+            if not self.layout:
+                self.layout = layout.get('nodes', {})
+            if key and not exact and layout.get('nodes'):
+                self.layout_cache.put(key, layout, self.layout_name)
+        if answer and exact and self.layout_name:
+            self.layout_cache.set_latest(self.layout_name, key)
+        if os.path.exists(self.layout_file):
+            os.remove(self.layout_file)
+        return answer
 
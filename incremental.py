@@ -0,0 +1,228 @@
+"""
+Incremental re-rendering.
+
+The model of the previous run is kept in a state folder together with the code of every table (per engine)
+and the positions of tables computed by Graphviz. On the next run the new model is compared with the previous one:
+only the code of changed tables is generated again, the code of other tables is taken from the state,
+and tables keep their positions, so Graphviz does not have to lay out the whole schema again.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from schema_model import SchemaModel
+
+
+def write_json(path: str, data) -> None:
+    """
+    Func saves data as JSON. The file is written under a temporary name and renamed, so it is never half-written.
+    """
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary_path, path)
+
+
+def read_json(path: str):
+    """
+    Func reads a JSON file. return: data or None, if the file does not exist or is broken.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SchemaDiff():
+    """
+    The class compares two models of a schema: tables, columns (names, types, order), primary and foreign keys.
+    'affected_tables' are tables whose code must be generated again: new and changed tables
+    and both ends of every added or removed foreign key.
+    """
+    def __init__(self, old: SchemaModel, new: SchemaModel):
+        self.added_tables = [name for name in new.tables if name not in old.tables]
+        self.removed_tables = [name for name in old.tables if name not in new.tables]
+        self.changed_tables = {}
+        for name, table in new.tables.items():
+            if name in old.tables:
+                changes = self.compare_tables(old.tables[name], table)
+                if changes:
+                    self.changed_tables[name] = changes
+
+        old_keys = {self.foreign_key_record(foreign_key) for foreign_key in old.foreign_keys}
+        new_keys = {self.foreign_key_record(foreign_key) for foreign_key in new.foreign_keys}
+        self.added_foreign_keys = sorted(new_keys - old_keys)
+        self.removed_foreign_keys = sorted(old_keys - new_keys)
+
+        self.affected_tables = set(self.added_tables) | set(self.changed_tables)
+        for _, table, ref_table, _, _ in self.added_foreign_keys + self.removed_foreign_keys:
+            self.affected_tables.update((table, ref_table))
+        self.affected_tables.intersection_update(new.tables)
+
+    @staticmethod
+    def foreign_key_record(foreign_key) -> tuple:
+        return (
+            foreign_key.name, foreign_key.table, foreign_key.ref_table,
+            tuple(foreign_key.columns), tuple(foreign_key.ref_columns)
+        )
+
+    @staticmethod
+    def compare_tables(old, new) -> dict:
+        """
+        Func compares two versions of one table. return: dict with changes, empty if the table has not changed.
+        """
+        old_types = {column.name: column.data_type for column in old.columns}
+        new_types = {column.name: column.data_type for column in new.columns}
+        changes = {}
+        added = [name for name in new_types if name not in old_types]
+        removed = [name for name in old_types if name not in new_types]
+        retyped = {
+            name: [old_types[name], data_type]
+            for name, data_type in new_types.items() if name in old_types and old_types[name] != data_type
+        }
+        if added:
+            changes['added_columns'] = added
+        if removed:
+            changes['removed_columns'] = removed
+        if retyped:
+            changes['changed_columns'] = retyped
+        if not added and not removed and list(old_types) != list(new_types):
+            changes['reordered_columns'] = True
+        if old.primary_keys != new.primary_keys:
+            changes['primary_keys'] = [sorted(old.primary_keys), sorted(new.primary_keys)]
+        return changes
+
+    def is_empty(self) -> bool:
+        return not (
+            self.added_tables or self.removed_tables or self.changed_tables
+            or self.added_foreign_keys or self.removed_foreign_keys
+        )
+
+    def to_dict(self) -> dict:
+        def foreign_keys(records):
+            return [
+                {'name': name, 'table': table, 'ref_table': ref_table,
+                 'columns': list(columns), 'ref_columns': list(ref_columns)}
+                for name, table, ref_table, columns, ref_columns in records
+            ]
+        return {
+            'added_tables': self.added_tables,
+            'removed_tables': self.removed_tables,
+            'changed_tables': self.changed_tables,
+            'added_foreign_keys': foreign_keys(self.added_foreign_keys),
+            'removed_foreign_keys': foreign_keys(self.removed_foreign_keys)
+        }
+
+    def summary(self) -> str:
+        if self.is_empty():
+            return 'The schema has not changed since the previous run.'
+        return (
+            f'Changes since the previous run: tables added {len(self.added_tables)}, '
+            f'removed {len(self.removed_tables)}, changed {len(self.changed_tables)}; '
+            f'foreign keys added {len(self.added_foreign_keys)}, removed {len(self.removed_foreign_keys)}.'
+        )
+
+
+class FragmentCache():
+    """
+    The class gives the code of a table to a renderer.
+    The code of tables which are not affected by the diff is taken from the previous run,
+    the code of other tables is built again. 'fragments' collects the code of all tables of the current run.
+    'affected_tables' = None means that every table is built.
+    """
+    def __init__(self, previous: dict = None, affected_tables: set = None):
+        self.previous = previous or {}
+        self.affected_tables = affected_tables
+        self.fragments = {}
+        self.reused = 0
+
+    def get(self, table, build) -> str:
+        code = None
+        if self.affected_tables is not None and table.name not in self.affected_tables:
+            code = self.previous.get(table.name)
+        if code is None:
+            code = build(table)
+        else:
+            self.reused += 1
+        self.fragments[table.name] = code
+        return code
+
+
+class RenderState():
+    """
+    The class keeps the state of incremental rendering of one schema in 'state_dir/name':
+    the model of the last run, the code of tables for every engine, positions of tables and the last diff.
+    Code and positions are saved together with the version of the model they were made for,
+    so they are used only if they belong to the previous model.
+    """
+    def __init__(self, state_dir: str, name: str):
+        self.folder = os.path.join(state_dir, name)
+        self.diff = None
+        self.previous_version = None
+        self.version = None
+
+    @staticmethod
+    def model_version(data: dict) -> str:
+        return hashlib.md5(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.folder, file_name)
+
+    def compare(self, model: SchemaModel) -> SchemaDiff:
+        """
+        Func compares the model with the model of the previous run.
+        If there was no previous run, every table is new.
+        """
+        previous = read_json(self.path('model.json'))
+        if previous:
+            self.previous_version = self.model_version(previous)
+            previous_model = SchemaModel.from_dict(previous)
+        else:
+            previous_model = SchemaModel(model.name)
+        self.version = self.model_version(model.to_dict())
+        self.diff = SchemaDiff(previous_model, model)
+        return self.diff
+
+    def save_model(self, model: SchemaModel) -> None:
+        write_json(self.path('model.json'), model.to_dict())
+
+    def save_diff(self, path: str = None) -> str:
+        """
+        Func saves the diff as JSON in the state folder or in 'path'. return: path of the file.
+        """
+        path = path or self.path('diff.json')
+        write_json(path, self.diff.to_dict())
+        return path
+
+    def load(self, file_name: str):
+        """
+        Func returns data saved for the previous model or None.
+        """
+        data = read_json(self.path(file_name))
+        if not data or self.previous_version is None or data.get('version') != self.previous_version:
+            return None
+        return data['data']
+
+    def save(self, file_name: str, data) -> None:
+        write_json(self.path(file_name), {'version': self.version, 'data': data})
+
+    def fragments(self, engine: str) -> FragmentCache:
+        previous = self.load(f'{engine}.fragments.json')
+        if previous is None:
+            return FragmentCache()
+        return FragmentCache(previous, self.diff.affected_tables)
+
+    def save_fragments(self, engine: str, cache: FragmentCache) -> None:
+        self.save(f'{engine}.fragments.json', cache.fragments)
+
+    def load_positions(self, engine: str) -> dict:
+        """
+        return: dict (table: [x, y]) with positions of tables in points.
+        """
+        return self.load(f'{engine}.positions.json') or {}
+
+    def save_positions(self, engine: str, positions: dict) -> None:
+        self.save(f'{engine}.positions.json', positions)
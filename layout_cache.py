@@ -0,0 +1,87 @@
+"""
+Cache of Graphviz layouts.
+
+The layout of a large graph takes most of the time of 'dot'. A layout (positions of tables, routes of links and
+frames of schemas, as 'dot -Tjson0' gives them) is kept by a key made of the structure of the graph only:
+tables, columns, keys and links. Colors, formats and other cosmetic options are not in the key,
+so the same layout is used for every format and after such changes. The image is then drawn by 'neato -n2',
+which only writes the output. The last layout of every diagram is also kept by its name: if the schema
+has changed a little, tables keep their places and only the changed parts are routed again.
+Layouts are stored in DiagramCache, so they share its size limit.
+"""
+import hashlib
+import json
+from diagram_cache import DiagramCache
+from schema_model import SchemaModel
+
+# Changes of the DOT-code which move tables must change this version, old layouts are not used then.
+LAYOUT_VERSION = 2
+
+
+def table_signature(table) -> str:
+    """
+    Func returns a signature of everything that changes the size of the block of the table.
+    """
+    data = [table.name, table.schema, [[column.name, column.name in table.primary_keys] for column in table.columns]]
+    return hashlib.md5(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+def layout_key(model: SchemaModel, options: dict = None) -> str:
+    """
+    Func makes the key of the layout of the model: tables in their order, their signatures, links and options
+    which change the layout (for example, frames of schemas).
+    """
+    digest = hashlib.sha256(json.dumps([LAYOUT_VERSION, options or {}], sort_keys=True).encode('utf-8'))
+    for table in model.tables.values():
+        digest.update(f'\nt|{table_signature(table)}'.encode('utf-8'))
+    for link in model.links():
+        digest.update(('\nl|' + '|'.join(link)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class LayoutCache():
+    """
+    The class keeps layouts in DiagramCache.
+    A layout is a dict: 'nodes' (table: [x, y] in points), 'edges' (link: route of the link),
+    'clusters' (frame: its bounding box) and 'signatures' (table: signature of the table when it was laid out).
+    """
+    def __init__(self, cache: DiagramCache):
+        self.cache = cache
+
+    @staticmethod
+    def cache_key(key: str) -> str:
+        return DiagramCache.key(key, 'layout', {})
+
+    @staticmethod
+    def name_key(name: str) -> str:
+        return DiagramCache.key(name, 'layout-latest', {})
+
+    def read(self, key: str):
+        data = self.cache.get(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def get(self, key: str):
+        """
+        return: the layout of the graph with this key or None.
+        """
+        return self.read(self.cache_key(key))
+
+    def latest(self, name: str):
+        """
+        return: the last layout of the diagram with this name or None.
+        """
+        key = self.cache.get(self.name_key(name))
+        return self.get(key.decode('utf-8')) if key else None
+
+    def put(self, key: str, layout: dict, name: str = None):
+        self.cache.put(self.cache_key(key), json.dumps(layout).encode('utf-8'))
+        if name:
+            self.set_latest(name, key)
+
+    def set_latest(self, name: str, key: str):
+        self.cache.put(self.name_key(name), key.encode('utf-8'))
@@ -2,70 +2,380 @@
 This visualizer is CLI-only. Type in the project directory to run:
 
 $ python main.py --host HOST --port PORT --user USER --password PASSWORD
---db_name DB_NAME --schema_name SCHEMA_NAME --engine ENGINE --direction DIRECTION --output_path PATH
+--db_name DB_NAME --schema_name SCHEMA_NAME[,SCHEMA_NAME...] --cluster --engine ENGINE --direction DIRECTION
+--output_path PATH --state_dir STATE_DIR --diff DIFF_PATH --focus TABLE[,TABLE...] --depth DEPTH --split MAX_TABLES
+--metrics METRICS_PATH --profile PROFILE_PATH --tiles
+
+Without the database: $ python main.py --dump SCHEMA.sql --schema_name SCHEMA_NAME [options above]
 
 """
 import argparse
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from diagram_builder import PlantUMLBilder
+from plantuml_process import PlantUMLProcess
 from postgres_handler import ERAlchemyHandler, PostgreSQL_handler
 from dbml_renderer_handler import DBMLRenderer
 from graphviz_dot_handler import Graphviz_handler
+from diagram_cache import DiagramCache
+from dump_handler import DumpHandler
+from incremental import RenderState
+from layout_cache import LayoutCache
+from graph_analytics import GraphAnalytics
+from tiles import DeepZoom
+from partition import SchemaPartition
+from metrics import metrics
 
+ENGINES = ('dbml-r', 'plantuml', 'eralchemy', 'dot-r')
+FORMATS = ('png', 'svg', 'pdf')
+# Engines whose diagrams can be cut into tiles (they draw svg with all details).
+TILED_ENGINES = ('dbml-r', 'plantuml', 'dot-r')
 
-def main(host, port, user, password, db_name, schema_name, engine=None, direction='1', output_path=None):
-    try:
-        answer = \
-            PostgreSQL_handler(host, port, user, password, db_name, schema_name).start_handler()
-    except NameError:
-        print('No tables found!')
-        raise
-    else:
-        if not answer:
-            print('Failed to get database data.')
 
-    tables_structure, foreign_keys_for_diagram_builder, keys_in_table, \
-        number_of_keys, primary_keys, column_types = answer
+def cache_key(fingerprint, engine, direction='1', image_format='png', cluster=False) -> str:
+    """
+    Key of the diagram in the cache: the schema fingerprint, the engine and options of rendering.
+    """
+    options = {'direction': direction or '1', 'format': image_format}
+    if cluster:
+        options['cluster'] = True
+    return DiagramCache.key(fingerprint, engine, options)
 
-    if engine == 'plantuml':
-        PlantUMLBilder(db_name, output_path).start_handler(
-            tables_structure, foreign_keys_for_diagram_builder, keys_in_table, primary_keys, direction
+
+def render(
+        engine, model, name, direction='1', output_path=None, work_dir='.', plantuml_process=None, image_format='png',
+        cache=None, fingerprint=None, state=None, cluster=False, analytics=None, tiles=False
+) -> bool:
+    """
+    Builds the diagram by one engine. Temporary files of the engine are kept in 'work_dir'.
+    name: used in the name of the image, usually the name of the database.
+    plantuml_process: long-lived PlantUML process shared by many diagrams.
+    image_format: 'png', 'svg' or 'pdf'.
+    cache, fingerprint: if the diagram of the schema with this fingerprint is in the cache (DiagramCache),
+    it is not built again (model is not used then). New diagrams are added to the cache.
+    Layouts of 'dot-r' are kept in the cache too (LayoutCache) and used for other formats and next versions.
+    state: RenderState of incremental rendering, the code of unchanged tables and positions of tables
+    are taken from the previous run.
+    cluster: if the model contains several schemas, tables of every schema are drawn together in a frame.
+    analytics: analytics of the graph of the model (GraphAnalytics) shared by engines, otherwise the engine makes it.
+    tiles: the diagram is cut into a pyramid of tiles with an HTML viewer (render_tiles), 'image_format' is not used.
+    """
+    if tiles:
+        return render_tiles(
+            engine, model, name, direction, output_path, work_dir, plantuml_process, cache, fingerprint, state,
+            cluster, analytics
         )
+    if engine == 'plantuml':
+        handler = PlantUMLBilder(name, output_path, work_dir, plantuml_process, image_format)
 
     elif engine == 'dot-r':
-        Graphviz_handler(db_name, output_path).start_handler(
-            tables_structure, foreign_keys_for_diagram_builder, primary_keys
-        )
+        handler = Graphviz_handler(name, output_path, work_dir, image_format)
 
     elif engine == 'dbml-r':
-        DBMLRenderer(db_name, output_path).start_handler(
-            tables_structure, foreign_keys_for_diagram_builder, primary_keys, column_types, direction
-        )
+        handler = DBMLRenderer(name, output_path, work_dir, image_format)
 
     elif engine == 'eralchemy':
-        ERAlchemyHandler(db_name, user, password, host, output_path).start_handler()
+        handler = ERAlchemyHandler(name, output_path, image_format, work_dir)
 
     else:
-        DBMLRenderer(db_name, output_path).start_handler(
-             tables_structure, foreign_keys_for_diagram_builder, primary_keys, column_types, direction
+        return False
+
+    if cluster and engine != 'eralchemy':
+        handler.cluster = True
+    if engine != 'eralchemy':
+        handler.analytics = analytics
+    key = cache_key(fingerprint, engine, direction, image_format, cluster) if cache and fingerprint else None
+    if key:
+        image = cache.get(key)
+        if image is not None:
+            print(f"Diagram by '{engine}' is taken from the cache.")
+            return handler.saver.write(image)
+
+    if model is None:
+        print(f"Diagram by '{engine}' is not in the cache, the schema must be read.")
+        return False
+    incremental = state is not None and engine != 'eralchemy'
+    if incremental:
+        handler.fragments = state.fragments(engine)
+    if incremental and engine == 'dot-r':
+        handler.positions = state.load_positions(engine)
+        handler.keep_layout = True
+    if cache and engine == 'dot-r':
+        # Layouts are reused for other formats and for the next versions of the schema.
+        handler.layout_cache = LayoutCache(cache)
+        handler.layout_name = f'{name}_{model.name}'
+
+    with metrics.stage(f'engine {engine}', tables=len(model)):
+        if engine in ('plantuml', 'dbml-r'):
+            answer = handler.start_handler(model, direction)
+        else:
+            answer = handler.start_handler(model)
+    if answer and key:
+        with open(handler.saver.destination(), 'rb') as f:
+            cache.put(key, f.read())
+    if answer and incremental:
+        state.save_fragments(engine, handler.fragments)
+        if engine == 'dot-r' and handler.layout:
+            state.save_positions(engine, handler.layout)
+    return answer
+
+
+def render_tiles(
+        engine, model, name, direction='1', output_path=None, work_dir='.', plantuml_process=None, cache=None,
+        fingerprint=None, state=None, cluster=False, analytics=None
+) -> bool:
+    """
+    Builds the diagram in svg and cuts it into tiles (DeepZoom): 'NAME.dzi', tiles in 'NAME_files'
+    and the viewer 'NAME.html' are saved in 'output_path' (by default in 'diagram_folder').
+    The svg is taken from the cache and put in it as the diagram in 'svg' format.
+    """
+    if engine not in TILED_ENGINES:
+        print(f"Diagrams by '{engine}' can not be cut into tiles.")
+        return False
+    if plantuml_process and plantuml_process.image_format != 'svg':
+        plantuml_process = None
+    svg_path = tempfile.mkdtemp(prefix='svg_', dir=work_dir)
+    try:
+        if not render(
+                engine, model, name, direction, svg_path, work_dir, plantuml_process, 'svg', cache, fingerprint, state,
+                cluster, analytics
+        ):
+            return False
+        images = os.listdir(svg_path)
+        if not images:
+            return False
+        with open(os.path.join(svg_path, images[0]), 'rb') as f:
+            svg = f.read()
+        try:
+            deep_zoom = DeepZoom(svg)
+        except (ValueError, SyntaxError) as e:
+            print(f"Failed to cut the diagram by '{engine}' into tiles: {e}")
+            return False
+        output_path = output_path or 'diagram_folder'
+        os.makedirs(output_path, exist_ok=True)
+        return deep_zoom.save(output_path, os.path.splitext(images[0])[0])
+    finally:
+        shutil.rmtree(svg_path, ignore_errors=True)
+
+
+def render_all(
+        model, db_name, direction='1', output_path=None, jobs=None, image_format='png', cache=None, fingerprint=None,
+        state=None, cluster=False, tiles=False
+) -> dict:
+    """
+    Builds diagrams by all engines at once. The database is not accessed: every engine uses the same model.
+    Engines mostly wait for external processes (java, node, dot), so threads are enough.
+    Every engine gets its own temporary folder, that's why their files do not collide.
+    PlantUML is run by PlantUMLProcess, which is stopped at the end.
+    return: dict (engine: True if the diagram was built).
+    """
+    results = {}
+    # Degrees, components and directions of links are computed once for all engines.
+    analytics = GraphAnalytics(model) if model is not None else None
+    plantuml_process = PlantUMLProcess(image_format='svg' if tiles else image_format)
+    with ThreadPoolExecutor(max_workers=jobs or len(ENGINES)) as pool:
+        tasks = {}
+        for engine in TILED_ENGINES if tiles else ENGINES:
+            work_dir = tempfile.mkdtemp(prefix=f'{engine}_')
+            tasks[engine] = (pool.submit(
+                render, engine, model, db_name, direction, output_path, work_dir, plantuml_process,
+                image_format=image_format, cache=cache, fingerprint=fingerprint, state=state, cluster=cluster,
+                analytics=analytics, tiles=tiles
+            ), work_dir)
+
+        for engine, (task, work_dir) in tasks.items():
+            try:
+                results[engine] = bool(task.result())
+            except Exception as e:
+                print(f"Failed to build diagram by '{engine}': {e}")
+                results[engine] = False
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    plantuml_process.close()
+    return results
+
+
+def render_parts(
+        model, name, engines, direction='1', output_path=None, jobs=None, image_format='png', max_tables=200,
+        cache=None, fingerprint=None, state_dir=None, cluster=False, tiles=False
+) -> dict:
+    """
+    Splits the schema into parts of at most 'max_tables' tables (SchemaPartition) and builds a diagram
+    of every part by every engine at once, plus the overview of parts by Graphviz.
+    Images of parts are named '<name>_part<N>', the overview is '<name>_overview'.
+    return: dict ((part, engine): True if the diagram was built), the overview is part 0.
+    """
+    partition = SchemaPartition(model, max_tables)
+    print(f'The schema is split into {len(partition.parts)} parts.')
+    results = {}
+    states = []
+    # All parts are drawn by one PlantUML process, so Java is started only once.
+    plantuml_process = PlantUMLProcess(image_format='svg' if tiles else image_format)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        tasks = {}
+        for index, part in enumerate(partition.part_models(), 1):
+            part_name = f'{name}_part{index}'
+            part_fingerprint = None
+            if fingerprint:
+                part_fingerprint = DiagramCache.key(fingerprint, 'part', {'max_tables': max_tables, 'index': index})
+            state = None
+            if state_dir:
+                state = RenderState(state_dir, f'{part_name}_{model.name}')
+                state.compare(part)
+                states.append((state, part))
+            analytics = GraphAnalytics(part)
+            for engine in engines:
+                work_dir = tempfile.mkdtemp(prefix=f'{engine}_')
+                tasks[(index, engine)] = (pool.submit(
+                    render, engine, part, part_name, direction, output_path, work_dir, plantuml_process,
+                    image_format=image_format, cache=cache, fingerprint=part_fingerprint, state=state, cluster=cluster,
+                    analytics=analytics, tiles=tiles
+                ), work_dir)
+        work_dir = tempfile.mkdtemp(prefix='overview_')
+        overview = Graphviz_handler(f'{name}_overview', output_path, work_dir, image_format)
+        tasks[(0, 'dot-r')] = (pool.submit(overview.start_overview, partition), work_dir)
+
+        for key, (task, work_dir) in tasks.items():
+            try:
+                results[key] = bool(task.result())
+            except Exception as e:
+                print(f"Failed to build diagram of part {key[0]} by '{key[1]}': {e}")
+                results[key] = False
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    plantuml_process.close()
+    for state, part in states:
+        state.save_model(part)
+    return results
+
+
+def main(
+        host, port, user, password, db_name, schema_name, engine=None, direction='1', output_path=None, jobs=None,
+        image_format='png', cache_dir=None, cache_size=512, state_dir=None, diff_path=None, focus=None, depth=1,
+        split=None, cluster=False, metrics_path=None, profile_path=None, dump_path=None, tiles=False
+):
+    """
+    schema_name: name of the schema, pattern ('sales_*') or list of them. Tables of several schemas are named
+    'schema.table', keys between the schemas are shown. With 'cluster' every schema is drawn in a frame.
+    focus: list of tables. If given, only these tables and their neighbors at most 'depth' foreign keys away
+    are read and shown. The names of the images contain the names of the focus tables.
+    split: if given, the schema is drawn in parts of at most 'split' tables (see render_parts).
+    dump_path: schema-only dump (pg_dump --schema-only). If given, the structure is read from it
+    and the database is not accessed. Images are named by 'db_name' or by the name of the dump.
+    metrics_path: if given, times of stages, SQL queries, sizes of the code and external processes are saved
+    in this JSON file. profile_path: if given, stages are profiled by cProfile
+    and the profile is saved in this file, the engines are run one by one then (jobs = 1).
+    tiles: diagrams are cut into tiles with an HTML viewer instead of one image (see render_tiles).
+    """
+    metrics.reset()
+    metrics.profiling = bool(profile_path)
+    if profile_path:
+        # Only one stage can be profiled at a time, so the engines are run one by one.
+        jobs = 1
+    try:
+        build(
+            host, port, user, password, db_name, schema_name, engine, direction, output_path, jobs, image_format,
+            cache_dir, cache_size, state_dir, diff_path, focus, depth, split, cluster, dump_path, tiles
         )
-        PlantUMLBilder(db_name, output_path).start_handler(
-            tables_structure, foreign_keys_for_diagram_builder, keys_in_table, primary_keys, direction
+    finally:
+        if metrics_path:
+            metrics.save(metrics_path)
+            print(f'Metrics are saved in "{metrics_path}".')
+        if profile_path and metrics.save_profile(profile_path):
+            print(f'The profile is saved in "{profile_path}".')
+
+
+def build(
+        host, port, user, password, db_name, schema_name, engine, direction, output_path, jobs, image_format,
+        cache_dir, cache_size, state_dir, diff_path, focus, depth, split, cluster, dump_path=None, tiles=False
+):
+    """
+    Reads the schema and builds diagrams, arguments are described in 'main'.
+    """
+    if dump_path:
+        handler = DumpHandler(dump_path, schema_name, focus=focus, depth=depth)
+        db_name = db_name or os.path.splitext(os.path.basename(dump_path))[0]
+    else:
+        handler = PostgreSQL_handler(host, port, user, password, db_name, schema_name, focus=focus, depth=depth)
+    engines = [engine] if engine in ENGINES else list(ENGINES)
+    name = f"{db_name}_{'_'.join(focus)}" if focus else db_name
+
+    cache = fingerprint = model = None
+    if cache_dir:
+        cache = DiagramCache(cache_dir, cache_size * 1024 * 1024)
+        try:
+            with metrics.stage('fingerprint'):
+                fingerprint = handler.get_fingerprint()
+        except Exception as e:
+            print(f'Failed to compute the schema fingerprint, the cache is not used: {e}')
+        # A part of the schema is another diagram of the same schema.
+        if fingerprint and focus:
+            fingerprint = DiagramCache.key(fingerprint, 'focus', {'tables': focus, 'depth': depth})
+
+    # If all diagrams are in the cache, the structure of the schema is not needed. Tiles are cut from svg.
+    if tiles:
+        engines = [e for e in engines if e in TILED_ENGINES]
+    cached_format = 'svg' if tiles else image_format
+    if split or not fingerprint or not all(
+            cache.contains(cache_key(fingerprint, e, direction, cached_format, cluster)) for e in engines
+    ):
+        try:
+            with metrics.stage('introspection'):
+                model = handler.start_handler()
+        except NameError:
+            print('No tables found!')
+            raise
+        else:
+            if not model:
+                print('Failed to get database data.')
+                return
+
+    if split:
+        render_parts(
+            model, name, engines, direction, output_path, jobs, image_format, split, cache, fingerprint, state_dir,
+            cluster, tiles
         )
-        ERAlchemyHandler(
-            db_name, user, password, host, output_path
-        ).start_handler()
-        Graphviz_handler(db_name, output_path).start_handler(
-            tables_structure, foreign_keys_for_diagram_builder, primary_keys
+        return
+
+    # Incremental rendering: the model is compared with the model of the previous run.
+    state = None
+    if state_dir and model:
+        state = RenderState(state_dir, f'{name}_{model.name}')
+        diff = state.compare(model)
+        print(diff.summary())
+        print(f'The diff is saved in "{state.save_diff(diff_path)}".')
+
+    if engine in ENGINES:
+        render(
+            engine, model, name, direction, output_path, image_format=image_format,
+            cache=cache, fingerprint=fingerprint, state=state, cluster=cluster, tiles=tiles
         )
+    else:
+        render_all(model, name, direction, output_path, jobs, image_format, cache, fingerprint, state, cluster, tiles)
+    if state:
+        state.save_model(model)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Diagram Builder")
-    parser.add_argument("--host", required=True, help="Database host")
-    parser.add_argument("--port", required=True, help="Database port")
-    parser.add_argument("--user", required=True, help="Database user")
-    parser.add_argument("--password", required=True, help="Database password")
-    parser.add_argument("--db_name", required=True, help="Database name")
-    parser.add_argument("--schema_name", required=True, help="Schema name")
+    parser.add_argument("--host", required=False, help="Database host")
+    parser.add_argument("--port", required=False, help="Database port")
+    parser.add_argument("--user", required=False, help="Database user")
+    parser.add_argument("--password", required=False, help="Database password")
+    parser.add_argument("--db_name", required=False, help="Database name")
+    parser.add_argument(
+        "--dump", required=False, metavar="SCHEMA.sql",
+        help="Read the structure from a schema-only dump (pg_dump --schema-only), the database is not used."
+    )
+    parser.add_argument(
+        "--schema_name", required=True,
+        help="Schema name. Several schemas are separated by commas, patterns like 'sales_*' are allowed."
+    )
+    parser.add_argument(
+        "--cluster", action="store_true", help="If several schemas are selected, draw every schema in a frame."
+    )
     parser.add_argument(
         "--engine",
         help="Select how the diagram is rendered. Available 4 type.\n"
@@ -77,9 +387,63 @@ if __name__ == "__main__":
         "--direction", required=False, help="By default is '1', can be also '2'. Affects the layout of tables."
     )
     parser.add_argument("--output_path", required=False, help="Output path. Diagrams will be saved in this path.")
+    parser.add_argument(
+        "--format", required=False, default='png', choices=FORMATS,
+        help="Format of the diagram: 'png' (by default), 'svg' or 'pdf'. Vector formats are not rasterized."
+    )
+    parser.add_argument(
+        "--cache_dir", required=False,
+        help="Folder for the cache of diagrams. If the schema has not changed, diagrams are taken from the cache."
+    )
+    parser.add_argument(
+        "--cache_size", required=False, type=int, default=512, help="Maximum size of the cache in MB. By default 512."
+    )
+    parser.add_argument(
+        "--state_dir", required=False,
+        help="Folder for the state of incremental rendering. Only changed tables are built again."
+    )
+    parser.add_argument(
+        "--diff", required=False, help="Save the changes of the schema since the previous run in this JSON file."
+    )
+    parser.add_argument(
+        "--focus", required=False,
+        help="Show only these tables (separated by commas) and their neighbors by foreign keys."
+    )
+    parser.add_argument(
+        "--depth", required=False, type=int, default=1,
+        help="With --focus: how many foreign keys away from the focus tables neighbors are shown. By default 1."
+    )
+    parser.add_argument(
+        "--split", required=False, type=int, metavar="MAX_TABLES",
+        help="Draw the schema in parts of at most MAX_TABLES tables (by foreign keys), plus an overview of parts."
+    )
+    parser.add_argument(
+        "--tiles", action="store_true",
+        help="Cut diagrams into a pyramid of tiles with an HTML viewer instead of one image, for very large schemas."
+    )
+    parser.add_argument(
+        "--metrics", required=False, metavar="METRICS_PATH",
+        help="Save times of stages, SQL queries, sizes of the code and external processes in this JSON file."
+    )
+    parser.add_argument(
+        "--profile", required=False, metavar="PROFILE_PATH",
+        help="Profile the stages by cProfile and save the profile in this file (for pstats or snakeviz)."
+    )
+    parser.add_argument(
+        "--jobs", required=False, type=int,
+        help="Number of engines working at the same time, if engine is not selected. By default all at once."
+    )
 
     args = parser.parse_args()
+    if not args.dump:
+        missing = [option for option in ('host', 'port', 'user', 'password', 'db_name') if not getattr(args, option)]
+        if missing:
+            parser.error(f"the following arguments are required without --dump: --{', --'.join(missing)}")
     main(
         args.host, args.port, args.user, args.password, args.db_name,
-        args.schema_name, args.engine, args.direction, args.output_path
+        [schema.strip() for schema in args.schema_name.split(',') if schema.strip()],
+        args.engine, args.direction, args.output_path, args.jobs, args.format,
+        args.cache_dir, args.cache_size, args.state_dir, args.diff,
+        [table.strip() for table in args.focus.split(',') if table.strip()] if args.focus else None, args.depth,
+        args.split, args.cluster, args.metrics, args.profile, args.dump, args.tiles
     )
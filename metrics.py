@@ -0,0 +1,161 @@
+"""
+Measurements of a run.
+
+'metrics' collects wall and CPU time of every stage (introspection, generation of the code, rendering, conversion,
+saving), the number of SQL queries and fetched rows, the size of the generated code, exit codes and durations
+of external processes (java, node, dot) and the peak memory. Stages may run in parallel threads,
+the CPU time of a stage is the time of its thread.
+The results are saved in JSON. If profiling is on, Python stages are also profiled by cProfile, one stage
+at a time: main runs the engines one by one then.
+"""
+import cProfile
+import json
+import pstats
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory is not measured there.
+    resource = None
+
+
+class Metrics():
+    """
+    The class collects measurements. It is used by all modules through the object 'metrics'.
+    max_records: if given, only the last records of stages, code and processes are kept (long-running service).
+    """
+    def __init__(self, max_records: int = None):
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        # One profiler works in the process at a time (Python 3.12 does not allow more), it profiles
+        # the outermost stage which got the lock. Nested stages and stages of other threads are not profiled.
+        self.profile_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages = deque(maxlen=self.max_records)
+        self.queries = 0
+        self.rows = 0
+        self.code = deque(maxlen=self.max_records)
+        self.processes = deque(maxlen=self.max_records)
+        self.profiling = False
+        self.profiles = []
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        """
+        Measures the stage: with metrics.stage('code plantuml'): ...
+        """
+        start = time.perf_counter()
+        start_cpu = time.thread_time()
+        profile = None
+        if self.profiling and self.profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (not ours) is active.
+                self.profile_lock.release()
+                profile = None
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self.profile_lock.release()
+            record = {
+                'stage': name, 'start': start - self.start, 'wall': time.perf_counter() - start,
+                'cpu': time.thread_time() - start_cpu, 'thread': threading.current_thread().name
+            }
+            record.update(info)
+            with self.lock:
+                self.stages.append(record)
+                if profile:
+                    self.profiles.append(profile)
+
+    def query(self, rows: int):
+        with self.lock:
+            self.queries += 1
+            self.rows += rows
+
+    def code_size(self, engine: str, code: str):
+        with self.lock:
+            self.code.append({'engine': engine, 'size': len(code)})
+
+    def process(self, command: list, return_code, seconds: float):
+        with self.lock:
+            self.processes.append({'command': ' '.join(command[:2]), 'return_code': return_code, 'wall': seconds})
+
+    def run(self, command: list, **kwargs) -> subprocess.CompletedProcess:
+        """
+        Func runs an external process by subprocess.run and records its exit code and duration.
+        """
+        start = time.perf_counter()
+        return_code = None
+        try:
+            result = subprocess.run(command, **kwargs)
+            return_code = result.returncode
+            return result
+        finally:
+            self.process(command, return_code, time.perf_counter() - start)
+
+    def call(self, command: list, **kwargs) -> int:
+        """
+        The same as 'run' for subprocess.call.
+        """
+        start = time.perf_counter()
+        return_code = None
+        try:
+            return_code = subprocess.call(command, **kwargs)
+            return return_code
+        finally:
+            self.process(command, return_code, time.perf_counter() - start)
+
+    def to_dict(self) -> dict:
+        usage = {}
+        if resource:
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            # Linux reports the peak memory in kilobytes.
+            usage = {
+                'cpu_children': children.ru_utime + children.ru_stime,
+                'peak_rss_kb': own.ru_maxrss,
+                'peak_rss_children_kb': children.ru_maxrss
+            }
+        with self.lock:
+            return {
+                'wall': time.perf_counter() - self.start,
+                'cpu': time.process_time() - self.start_cpu,
+                **usage,
+                'sql': {'queries': self.queries, 'rows': self.rows},
+                'code': list(self.code),
+                'processes': list(self.processes),
+                'stages': sorted(self.stages, key=lambda record: record['start'])
+            }
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def save_profile(self, path: str) -> bool:
+        """
+        Func saves profiles of all stages in one file for pstats / snakeviz.
+        """
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
+
+
+metrics = Metrics()
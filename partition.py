@@ -0,0 +1,120 @@
+"""
+Split of a large schema into parts which are drawn as separate diagrams.
+
+Tables are grouped by connected components of the graph of foreign keys.
+A component larger than the budget is divided into communities: groups of tables which are linked
+with each other more than with the rest of the component. Small components, small communities
+and tables without links are collected in common parts.
+"""
+from schema_model import SchemaModel
+from graph_analytics import GraphAnalytics, analyze, neighbors
+
+
+class SchemaPartition():
+    """
+    The class divides the tables of the model into parts of at most 'max_tables' tables.
+    'parts' is a list of lists of table names, 'part_of' gives the index of the part of a table.
+    analytics: analytics of the model (GraphAnalytics), if it is already made.
+    """
+    def __init__(self, model: SchemaModel, max_tables: int = 200, rounds: int = 10, analytics: GraphAnalytics = None):
+        self.model = model
+        self.analytics = analyze(model, analytics)
+        self.max_tables = max(1, max_tables)
+        self.rounds = rounds
+        self.parts = []
+        small = []
+        for component in self.analytics.components:
+            if len(component) * 4 <= self.max_tables:
+                small.append(component)
+            elif len(component) <= self.max_tables:
+                self.parts.append(component)
+            else:
+                # Communities which are still small after merging are packed like small components.
+                for community in self.communities(component):
+                    (small if len(community) * 4 <= self.max_tables else self.parts).append(community)
+        # Small components and communities are packed together, they are never divided between parts.
+        part = []
+        for component in small:
+            if len(part) + len(component) > self.max_tables:
+                self.parts.append(part)
+                part = []
+            part.extend(component)
+        if part:
+            self.parts.append(part)
+        self.part_of = {table: index for index, part in enumerate(self.parts) for table in part}
+
+    def communities(self, component: list) -> list:
+        """
+        Func divides a component into communities by label propagation: every table joins the community
+        with which it has the most links, if the community is not full. Time is O(links) per round.
+        Small communities are then merged into their most linked neighbor, if there is room;
+        those left small are packed into common parts by __init__.
+        """
+        label = {name: name for name in component}
+        size = {name: 1 for name in component}
+        for _ in range(self.rounds):
+            changed = False
+            for name in component:
+                weights = {}
+                for neighbor in neighbors(self.model, name):
+                    if neighbor != name:
+                        weights[label[neighbor]] = weights.get(label[neighbor], 0) + 1
+                current = label[name]
+                best, best_weight = current, weights.get(current, 0)
+                for candidate, weight in weights.items():
+                    if weight > best_weight and size[candidate] < self.max_tables:
+                        best, best_weight = candidate, weight
+                if best != current:
+                    size[current] -= 1
+                    size[best] += 1
+                    label[name] = best
+                    changed = True
+            if not changed:
+                break
+
+        groups = {}
+        for name in component:
+            groups.setdefault(label[name], []).append(name)
+        # Small communities are merged, starting from the smallest.
+        for key in sorted(groups, key=lambda key: len(groups[key])):
+            group = groups[key]
+            if len(group) * 4 > self.max_tables:
+                continue
+            weights = {}
+            for name in group:
+                for neighbor in neighbors(self.model, name):
+                    if label[neighbor] != key:
+                        weights[label[neighbor]] = weights.get(label[neighbor], 0) + 1
+            for target in sorted(weights, key=weights.get, reverse=True):
+                if len(groups[target]) + len(group) <= self.max_tables:
+                    groups[target].extend(group)
+                    for name in group:
+                        label[name] = target
+                    groups[key] = []
+                    break
+        return [group for group in groups.values() if group]
+
+    def part_models(self) -> list:
+        """
+        return: list of models, one per part.
+        """
+        return [self.model.subgraph(part) for part in self.parts]
+
+    def cross_links(self) -> dict:
+        """
+        Func counts foreign keys between parts. return: dict ((part, part): number of keys).
+        """
+        links = {}
+        for foreign_key in self.model.foreign_keys:
+            part_from = self.part_of[foreign_key.table]
+            part_to = self.part_of[foreign_key.ref_table]
+            if part_from != part_to:
+                key = (min(part_from, part_to), max(part_from, part_to))
+                links[key] = links.get(key, 0) + 1
+        return links
+
+    def hub(self, index: int) -> str:
+        """
+        Func returns the table of the part with the most links.
+        """
+        return self.analytics.hub(self.parts[index])
@@ -0,0 +1,87 @@
+"""
+Long-lived PlantUML process.
+
+Starting the JVM and warming up PlantUML takes more time than the layout of a typical diagram.
+PlantUMLProcess starts PlantUML once in pipe mode and sends it the code of every diagram through stdin,
+images are read back from stdout. Diagrams are separated by a unique delimiter.
+"""
+import subprocess
+import threading
+import time
+import uuid
+from metrics import metrics
+
+
+class PlantUMLProcess():
+    """
+    The class keeps one PlantUML process and renders diagrams by it one after another.
+    It can be shared between threads: diagrams are sent to the process under a lock.
+    """
+    def __init__(self, path_to_plantuml: str = "third_party/plantuml.jar", image_format: str = 'png'):
+        self.path_to_plantuml = path_to_plantuml
+        self.image_format = image_format
+        self.delimiter = f'--plantuml-{uuid.uuid4().hex}--'
+        self.process = None
+        self.buffer = b''
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Func starts PlantUML in pipe mode. The delimiter is printed by PlantUML after every image.
+        """
+        self.buffer = b''
+        self.process = subprocess.Popen(
+            ["java", "-Djava.awt.headless=true", "-jar", self.path_to_plantuml,
+             "-pipe", f"-t{self.image_format}", "-pipedelimitor", self.delimiter],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def read_image(self) -> bytes:
+        """
+        Func reads stdout of PlantUML up to the next delimiter.
+        """
+        delimiter = self.delimiter.encode()
+        while delimiter not in self.buffer:
+            chunk = self.process.stdout.read1(65536)
+            if not chunk:
+                raise RuntimeError('PlantUML process has stopped.')
+            self.buffer += chunk
+        image, _, self.buffer = self.buffer.partition(delimiter)
+        # The delimiter is followed by a line break.
+        self.buffer = self.buffer.lstrip(b'\r\n')
+        return image
+
+    def render(self, uml_code: str) -> bytes:
+        """
+        Func renders one diagram. The process is started at the first call and restarted if it has stopped.
+        return: image in bytes.
+        """
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+            start = time.perf_counter()
+            try:
+                self.process.stdin.write(uml_code.encode('utf-8') + b'\n')
+                self.process.stdin.flush()
+                image = self.read_image()
+            except (OSError, RuntimeError):
+                metrics.process(['plantuml', '-pipe'], None, time.perf_counter() - start)
+                self.close()
+                raise
+            metrics.process(['plantuml', '-pipe'], 0, time.perf_counter() - start)
+            return image
+
+    def close(self):
+        """
+        Func stops the process.
+        """
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except Exception:
+                self.process.kill()
+            self.process = None
@@ -1,10 +1,14 @@
 import pg8000
 from pg8000 import Error
-from typing import Dict
-from eralchemy import render_er
+import fnmatch
+import hashlib
+from eralchemy.main import intermediary_to_schema
+from eralchemy.models import Column, Relation, Table
 import os
 from datetime import datetime
 from saver import Saver
+from schema_model import SchemaModel, neighborhood
+from metrics import metrics
 
 
 class PostgreSQL_handler():
@@ -12,249 +16,394 @@ class PostgreSQL_handler():
     The class gets the necessary information about the database.
     It stores information about tabel names, tabel structures, foreign keys and relationships.
     """
-    def __init__(self, host, port, user, password, db_name, schema_name):
-        try:
-            self.conn = self.connection = pg8000.connect(
-                database=db_name, user=user, password=password, host=host, port=port
-            )
-        except Error as e:
-            print(f"{e}")
+    def __init__(
+            self, host, port, user, password, db_name, schema_name, connection=None, focus=None, depth=1
+    ):
+        """
+        schema_name: name of the schema or list of names. Several schemas are read in the same queries.
+        Names can be patterns with '*', '?' and '[]' (for example 'sales_*').
+        connection: already opened connection to the database, for example from a pool.
+        focus: list of tables ('table' or 'schema.table'). If given, only these tables and their neighbors
+        at most 'depth' foreign keys away are read.
+        """
+        if connection is not None:
+            self.conn = connection
+        else:
+            try:
+                self.conn = self.connection = pg8000.connect(
+                    database=db_name, user=user, password=password, host=host, port=port
+                )
+            except Error as e:
+                print(f"{e}")
 
-        self.schema = schema_name
-        self.tables = []
-        self.tables_structure = {}
+        self.schemas = [schema_name] if isinstance(schema_name, str) else list(schema_name)
+        self.schema = self.schemas[0]
         self.connection = None
-        self.foreign_keys = {}
-        self.primary_keys = {}
-        self.keys_in_table = {}
-        self.number_of_keys = {}
-        self.column_types = {}
+        self.models = {schema: SchemaModel(schema) for schema in self.schemas}
+        self.model = self.models[self.schema]
+        self.focus = list(focus or [])
+        self.depth = depth
+        # Tables selected by focus, as 'schema.table'. None means all tables.
+        self.selected = None
+
+    def get_schema_list(self) -> list:
+        """
+        Func returns names of all schemas in db, except the system ones.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT schema_name \
+                        FROM information_schema.schemata \
+                        WHERE schema_name NOT LIKE 'pg_%' AND schema_name != 'information_schema';")
+        schemas = sorted(table[0] for table in cursor.fetchall())
+        metrics.query(len(schemas))
+        return schemas
 
     def check_schema_names(self):
         """
-        Checks if the schema exists in db.
+        Checks if the schemas exist in db. Missing schemas are excluded from processing.
+        Patterns are replaced by the names of matching schemas.
         """
         try:
-            cursor = self.conn.cursor()
+            schemas = self.get_schema_list()
         except:
             print(f'Error connecting to the database, please check your personal data.')
             return False
         else:
-            cursor.execute("SELECT schema_name \
-                            FROM information_schema.schemata \
-                            WHERE schema_name NOT LIKE 'pg_%' AND schema_name != 'information_schema';")
-            schemas = [table[0] for table in cursor.fetchall()]
-            if self.schema in schemas:
-                return True
-            else:
-                print(f'The selected schema does not exist.')
-                return False
+            selected = []
+            for schema in self.schemas:
+                if any(char in schema for char in '*?['):
+                    matched = [name for name in schemas if fnmatch.fnmatchcase(name, schema)]
+                    if not matched:
+                        print(f'No schema matches "{schema}".')
+                    selected.extend(matched)
+                elif schema in schemas:
+                    selected.append(schema)
+                else:
+                    print(f'The selected schema "{schema}" does not exist.')
+            self.schemas = list(dict.fromkeys(selected))
+            for schema in self.schemas:
+                self.models.setdefault(schema, SchemaModel(schema))
+            if self.schemas:
+                self.schema = self.schemas[0]
+                self.model = self.models[self.schema]
+            return self.schemas != []
 
-    def get_tabel_names(self) -> bool:
+    def fetch(self, query: str, params: tuple = ()) -> list:
         """
-        Func gets informathion about tabel names in db.
+        Func executes a query and returns all rows.
         """
-
         cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+        cursor.close()
+        metrics.query(len(results))
+        return results
+
+    def get_fingerprints(self) -> dict:
+        """
+        Func computes a fingerprint of every selected schema by one query: md5 of its tables, columns (names,
+        positions, types) and constraints (primary and foreign keys). Data of the tables is not read.
+        return: dict (schema: fingerprint). Schemas without tables are missing.
+        """
+        if not self.check_schema_names():
+            return {}
+        results = self.fetch("""
+            WITH ns AS (
+                SELECT oid, nspname FROM pg_catalog.pg_namespace WHERE nspname::text = ANY(%s)
+            ), items AS (
+                SELECT c.relnamespace AS nsp, 'r:' || c.relname || ':' || c.relkind AS item
+                FROM pg_catalog.pg_class c JOIN ns ON ns.oid = c.relnamespace
+                WHERE c.relkind IN ('r', 'p')
+                UNION ALL
+                SELECT c.relnamespace, 'a:' || c.relname || ':' || a.attnum || ':' || a.attname || ':'
+                || pg_catalog.format_type(a.atttypid, NULL)
+                FROM pg_catalog.pg_attribute a
+                JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+                JOIN ns ON ns.oid = c.relnamespace
+                WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+                UNION ALL
+                SELECT c.relnamespace, 'c:' || c.relname || ':' || con.conname || ':'
+                || pg_catalog.pg_get_constraintdef(con.oid)
+                FROM pg_catalog.pg_constraint con
+                JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+                JOIN ns ON ns.oid = c.relnamespace
+                WHERE con.contype IN ('p', 'f')
+            )
+            SELECT ns.nspname, md5(string_agg(items.item, '|' ORDER BY items.item))
+            FROM items JOIN ns ON ns.oid = items.nsp
+            GROUP BY ns.nspname;
+        """, (self.schemas,))
+        return {schema: fingerprint for schema, fingerprint in results}
 
-        # Ignore virtual tables (view).
-        cursor.execute(f"SELECT table_name FROM information_schema.tables WHERE table_schema = '{self.schema}' " 
-                       f"AND table_type = 'BASE TABLE';")
-        tables = [table[0] for table in cursor.fetchall()]
-        if tables != []:
-            [self.tables.append(table) for table in tables]
-            print('Table name received successfully.')
+    def get_fingerprint(self) -> str:
+        """
+        Func returns the fingerprint of the schema or None, if the schema has no tables.
+        The fingerprint of several schemas is made of fingerprints of all of them.
+        """
+        fingerprints = self.get_fingerprints()
+        if len(self.schemas) < 2 or not fingerprints:
+            return fingerprints.get(self.schema)
+        data = '|'.join(f'{schema}:{fingerprints.get(schema)}' for schema in self.schemas)
+        return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    def catalog_columns(self) -> list:
+        """
+        Func reads columns of all selected tables by one query.
+        return: rows (schema, table, column, position, type), a table without columns has one row with column None.
+        """
+        # relkind 'r' - ordinary table, 'p' - partitioned table. Views are ignored.
+        condition, params = self.selected_condition()
+        return self.fetch(f"""
+            SELECT n.nspname, c.relname, a.attname, a.attnum, pg_catalog.format_type(a.atttypid, NULL)
+            FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_catalog.pg_attribute a
+            ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            WHERE n.nspname::text = ANY(%s) AND c.relkind IN ('r', 'p'){condition}
+            ORDER BY n.nspname, c.relname, a.attnum;
+        """, (self.schemas, *params))
+
+    def get_catalog_tables(self) -> bool:
+        """
+        Func gets names, columns and column types of all tables in the schemas by one query.
+        Columns are ordered by their ordinal position. Data is saved directly in the schema models.
+        """
+        results = self.catalog_columns()
+        for schema, table, column, position, type_c in results:
+            model = self.models[schema]
+            model.add_table(table)
+            if column is not None:
+                model.add_column(table, column, type_c)
+
+        if any(self.models[schema].tables for schema in self.schemas):
+            print('Table name and column data received successfully.')
             return True
         else:
             print('Attention! In db not tables.')
             return False
 
-    def get_info_about_tables(self) -> bool:
+    def catalog_primary_keys(self) -> list:
         """
-        Func gets informathion about tabel structures (columns).
+        Func reads primary keys of all selected tables by one query.
+        return: rows (schema, table, column), columns of a key are in the order of the constraint.
         """
-        cursor = self.conn.cursor()
-        for table in self.tables:
-            cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table}';")
-            columns = [column[0] for column in cursor.fetchall()]
-            self.tables_structure[table] = columns
-        cursor.close()
-        if self.tables_structure != {}:
-            print('Table column data has been successfully retrieved.')
-            return True
-        else:
-            print('In tables not columns at all.')
-            return False
+        condition, params = self.selected_condition()
+        return self.fetch(f"""
+            SELECT n.nspname, c.relname, a.attname
+            FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            WHERE n.nspname::text = ANY(%s) AND con.contype = 'p'{condition}
+            ORDER BY n.nspname, c.relname, k.ord;
+        """, (self.schemas, *params))
 
-    def get_info_about_foreign_keys(self):
+    def get_catalog_primary_keys(self):
         """
-        Func gets information about restrictions on the tables.
-        Information about foreign keys and relationships saved in self.connection.
+        Func gets primary keys of all tables in the schemas by one query.
         """
-        cursor = self.conn.cursor()
+        results = self.catalog_primary_keys()
+        for schema, table, column in results:
+            self.models[schema].add_primary_key(table, column)
 
-        cursor.execute("""
-            SELECT 
-            tc.table_name AS TABLE_NAME, 
-            kcu.column_name AS COLUMN_NAME, 
-            tc.constraint_name AS CONSTRAINT_NAME, 
-            ccu.table_name AS REFERENCED_TABLE_NAME, 
-            ccu.column_name AS REFERENCED_COLUMN_NAME 
-            FROM 
-            information_schema.table_constraints tc 
-            JOIN 
-            information_schema.key_column_usage kcu 
-            ON tc.constraint_name = kcu.constraint_name 
-            AND tc.table_schema = kcu.table_schema 
-            JOIN 
-            information_schema.constraint_column_usage ccu 
-            ON ccu.constraint_name = tc.constraint_name 
-            AND ccu.table_schema = tc.table_schema 
-            WHERE 
-            tc.constraint_type = 'FOREIGN KEY';
-        """)
+        if not results:
+            print('Tables do not have primary keys.')
 
-        results = cursor.fetchall()
+    def catalog_foreign_keys(self) -> list:
+        """
+        Func reads foreign keys of the selected schemas by one query, keys which refer to other selected schemas
+        are included too. return: rows (schema, constraint, table, referenced schema, referenced table,
+        [columns], [referenced columns]).
+        """
+        # conkey/confkey are unnested together, so columns are paired by position without N x M rows.
+        return self.fetch("""
+            SELECT n.nspname, con.conname, c.relname, rn.nspname, rc.relname,
+            array_agg(a.attname::text ORDER BY k.ord),
+            array_agg(ra.attname::text ORDER BY k.ord)
+            FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+            JOIN pg_catalog.pg_class rc ON rc.oid = con.confrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_catalog.pg_namespace rn ON rn.oid = rc.relnamespace
+            CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, ord)
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            JOIN pg_catalog.pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.ref_attnum
+            WHERE con.contype = 'f' AND n.nspname::text = ANY(%s) AND rn.nspname::text = ANY(%s)
+            GROUP BY con.oid, n.nspname, con.conname, c.relname, rn.nspname, rc.relname
+            ORDER BY n.nspname, c.relname, con.conname;
+        """, (self.schemas, self.schemas))
 
-        if results and results != []:
-            keys = []
-            for el in results:
-                if el not in keys:
-                    keys.append(el)
-            self.connection = keys
+    def get_info_about_foreign_keys(self):
+        """
+        Func gets information about foreign keys of the tables in the schemas.
+        One record is saved in self.connection per constraint:
+        (schema, constraint, table, referenced schema, referenced table, [(column, referenced column), ...]).
+        Column pairs of composite keys keep the order of the constraint definition.
+        """
+        results = self.catalog_foreign_keys()
+        if results:
+            self.connection = [
+                (schema, name, table, ref_schema, ref_table, list(zip(columns, ref_columns)))
+                for schema, name, table, ref_schema, ref_table, columns, ref_columns in results
+            ]
             print(f'Keys received successfully. Number of connections established: {len(self.connection)}.')
         else:
             print('All tables in the database do not have foreign keys.')
-        cursor.close()
 
-    def get_info_about_primary_keys(self):
-        cursor = self.conn.cursor()
-        for tabel in self.tables:
-            # a.attname - name of columns, pg_index - system table;
-            # Join two tables: pg_attribute and pg_attribute, by attrelid (identifier).
-            cursor.execute(f"""
-                SELECT a.attname
-                FROM pg_index i
-                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
-                WHERE i.indrelid = '"{self.schema}"."{tabel}"'::regclass AND i.indisprimary;
-            """)
-
-            results = cursor.fetchall()
-
-            if results != []:
-                primary_keys = [i[0] for i in results]
-                self.primary_keys[tabel] = primary_keys
+    def selected_condition(self) -> tuple:
+        """
+        Func returns the condition of catalog queries which restricts them to the selected tables, and its parameters.
+        """
+        if self.selected is None:
+            return '', ()
+        return " AND n.nspname::text || '.' || c.relname::text = ANY(%s)", (sorted(self.selected),)
 
-        if self.primary_keys == {}:
-            print('Tables do not have primary keys.')
+    def select_focus(self):
+        """
+        Func selects the focus tables and their neighbors by the foreign keys (breadth-first search).
+        Only foreign keys are read for it, columns are read later only for the selected tables.
+        """
+        start = set()
+        for table in self.focus:
+            if '.' in table and table.split('.', 1)[0] in self.schemas:
+                start.add(table)
+            else:
+                start.update(f'{schema}.{table}' for schema in self.schemas)
+        links = [
+            (f'{schema}.{table_from}', f'{ref_schema}.{table_to}')
+            for schema, _, table_from, ref_schema, table_to, _ in self.connection or []
+        ]
+        self.selected = neighborhood(links, start, self.depth)
 
     def data_preparation(self):
         """
-        This is where information about relationships between tables is processed.
-        Finally name of the table and the name of the table associated with it, as well as the keys,
-        are saved in self.foreign_keys.
-        """
-        for table in self.tables:
-            connection_from_tabel = []
-            if self.connection:
-                for relation in self.connection:
-                    if relation[0] == table:
-                        connection_from_tabel.append({relation[3]: [relation[1], relation[4]]})
-                self.foreign_keys[table] = connection_from_tabel
+        This is where foreign keys are added to the schema models (self.models): tables with columns,
+        their types and primary keys are put there by the queries. Every constraint is visited once.
+        """
+        # Keys between schemas are shown only in the combined model (combined_model).
+        for schema, name, table_from, ref_schema, table_to, pairs in self.connection or []:
+            if ref_schema != schema or not self.is_selected(schema, table_from, ref_schema, table_to):
+                continue
+            self.models[schema].add_foreign_key(
+                name, table_from, table_to, [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+            )
 
-                for relation in self.connection:
-                    first_table = relation[0]
-                    first_key = relation[1]
-                    second_table = relation[3]
-                    second_key = relation[4]
-                    if first_table in self.keys_in_table:
-                        if first_key not in self.keys_in_table[first_table]:
-                            self.keys_in_table[first_table].append(first_key)
-                    else:
-                        self.keys_in_table[first_table] = [first_key]
-                    if second_table in self.keys_in_table:
-                        if second_key not in self.keys_in_table[second_table]:
-                            self.keys_in_table[second_table].append(second_key)
-                    else:
-                        self.keys_in_table[second_table] = [second_key]
+    def is_selected(self, schema: str, table_from: str, ref_schema: str, table_to: str) -> bool:
+        return self.selected is None or (
+            f'{schema}.{table_from}' in self.selected and f'{ref_schema}.{table_to}' in self.selected
+        )
 
-                for table in list(self.keys_in_table.items()):
-                    self.number_of_keys[table[0]] = len(table[1])
+    def combined_model(self) -> SchemaModel:
+        """
+        Func joins the models of all selected schemas into one model. Tables are named 'schema.table',
+        keys between schemas are included.
+        """
+        model = SchemaModel(','.join(self.schemas))
+        for schema in self.schemas:
+            for table in self.models[schema].tables.values():
+                combined = model.add_table(f'{schema}.{table.name}', schema)
+                combined.columns = list(table.columns)
+                combined.primary_keys = set(table.primary_keys)
+        for schema, name, table_from, ref_schema, table_to, pairs in self.connection or []:
+            table_from, table_to = f'{schema}.{table_from}', f'{ref_schema}.{table_to}'
+            if table_from in model.tables and table_to in model.tables:
+                model.add_foreign_key(
+                    name, table_from, table_to, [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+                )
+        return model
 
-    def get_column_types(self):
+    def collect_models(self) -> dict:
         """
-        Func gets info about type of column in tables.
+        Func reads all selected schemas in one pass over the catalog.
+        return: dict (schema: schema model). Schemas which do not exist or have no tables are skipped.
         """
-        cursor = self.conn.cursor()
-        for tabel in self.tables:
-            cursor.execute(f" \
-                SELECT column_name, data_type \
-                FROM information_schema.columns \
-                WHERE table_name = '{tabel}' \
-            ")
-            results = cursor.fetchall()
-            tabel_data = {}
-            if results != []:
-                for column_data in results:
-                    column = column_data[0]
-                    type_c = column_data[1]
-                    tabel_data[column] = type_c
-                self.column_types[tabel] = tabel_data
+        if not self.check_schema_names():
+            return {}
+
+        # With focus the foreign keys are read first: they define which tables are needed.
+        if self.focus:
+            self.get_info_about_foreign_keys()
+            self.select_focus()
+
+        # The whole schema is read from pg_catalog by a constant number of queries.
+        if not self.get_catalog_tables():
+            return {}
+        self.get_catalog_primary_keys()
 
-    def start_handler(self) -> Dict:
+        if not self.focus:
+            self.get_info_about_foreign_keys()
+        self.data_preparation()
+        found = {f'{schema}.{name}' for schema in self.schemas for name in self.models[schema].tables}
+        for table in self.focus:
+            if table not in found and not any(f'{schema}.{table}' in found for schema in self.schemas):
+                print(f'The selected table "{table}" does not exist.')
+        return {schema: self.models[schema] for schema in self.schemas if self.models[schema].tables}
+
+    def start_handler(self) -> SchemaModel:
         """
         Func starts processing data from the database.
         It calls functions step by step to get data about table names, their structure, and foreign keys.
-        return: dicts with structure of db and relationships by foreign keys.
-        """
-        if self.check_schema_names():
-            answer = self.get_tabel_names()
-            if answer:
-                get_columns = self.get_info_about_tables()
-                if get_columns:
-                    self.get_column_types()
-                    self.get_info_about_foreign_keys()
-                    self.get_info_about_primary_keys()
-                    self.data_preparation()
-                    return self.tables_structure, \
-                        self.foreign_keys, \
-                        self.keys_in_table, \
-                        dict(sorted(self.number_of_keys.items(), key=lambda item: item[1], reverse=True)), \
-                        self.primary_keys, \
-                        self.column_types
-            else:
-                return False
-        else:
+        return: schema model with structure of db and relationships by foreign keys.
+        If several schemas are selected, the model contains all of them (see combined_model).
+        """
+        models = self.collect_models()
+        if len(self.schemas) > 1:
+            return self.combined_model() if models else False
+        if self.schema not in models:
             return False
+        return self.model
 
 
 class ERAlchemyHandler():
     """
     Class performs building diagram by 'ERAlchemy'.
-    It accesses an existing table by path and builds a diagram.
-    Unlike other methods, it does not need to provide ready-made data.
+    The schema model received by PostgreSQL_handler is converted to the intermediary tables and relations
+    of ERAlchemy, so the database is not read once more and only the selected schemas are shown.
     """
-    def __init__(self, db_name: str, user_name: str, password: str, host: str, output_path: str):
+    def __init__(self, db_name: str, output_path: str, image_format: str = 'png', work_dir: str = '.'):
         self.name_db = db_name
-        self.user_name = user_name
-        self.password = password
-        self.host = host
         self.date_today = datetime.now().date().strftime('%Y-%m-%d')
         self.output_path = output_path
-        self.img_name = f'{self.name_db}_{self.date_today}_.png'
+        # Folder for temporary files, every renderer running in parallel has its own.
+        self.work_dir = work_dir
+        # The format of the image is selected by its extension: 'png', 'svg' or 'pdf'.
+        self.img_name = f'{self.name_db}_{self.date_today}_.{image_format}'
+        self.img_file = os.path.join(self.work_dir, self.img_name)
         self.saver = Saver(self.output_path, self.img_name)
 
-    def start_handler(self):
-        if not os.path.exists('diagram_folder'):
-            os.makedirs('diagram_folder')
+    def create_intermediary(self, model: SchemaModel) -> tuple:
+        """
+        Func converts the schema model to the intermediary representation of ERAlchemy: tables with columns,
+        their types and primary keys, and one relation per link. Tables keep the names of the model,
+        so 'schema.table' stays qualified on both ends of relations between schemas.
+        return: (tables, relations).
+        """
+        tables = [
+            Table(table.name, [
+                Column(column.name, column.data_type, column.name in table.primary_keys) for column in table.columns
+            ])
+            for table in model.tables.values()
+        ]
+        relations = [
+            Relation(right_col=table_from, left_col=table_to, right_cardinality='?', left_cardinality='*')
+            for table_from, _, table_to, _ in dict.fromkeys(model.links())
+        ]
+        return tables, relations
 
-        url = f'postgresql://{self.user_name}:{self.password}@{self.host}/{self.name_db}'
-        output_path = f'./diagram_folder/{self.name_db}_{self.date_today}_.png'
+    def start_handler(self, model: SchemaModel) -> bool:
         try:
-            render_er(url, output_path)
+            with metrics.stage('intermediary eralchemy'):
+                tables, relations = self.create_intermediary(model)
+            with metrics.stage('render eralchemy'):
+                intermediary_to_schema(tables, relations, self.img_file)
+            with open(self.img_file, 'rb') as f:
+                image = f.read()
         except:
             print(r"Failed launched 'ERAlchemy'.")
-        else:
-            print(r"Successfully launched 'ERAlchemy'.")
-        if self.output_path:
-            self.saver.save()
+            return False
+        finally:
+            if os.path.exists(self.img_file):
+                os.remove(self.img_file)
+        print(r"Successfully launched 'ERAlchemy'.")
+        return self.saver.write(image)
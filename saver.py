@@ -1,7 +1,9 @@
 """
 Saving an image to a specific address.
 """
+import os
 import shutil
+from metrics import metrics
 
 
 class Saver():
@@ -14,6 +16,35 @@ class Saver():
 
     def save(self):
         try:
-            shutil.move(f'./diagram_folder/{self.img_name}', self.output_path)
+            with metrics.stage('save', image=self.img_name):
+                shutil.move(f'./diagram_folder/{self.img_name}', self.output_path)
         except:
-            print(f'Incorrect path to output or "{self.img_name}" already exist.')
\ No newline at end of file
+            print(f'Incorrect path to output or "{self.img_name}" already exist.')
+
+    def destination(self) -> str:
+        """
+        Func returns the path where the image ends up: 'diagram_folder' or the given output path.
+        """
+        if not self.output_path:
+            return os.path.join('diagram_folder', self.img_name)
+        if os.path.isdir(self.output_path):
+            return os.path.join(self.output_path, self.img_name)
+        return self.output_path
+
+    def write(self, image: bytes) -> bool:
+        """
+        Func writes an image received in memory straight to its destination, without moving files.
+        """
+        path = self.destination()
+        if self.output_path and os.path.isdir(self.output_path) and os.path.exists(path):
+            print(f'Incorrect path to output or "{self.img_name}" already exist.')
+            return False
+        try:
+            with metrics.stage('save', image=self.img_name, size=len(image)):
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(image)
+        except OSError:
+            print(f'Incorrect path to output "{path}".')
+            return False
+        return True
@@ -0,0 +1,212 @@
+"""
+Compact model of the database structure.
+
+PostgreSQL_handler fills the model, renderers read from it.
+Records use __slots__, key membership is kept in sets and every table knows its incoming and outgoing
+foreign keys, so lookups per column and per link do not depend on the size of the schema.
+"""
+from collections import deque
+
+
+def neighborhood(links, start, depth: int) -> set:
+    """
+    Func finds tables which are at most 'depth' foreign keys away from the 'start' tables (breadth-first search).
+    Direction of the keys does not matter.
+    links: pairs (table, referenced table). return: set of tables, including the 'start' tables.
+    """
+    adjacency = {}
+    for table, ref_table in links:
+        adjacency.setdefault(table, set()).add(ref_table)
+        adjacency.setdefault(ref_table, set()).add(table)
+    found = set(start)
+    queue = deque((table, 0) for table in found)
+    while queue:
+        table, distance = queue.popleft()
+        if distance == depth:
+            continue
+        for neighbor in adjacency.get(table, ()):
+            if neighbor not in found:
+                found.add(neighbor)
+                queue.append((neighbor, distance + 1))
+    return found
+
+
+class Column():
+    """
+    Column of a table: name, data type and ordinal position.
+    """
+    __slots__ = ('name', 'data_type', 'position')
+
+    def __init__(self, name: str, data_type: str, position: int):
+        self.name = name
+        self.data_type = data_type
+        self.position = position
+
+
+class ForeignKey():
+    """
+    One foreign key constraint.
+    Columns of composite keys are stored in the order of the constraint definition.
+    """
+    __slots__ = ('name', 'table', 'ref_table', 'columns', 'ref_columns')
+
+    def __init__(self, name: str, table: str, ref_table: str, columns: tuple, ref_columns: tuple):
+        self.name = name
+        self.table = table
+        self.ref_table = ref_table
+        self.columns = columns
+        self.ref_columns = ref_columns
+
+    def pairs(self):
+        """
+        Func returns pairs (column, referenced column).
+        """
+        return zip(self.columns, self.ref_columns)
+
+
+class Table():
+    """
+    Table with its columns, primary keys and foreign keys.
+    'key_columns' contains columns used in any foreign key, on both sides of the link.
+    'links_out' and 'links_in' count links (column pairs) from and to the table.
+    'schema' is set if the model contains several schemas, then the name of the table is 'schema.table'.
+    """
+    __slots__ = (
+        'name', 'schema', 'columns', 'primary_keys', 'key_columns', 'outgoing', 'incoming', 'links_out', 'links_in'
+    )
+
+    def __init__(self, name: str, schema: str = None):
+        self.name = name
+        self.schema = schema
+        self.columns = []
+        self.primary_keys = set()
+        self.key_columns = set()
+        self.outgoing = []
+        self.incoming = []
+        self.links_out = 0
+        self.links_in = 0
+
+    def number_of_links(self) -> int:
+        return self.links_out + self.links_in
+
+
+class SchemaModel():
+    """
+    The class stores tables and relationships of one schema.
+    Tables are kept in the order in which they were added.
+    """
+    __slots__ = ('name', 'tables', 'foreign_keys')
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self.tables = {}
+        self.foreign_keys = []
+
+    def add_table(self, name: str, schema: str = None) -> Table:
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables[name] = Table(name, schema)
+        return table
+
+    def schemas(self) -> list:
+        """
+        Func returns schemas of tables, if the model contains several schemas.
+        """
+        return list(dict.fromkeys(table.schema for table in self.tables.values() if table.schema))
+
+    def add_column(self, table: str, name: str, data_type: str, position: int = None) -> Column:
+        columns = self.add_table(table).columns
+        column = Column(name, data_type, position if position is not None else len(columns) + 1)
+        columns.append(column)
+        return column
+
+    def add_primary_key(self, table: str, column: str):
+        self.add_table(table).primary_keys.add(column)
+
+    def add_foreign_key(
+            self, name: str, table: str, ref_table: str, columns, ref_columns
+    ) -> ForeignKey:
+        """
+        Func adds a foreign key and updates the adjacency index of both tables.
+        """
+        foreign_key = ForeignKey(name, table, ref_table, tuple(columns), tuple(ref_columns))
+        table_from = self.add_table(table)
+        table_to = self.add_table(ref_table)
+        table_from.outgoing.append(foreign_key)
+        table_to.incoming.append(foreign_key)
+        table_from.links_out += len(foreign_key.columns)
+        table_to.links_in += len(foreign_key.columns)
+        table_from.key_columns.update(foreign_key.columns)
+        table_to.key_columns.update(foreign_key.ref_columns)
+        self.foreign_keys.append(foreign_key)
+        return foreign_key
+
+    def links(self):
+        """
+        Func yields every link as (table, column, referenced table, referenced column).
+        Links are grouped by the table they start from, in table order.
+        """
+        for table in self.tables.values():
+            for foreign_key in table.outgoing:
+                for key_from, key_to in foreign_key.pairs():
+                    yield table.name, key_from, foreign_key.ref_table, key_to
+
+    def __len__(self):
+        return len(self.tables)
+
+    def subgraph(self, names):
+        """
+        Func returns a new model with the given tables and foreign keys between them.
+        """
+        names = set(names)
+        model = SchemaModel(self.name)
+        for table in self.tables.values():
+            if table.name in names:
+                part = model.add_table(table.name, table.schema)
+                part.columns = list(table.columns)
+                part.primary_keys = set(table.primary_keys)
+        for foreign_key in self.foreign_keys:
+            if foreign_key.table in names and foreign_key.ref_table in names:
+                model.add_foreign_key(
+                    foreign_key.name, foreign_key.table, foreign_key.ref_table,
+                    foreign_key.columns, foreign_key.ref_columns
+                )
+        return model
+
+    def to_dict(self) -> dict:
+        """
+        Func returns the model as plain lists and dicts, which can be saved as JSON.
+        """
+        return {
+            'name': self.name,
+            'tables': [
+                {
+                    'name': table.name,
+                    'schema': table.schema,
+                    'columns': [[column.name, column.data_type, column.position] for column in table.columns],
+                    'primary_keys': sorted(table.primary_keys)
+                }
+                for table in self.tables.values()
+            ],
+            'foreign_keys': [
+                [foreign_key.name, foreign_key.table, foreign_key.ref_table,
+                 list(foreign_key.columns), list(foreign_key.ref_columns)]
+                for foreign_key in self.foreign_keys
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Func restores the model saved by 'to_dict'.
+        """
+        model = cls(data.get('name'))
+        for table in data['tables']:
+            model.add_table(table['name'], table.get('schema'))
+            for name, data_type, position in table['columns']:
+                model.add_column(table['name'], name, data_type, position)
+            for column in table['primary_keys']:
+                model.add_primary_key(table['name'], column)
+        for name, table, ref_table, columns, ref_columns in data['foreign_keys']:
+            model.add_foreign_key(name, table, ref_table, columns, ref_columns)
+        return model
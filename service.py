@@ -0,0 +1,351 @@
+"""
+HTTP service which renders diagrams on demand.
+
+$ python service.py --config CONFIG --host 127.0.0.1 --port 8080 --cache_dir CACHE_DIR --cache_size CACHE_SIZE
+--jobs JOBS --fingerprint_ttl SECONDS
+
+The config is a JSON file with databases, which are known by their names. Passwords are never sent in requests.
+A schema-only dump can be given instead of a database:
+
+{
+    "databases": {
+        "shop": {"host": "localhost", "port": 5432, "user": "USER", "password": "PASSWORD", "db_name": "shop"},
+        "archive": {"dump": "archive.sql"}
+    }
+}
+
+GET /diagram?db=shop&schema=public&engine=dot-r&format=svg&direction=1  - the image.
+"schema" may be a list of schemas separated by commas, "cluster=1" draws every schema in a frame.
+GET /health  - state of the service, GET /metrics  - measurements (see metrics.py).
+
+The service keeps one connection per database and one PlantUML process (JVM) per format.
+For every request only the fingerprint of the schema is read; diagrams are kept in the cache by the fingerprint,
+so a diagram is built only after the schema has changed. Identical requests which come at the same time
+are joined: the diagram is built once and all of them get it.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from batch import ConnectionPool
+from diagram_cache import DiagramCache
+from dump_handler import DumpHandler, SchemaDump
+from main import ENGINES, FORMATS, cache_key, render
+from metrics import metrics
+from plantuml_process import PlantUMLProcess
+from postgres_handler import PostgreSQL_handler
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+
+
+class Coalescer():
+    """
+    The class joins identical calls which run at the same time: the first call does the work,
+    the others wait for its result (or its exception).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.joined = 0
+
+    def run(self, key, func):
+        with self.lock:
+            future = self.running.get(key)
+            leader = future is None
+            if leader:
+                future = self.running[key] = Future()
+            else:
+                self.joined += 1
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.running[key]
+
+
+class DiagramService():
+    """
+    The class builds diagrams for requests (database, schemas, engine, format, direction).
+    Fingerprints are reused for 'fingerprint_ttl' seconds, the last model of every schema is kept in memory.
+    At most 'jobs' diagrams are built at the same time.
+    """
+    def __init__(self, databases: dict, cache: DiagramCache, jobs: int = 4, fingerprint_ttl: float = 0):
+        self.databases = databases
+        self.cache = cache
+        self.fingerprint_ttl = fingerprint_ttl
+        self.pool = ConnectionPool()
+        self.coalescer = Coalescer()
+        self.slots = threading.Semaphore(jobs)
+        self.lock = threading.Lock()
+        # A connection is used by one thread at a time.
+        self.database_locks = {name: threading.Lock() for name in databases}
+        self.fingerprints = {}
+        self.models = {}
+        self.dumps = {}
+        self.plantuml_processes = {}
+        self.started = time.time()
+        self.requests = 0
+        self.hits = 0
+        self.built = 0
+
+    def plantuml_process(self, image_format: str) -> PlantUMLProcess:
+        with self.lock:
+            if image_format not in self.plantuml_processes:
+                self.plantuml_processes[image_format] = PlantUMLProcess(image_format=image_format)
+            return self.plantuml_processes[image_format]
+
+    def warm_up(self, image_format: str = 'png'):
+        """
+        Func starts the PlantUML process before the first request, the JVM is warmed up by an empty diagram.
+        """
+        try:
+            self.plantuml_process(image_format).render('@startuml\n@enduml')
+        except Exception as e:
+            print(f'PlantUML is not warmed up: {e}')
+
+    def read(self, db: str, schemas: list, func):
+        """
+        Func calls 'func' with the handler of the database. A broken connection is opened again.
+        """
+        source = self.databases[db]
+        if source.get('dump'):
+            # The dump is read again only after the file has changed.
+            stat = os.stat(source['dump'])
+            version = (stat.st_mtime_ns, stat.st_size)
+            with self.database_locks[db]:
+                if db not in self.dumps or self.dumps[db][0] != version:
+                    self.dumps[db] = (version, SchemaDump(source['dump']))
+                dump = self.dumps[db][1]
+                return func(DumpHandler(source['dump'], schemas, dump=dump))
+        key = (source.get('host'), source.get('port', 5432), source.get('user'), source.get('db_name', db))
+        for attempt in range(2):
+            with self.database_locks[db]:
+                connection = self.pool.get(key[0], key[1], key[2], source.get('password'), key[3])
+                # The handler reports errors of the connection by messages, so the connection is checked first.
+                try:
+                    # Catalog queries only read, the connection must not stay idle in a transaction.
+                    connection.autocommit = True
+                    cursor = connection.cursor()
+                    cursor.execute('SELECT 1')
+                    cursor.fetchall()
+                except Exception as e:
+                    self.pool.discard(*key)
+                    if attempt:
+                        raise
+                    print(f"Connection to '{db}' is opened again: {e}")
+                    continue
+                return func(PostgreSQL_handler(
+                    key[0], key[1], key[2], source.get('password'), key[3], schemas, connection=connection
+                ))
+
+    def fingerprint(self, db: str, schemas: list) -> str:
+        key = (db, tuple(schemas))
+        with self.lock:
+            known = self.fingerprints.get(key)
+        if known and time.monotonic() - known[0] < self.fingerprint_ttl:
+            return known[1]
+
+        def compute():
+            fingerprint = self.read(db, schemas, lambda handler: handler.get_fingerprint())
+            with self.lock:
+                self.fingerprints[key] = (time.monotonic(), fingerprint)
+            return fingerprint
+        return self.coalescer.run(('fingerprint', key), compute)
+
+    def model(self, db: str, schemas: list, fingerprint: str):
+        """
+        Func returns the model of the schemas. It is read again only if the fingerprint has changed.
+        """
+        key = (db, tuple(schemas))
+        with self.lock:
+            known = self.models.get(key)
+        if known and known[0] == fingerprint:
+            return known[1]
+
+        def introspect():
+            model = self.read(db, schemas, lambda handler: handler.start_handler())
+            if not model:
+                raise LookupError('Schema does not exist or has no tables.')
+            with self.lock:
+                self.models[key] = (fingerprint, model)
+            return model
+        return self.coalescer.run(('model', key, fingerprint), introspect)
+
+    def build(self, db, schemas, engine, image_format, direction, cluster, fingerprint) -> bytes:
+        model = self.model(db, schemas, fingerprint)
+        output_path = tempfile.mkdtemp(prefix='service_out_')
+        work_dir = tempfile.mkdtemp(prefix=f'service_{engine}_')
+        try:
+            with self.slots:
+                answer = render(
+                    engine, model, f"{db}_{'_'.join(schemas)}", direction, output_path, work_dir,
+                    self.plantuml_process(image_format), image_format, self.cache, fingerprint, cluster=cluster
+                )
+            images = os.listdir(output_path)
+            if not answer or not images:
+                raise RuntimeError(f"Diagram by '{engine}' was not built.")
+            with open(os.path.join(output_path, images[0]), 'rb') as f:
+                image = f.read()
+            with self.lock:
+                self.built += 1
+            return image
+        finally:
+            shutil.rmtree(output_path, ignore_errors=True)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def diagram(self, db, schemas, engine, image_format='png', direction='1', cluster=False) -> tuple:
+        """
+        return: image in bytes and its key in the cache.
+        """
+        if db not in self.databases:
+            raise LookupError(f"Unknown database '{db}'.")
+        with self.lock:
+            self.requests += 1
+        fingerprint = self.fingerprint(db, schemas)
+        if not fingerprint:
+            raise LookupError('Schema does not exist or has no tables.')
+        key = cache_key(fingerprint, engine, direction, image_format, cluster)
+        image = self.cache.get(key)
+        if image is not None:
+            with self.lock:
+                self.hits += 1
+            return image, key
+        image = self.coalescer.run(
+            ('diagram', key),
+            lambda: self.build(db, schemas, engine, image_format, direction, cluster, fingerprint)
+        )
+        return image, key
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                'status': 'ok', 'uptime': time.time() - self.started, 'databases': sorted(self.databases),
+                'requests': self.requests, 'cache_hits': self.hits, 'built': self.built,
+                'joined': self.coalescer.joined,
+                'plantuml': {name: process.is_alive() for name, process in self.plantuml_processes.items()}
+            }
+
+    def close(self):
+        self.pool.close()
+        for process in self.plantuml_processes.values():
+            process.close()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    The class answers HTTP requests by the service of the server.
+    """
+    def send(self, code: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, code: int, data):
+        self.send(code, json.dumps(data, indent=2).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        service = self.server.service
+        if url.path == '/health':
+            self.send_json(200, service.status())
+        elif url.path == '/metrics':
+            self.send_json(200, {'service': service.status(), 'metrics': metrics.to_dict()})
+        elif url.path == '/diagram':
+            self.diagram(service, params)
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    do_HEAD = do_GET
+
+    def diagram(self, service: DiagramService, params: dict):
+        engine = params.get('engine', 'dot-r')
+        image_format = params.get('format', 'png')
+        direction = params.get('direction', '1')
+        schemas = [schema.strip() for schema in params.get('schema', '').split(',') if schema.strip()]
+        if not params.get('db') or not schemas:
+            return self.send_json(400, {'error': "Parameters 'db' and 'schema' are required."})
+        if engine not in ENGINES or image_format not in FORMATS or direction not in ('1', '2'):
+            return self.send_json(400, {'error': 'Unknown engine, format or direction.'})
+        try:
+            image, key = service.diagram(
+                params['db'], schemas, engine, image_format, direction, params.get('cluster') == '1'
+            )
+        except LookupError as e:
+            return self.send_json(404, {'error': str(e)})
+        except Exception as e:
+            return self.send_json(500, {'error': str(e)})
+        # The key changes with the schema, so browsers may keep the image until then.
+        if self.headers.get('If-None-Match') == f'"{key}"':
+            self.send_response(304)
+            self.send_header('ETag', f'"{key}"')
+            self.end_headers()
+            return
+        self.send(200, image, CONTENT_TYPES[image_format], {'ETag': f'"{key}"', 'Cache-Control': 'no-cache'})
+
+
+def load_config(path: str) -> dict:
+    """
+    Func reads the config. return: dict (name: database or dump).
+    """
+    with open(path) as f:
+        return json.load(f)['databases']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagram Builder service")
+    parser.add_argument("--config", required=True, help="JSON file with databases.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the service. By default 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8080, help="Port of the service. By default 8080.")
+    parser.add_argument("--cache_dir", default="diagram_cache", help="Folder for the cache of diagrams.")
+    parser.add_argument(
+        "--cache_size", type=int, default=512, help="Maximum size of the cache in MB. By default 512."
+    )
+    parser.add_argument("--jobs", type=int, default=4, help="Diagrams built at the same time. By default 4.")
+    parser.add_argument(
+        "--fingerprint_ttl", type=float, default=0,
+        help="Seconds during which the fingerprint of a schema is not read again. By default it is read every time."
+    )
+    parser.add_argument(
+        "--no_warm_up", action="store_true", help="Do not start PlantUML before the first request."
+    )
+
+    args = parser.parse_args()
+    # Only the last measurements are kept, the service works for a long time.
+    metrics.max_records = 1000
+    metrics.reset()
+    service = DiagramService(
+        load_config(args.config), DiagramCache(args.cache_dir, args.cache_size * 1024 * 1024), args.jobs,
+        args.fingerprint_ttl
+    )
+    if not args.no_warm_up:
+        threading.Thread(target=service.warm_up, daemon=True).start()
+    server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.service = service
+    print(f'Diagram service is running on http://{args.host}:{args.port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
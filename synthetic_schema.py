@@ -0,0 +1,166 @@
+"""
+Synthetic schemas for benchmarks.
+
+SyntheticSchema generates a schema with the given number of tables, columns per table, density of foreign keys,
+share of composite keys and hub tables (tables referenced by a large share of keys).
+The same schema is available as a model (SchemaModel), as a DDL script and as rows of the catalog queries
+of PostgreSQL_handler, which FakeCatalogConnection returns instead of a database.
+"""
+import hashlib
+import random
+from schema_model import SchemaModel
+
+COLUMN_TYPES = (
+    'integer', 'bigint', 'text', 'character varying', 'boolean', 'numeric', 'timestamp without time zone', 'date'
+)
+
+
+class SyntheticSchema():
+    """
+    The class generates the schema. The result depends only on the arguments (and 'seed').
+    tables: number of tables.
+    columns: number of ordinary columns per table (besides keys).
+    fk_density: average number of foreign keys per table.
+    composite: share of tables with composite (two-column) primary keys.
+    hubs: number of hub tables, 'hub_share' of foreign keys refers to them.
+    """
+    def __init__(
+            self, tables: int = 100, columns: int = 8, fk_density: float = 1.5, composite: float = 0.1,
+            hubs: int = 0, hub_share: float = 0.3, schema: str = 'public', seed: int = 0
+    ):
+        self.schema = schema
+        self.tables = {}
+        self.primary_keys = {}
+        self.foreign_keys = []
+        generator = random.Random(seed)
+        width = len(str(tables))
+        names = [f't{index:0{width}d}' for index in range(tables)]
+
+        for name in names:
+            key = ['id', 'part'] if generator.random() < composite else ['id']
+            self.primary_keys[name] = key
+            self.tables[name] = [(column, 'integer') for column in key] + [
+                (f'c{index}', generator.choice(COLUMN_TYPES)) for index in range(1, columns + 1)
+            ]
+
+        hub_names = names[:min(hubs, tables)]
+        for number in range(int(tables * fk_density) if tables > 1 else 0):
+            table = generator.choice(names)
+            if hub_names and generator.random() < hub_share:
+                ref_table = generator.choice(hub_names)
+            else:
+                ref_table = generator.choice(names)
+            if ref_table == table:
+                continue
+            ref_columns = self.primary_keys[ref_table]
+            columns_from = [f'{ref_table}_{column}_{number}' for column in ref_columns]
+            self.tables[table].extend((column, 'integer') for column in columns_from)
+            self.foreign_keys.append((f'fk_{table}_{number}', table, ref_table, columns_from, list(ref_columns)))
+
+    def model(self) -> SchemaModel:
+        model = SchemaModel(self.schema)
+        for table, columns in self.tables.items():
+            model.add_table(table)
+            for position, (column, data_type) in enumerate(columns, 1):
+                model.add_column(table, column, data_type, position)
+            for column in self.primary_keys[table]:
+                model.add_primary_key(table, column)
+        for name, table, ref_table, columns, ref_columns in self.foreign_keys:
+            model.add_foreign_key(name, table, ref_table, columns, ref_columns)
+        return model
+
+    def ddl(self) -> str:
+        """
+        Func returns the DDL script: CREATE TABLE with primary keys, then ALTER TABLE ... ADD CONSTRAINT
+        for foreign keys (the same way as 'pg_dump --schema-only' does).
+        """
+        parts = [f'CREATE SCHEMA IF NOT EXISTS {self.schema};\n\n']
+        for table, columns in self.tables.items():
+            parts.append(f'CREATE TABLE {self.schema}.{table} (\n')
+            parts.extend(f'    {column} {data_type},\n' for column, data_type in columns)
+            parts.append(f'    PRIMARY KEY ({", ".join(self.primary_keys[table])})\n);\n\n')
+        for name, table, ref_table, columns, ref_columns in self.foreign_keys:
+            parts.append(
+                f'ALTER TABLE ONLY {self.schema}.{table}\n'
+                f'    ADD CONSTRAINT {name} FOREIGN KEY ({", ".join(columns)}) '
+                f'REFERENCES {self.schema}.{ref_table}({", ".join(ref_columns)});\n\n'
+            )
+        return ''.join(parts)
+
+    def catalog_rows(self) -> dict:
+        """
+        Func returns rows of the catalog queries of PostgreSQL_handler, in the order of the queries.
+        """
+        schema = self.schema
+        return {
+            'schemas': [[schema]],
+            'columns': [
+                [schema, table, column, position, data_type]
+                for table in sorted(self.tables)
+                for position, (column, data_type) in enumerate(self.tables[table], 1)
+            ],
+            'primary_keys': [
+                [schema, table, column] for table in sorted(self.tables) for column in self.primary_keys[table]
+            ],
+            'foreign_keys': [
+                [schema, name, table, schema, ref_table, columns, ref_columns]
+                for name, table, ref_table, columns, ref_columns in sorted(
+                    self.foreign_keys, key=lambda key: (key[1], key[0])
+                )
+            ],
+            'fingerprints': [[schema, hashlib.md5(self.ddl().encode('utf-8')).hexdigest()]]
+        }
+
+
+class FakeCatalogCursor():
+    """
+    Cursor which answers the catalog queries of PostgreSQL_handler by prepared rows.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query: str, params: tuple = ()):
+        rows = self.connection.rows
+        if 'md5(' in query:
+            result = rows['fingerprints']
+        elif 'information_schema.schemata' in query:
+            result = rows['schemas']
+        elif 'format_type' in query:
+            result = rows['columns']
+        elif "contype = 'p'" in query:
+            result = rows['primary_keys']
+        elif "contype = 'f'" in query:
+            result = rows['foreign_keys']
+        else:
+            result = []
+        # Queries restricted to selected tables (focus) have the list of 'schema.table' as the last parameter.
+        if len(params) > 1 and 'relname::text = ANY' in query:
+            selected = set(params[-1])
+            result = [row for row in result if f'{row[0]}.{row[1]}' in selected]
+        self.connection.queries += 1
+        self.connection.rows_fetched += len(result)
+        self.rows = result
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeCatalogConnection():
+    """
+    Connection which is given to PostgreSQL_handler instead of a database connection.
+    It counts queries and fetched rows.
+    """
+    def __init__(self, schema: SyntheticSchema):
+        self.rows = schema.catalog_rows()
+        self.queries = 0
+        self.rows_fetched = 0
+
+    def cursor(self):
+        return FakeCatalogCursor(self)
+
+    def close(self):
+        pass
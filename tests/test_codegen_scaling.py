@@ -0,0 +1,60 @@
+"""
+Generation of the code must stay linear: 10 000 tables with 30 000 foreign keys are generated well under a second
+by every builder, and ten times more tables take about ten times longer, not a hundred times.
+"""
+import time
+import pytest
+from diagram_builder import PlantUMLBilder
+from graphviz_dot_handler import Graphviz_handler
+from dbml_renderer_handler import DBMLRenderer
+from graph_analytics import GraphAnalytics
+from synthetic_schema import SyntheticSchema
+
+BUILDERS = {
+    'plantuml': (lambda model: PlantUMLBilder('test', None).constructor(model, '1'), ' --['),
+    'dot-r': (lambda model: Graphviz_handler('test', None).dot_constructor(model), ' -> '),
+    'dbml-r': (lambda model: DBMLRenderer('test', None).constructor_handler(model, '1'), 'Ref: '),
+}
+# The code of 10 000 tables takes 0.2-0.6 s, so the bound of a second catches a slowdown of two times and more.
+# From 1 000 to 10 000 tables the time grows at most 40 times (caches make large schemas a bit slower per table,
+# quadratic code grows 100 times).
+LIMIT_SECONDS = 1.0
+LIMIT_RATIO = 40
+
+
+def best_time(func, model, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(model)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@pytest.fixture(scope='module')
+def models():
+    return {tables: SyntheticSchema(tables, fk_density=3).model() for tables in (1000, 10000)}
+
+
+@pytest.mark.parametrize('engine', BUILDERS)
+def test_time_is_linear(engine, models):
+    build, _ = BUILDERS[engine]
+    small = best_time(build, models[1000])
+    large = best_time(build, models[10000])
+    assert large < LIMIT_SECONDS, f'{engine}: {large:.2f} s for 10 000 tables'
+    assert large < small * LIMIT_RATIO, f'{engine}: {small:.3f} s for 1 000 tables, {large:.3f} s for 10 000 tables'
+
+
+@pytest.mark.parametrize('engine', BUILDERS)
+def test_links_are_not_repeated(engine):
+    model = SyntheticSchema(200, fk_density=3).model()
+    # The same keys once more: repeated links must be drawn once.
+    for foreign_key in list(model.foreign_keys[:50]):
+        model.add_foreign_key(
+            f'{foreign_key.name}_copy', foreign_key.table, foreign_key.ref_table,
+            foreign_key.columns, foreign_key.ref_columns
+        )
+    build, marker = BUILDERS[engine]
+    links = [line for line in build(model).splitlines() if marker in line]
+    assert len(links) == len(set(links))
+    assert len(links) == len(GraphAnalytics(model).links)
@@ -0,0 +1,40 @@
+"""
+ERAlchemy gets tables and relations from the model: with several schemas both ends of every relation
+keep the name 'schema.table', keys between schemas included.
+"""
+from dump_handler import DumpHandler
+from postgres_handler import ERAlchemyHandler
+
+DUMP = """
+CREATE TABLE a.t1 (
+    id integer NOT NULL,
+    t2_id integer
+);
+CREATE TABLE b.t2 (
+    id integer NOT NULL,
+    t1_id integer
+);
+CREATE TABLE b.t3 (
+    id integer NOT NULL,
+    t2_id integer
+);
+ALTER TABLE ONLY a.t1 ADD CONSTRAINT t1_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY b.t2 ADD CONSTRAINT t2_pkey PRIMARY KEY (id);
+ALTER TABLE ONLY a.t1 ADD CONSTRAINT t1_t2_fkey FOREIGN KEY (t2_id) REFERENCES b.t2(id);
+ALTER TABLE ONLY b.t2 ADD CONSTRAINT t2_t1_fkey FOREIGN KEY (t1_id) REFERENCES a.t1(id);
+ALTER TABLE ONLY b.t3 ADD CONSTRAINT t3_t2_fkey FOREIGN KEY (t2_id) REFERENCES b.t2(id);
+"""
+
+
+def test_relations_of_combined_model(tmp_path):
+    path = tmp_path / 'schemas.sql'
+    path.write_text(DUMP)
+    model = DumpHandler(str(path), ['a', 'b']).start_handler()
+    tables, relations = ERAlchemyHandler('test', None).create_intermediary(model)
+    names = {table.name for table in tables}
+    assert names == {'a.t1', 'b.t2', 'b.t3'}
+    assert {(relation.right_col, relation.left_col) for relation in relations} == {
+        ('a.t1', 'b.t2'), ('b.t2', 'a.t1'), ('b.t3', 'b.t2')
+    }
+    primary_keys = {table.name: [column.name for column in table.columns if column.is_key] for table in tables}
+    assert primary_keys == {'a.t1': ['id'], 'b.t2': ['id'], 'b.t3': []}
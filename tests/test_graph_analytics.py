@@ -0,0 +1,36 @@
+"""
+Analytics of the graph of foreign keys: repeated keys are counted once, as they are drawn,
+and links of a table with thousands of keys are colored in linear time.
+"""
+import time
+from schema_model import SchemaModel
+from graph_analytics import GraphAnalytics
+
+
+def test_degrees_of_repeated_keys():
+    model = SchemaModel('test')
+    for name in ('a', 'b', 'c'):
+        model.add_table(name)
+    model.add_foreign_key('a_b_1', 'a', 'b', ['b_id'], ['id'])
+    model.add_foreign_key('a_b_2', 'a', 'b', ['b_id'], ['id'])
+    model.add_foreign_key('c_b', 'c', 'b', ['b_id'], ['id'])
+    analytics = GraphAnalytics(model)
+    assert analytics.links == [('a', 'b_id', 'b', 'id'), ('c', 'b_id', 'b', 'id')]
+    assert analytics.degree == {'a': 1, 'b': 2, 'c': 1}
+    assert analytics.links_out == {'a': 1, 'b': 0, 'c': 1}
+
+
+def test_colors_of_busy_table():
+    model = SchemaModel('test')
+    model.add_table('hub')
+    for index in range(4000):
+        model.add_foreign_key(f'hub_t{index}', 'hub', f't{index}', [f't{index}_id'], ['id'])
+    # Two keys to one column make one group with one color.
+    model.add_foreign_key('t0_t1', 't0', 't1', ['t1_id'], ['id'])
+    analytics = GraphAnalytics(model)
+    start = time.perf_counter()
+    colors = analytics.link_colors()
+    assert time.perf_counter() - start < 1.0
+    assert colors[('t0', 't1_id')] == colors[('hub', 't1_id')] == colors[('t1', 'id')]
+    hub_colors = [colors[('hub', f't{index}_id')] for index in range(4000)]
+    assert len(set(hub_colors)) == 4000
@@ -0,0 +1,18 @@
+"""
+Parts of a split schema: every table is in one part of at most 'max_tables' tables,
+small components and small communities of large components are packed into common parts.
+"""
+import math
+from partition import SchemaPartition
+from synthetic_schema import SyntheticSchema
+
+
+def test_small_communities_are_packed():
+    model = SyntheticSchema(3000, fk_density=1.5, hubs=5).model()
+    partition = SchemaPartition(model, 200)
+    sizes = [len(part) for part in partition.parts]
+    assert sum(sizes) == len(model) and len(partition.part_of) == len(model)
+    assert max(sizes) <= 200
+    # Small groups are packed until the part is full, so at most the last common part stays small.
+    assert sum(1 for size in sizes if size * 4 <= 200) <= 1
+    assert len(sizes) <= 2 * math.ceil(len(model) / 200)
@@ -0,0 +1,253 @@
+"""
+Tiled output of very large diagrams (Deep Zoom).
+
+A bitmap of a diagram with thousands of tables is too large for PlantUML and for browsers. Instead, the diagram
+is drawn in svg and cut into a pyramid of png tiles: the last level has the full size, every level before it
+is two times smaller, down to one pixel. The pyramid is described by a '.dzi' file (Deep Zoom Image, it can also
+be opened by OpenSeadragon), a small HTML viewer is saved next to it. The viewer loads only visible tiles.
+
+The svg is parsed by cairosvg once. Only the last level is rasterized: the parsed image is drawn block by block
+(at most 'block' x 'block' pixels, the view box of the block selects and clips its part) and every block is cut
+into tiles. Every smaller level is made from the level above it: a tile is four tiles of the larger level
+reduced two times, as in other Deep Zoom pyramids. So the memory does not depend on the size of the diagram,
+and the time grows with the number of tiles.
+"""
+import math
+import os
+import re
+import cairocffi as cairo
+from cairosvg.parser import Tree
+from cairosvg.surface import PNGSurface
+from metrics import metrics
+
+VIEWER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+html, body {{margin: 0; height: 100%; overflow: hidden; background: #fff;}}
+#view {{position: absolute; top: 0; left: 0; right: 0; bottom: 0; cursor: grab;}}
+#view img {{position: absolute; left: 0; top: 0; transform-origin: 0 0; user-select: none; pointer-events: none;}}
+</style>
+</head>
+<body>
+<div id="view"></div>
+<script>
+// Size of the image, size of tiles, the last level and the folder of tiles.
+const W = {width}, H = {height}, TILE = {tile_size}, MAX = {max_level}, SRC = "{source}/";
+const view = document.getElementById("view");
+let zoom = Math.min(innerWidth / W, innerHeight / H, 1);
+let x = (innerWidth - W * zoom) / 2, y = (innerHeight - H * zoom) / 2;
+let shown = {{}};
+
+function draw() {{
+  // The level whose pixels are the closest to pixels of the screen.
+  const level = Math.max(0, Math.min(MAX, MAX + Math.ceil(Math.log2(zoom))));
+  const size = Math.pow(2, MAX - level), scale = zoom * size;
+  const columns = Math.ceil(W / size / TILE), rows = Math.ceil(H / size / TILE);
+  const left = Math.max(0, Math.floor(-x / scale / TILE));
+  const right = Math.min(columns - 1, Math.floor((innerWidth - x) / scale / TILE));
+  const top = Math.max(0, Math.floor(-y / scale / TILE));
+  const bottom = Math.min(rows - 1, Math.floor((innerHeight - y) / scale / TILE));
+  const visible = {{}};
+  for (let row = top; row <= bottom; row++) {{
+    for (let column = left; column <= right; column++) {{
+      const key = level + "/" + column + "_" + row;
+      let img = shown[key];
+      if (!img) {{
+        img = shown[key] = new Image();
+        img.src = SRC + key + ".png";
+        view.appendChild(img);
+      }}
+      img.style.transform = "translate(" + (x + column * TILE * scale) + "px," + (y + row * TILE * scale) + "px) "
+        + "scale(" + scale + ")";
+      visible[key] = true;
+    }}
+  }}
+  for (const key in shown) {{
+    if (!visible[key]) {{
+      shown[key].remove();
+      delete shown[key];
+    }}
+  }}
+}}
+
+view.addEventListener("wheel", function (event) {{
+  event.preventDefault();
+  const next = Math.min(Math.max(zoom * Math.exp(-event.deltaY / 500), Math.pow(2, -MAX)), 4);
+  x = event.clientX - (event.clientX - x) * next / zoom;
+  y = event.clientY - (event.clientY - y) * next / zoom;
+  zoom = next;
+  draw();
+}}, {{passive: false}});
+view.addEventListener("pointerdown", function (event) {{
+  view.setPointerCapture(event.pointerId);
+  view.style.cursor = "grabbing";
+}});
+view.addEventListener("pointermove", function (event) {{
+  if (view.hasPointerCapture(event.pointerId)) {{
+    x += event.movementX;
+    y += event.movementY;
+    draw();
+  }}
+}});
+view.addEventListener("pointerup", function () {{
+  view.style.cursor = "grab";
+}});
+addEventListener("resize", draw);
+draw();
+</script>
+</body>
+</html>
+"""
+
+
+def svg_number(value: str) -> float:
+    """
+    Func reads a length of svg without units: '1024pt', '512px', '300'.
+    """
+    found = re.match(r'\s*([0-9.]+)', value or '')
+    return float(found.group(1)) if found else 0.0
+
+
+class DeepZoom():
+    """
+    The class cuts an svg image into a pyramid of tiles.
+    scale: pixels of the last level per unit of the svg, so that text stays sharp at the largest zoom.
+    """
+    def __init__(self, svg: bytes, scale: float = 2.0, tile_size: int = 256, block: int = 2048):
+        self.scale = scale
+        self.tile_size = tile_size
+        # Blocks consist of whole tiles.
+        self.block = max(1, block // tile_size) * tile_size
+        self.tree = Tree(bytestring=svg)
+        if self.tree.get('viewBox'):
+            self.view_box = [float(number) for number in re.split(r'[\s,]+', self.tree['viewBox'].strip())]
+        else:
+            self.view_box = [0.0, 0.0, svg_number(self.tree.get('width')), svg_number(self.tree.get('height'))]
+        if len(self.view_box) != 4 or self.view_box[2] <= 0 or self.view_box[3] <= 0:
+            raise ValueError('The size of the svg image is unknown.')
+        self.width = max(1, math.ceil(self.view_box[2] * scale))
+        self.height = max(1, math.ceil(self.view_box[3] * scale))
+        self.max_level = math.ceil(math.log2(max(self.width, self.height)))
+
+    def level_size(self, level: int) -> tuple:
+        factor = 2 ** (self.max_level - level)
+        return math.ceil(self.width / factor), math.ceil(self.height / factor)
+
+    def render_block(self, x: int, y: int, width: int, height: int):
+        """
+        Func draws the block of the last level: (x, y) is its corner and (width, height) its size in pixels.
+        The parsed svg is reused, only the size and the view box of its root are changed.
+        return: cairo surface of the block.
+        """
+        units = 1 / self.scale
+        self.tree['width'] = str(width)
+        self.tree['height'] = str(height)
+        self.tree['viewBox'] = (
+            f'{self.view_box[0] + x * units:.4f} {self.view_box[1] + y * units:.4f} '
+            f'{width * units:.4f} {height * units:.4f}'
+        )
+        self.tree['preserveAspectRatio'] = 'none'
+        return PNGSurface(
+            self.tree, None, 96, output_width=width, output_height=height, background_color='white'
+        ).cairo
+
+    def cut(self, surface, folder: str, column: int, row: int, width: int, height: int) -> int:
+        """
+        Func cuts the block into tiles. column, row: the first tile of the block. return: the number of tiles.
+        """
+        number = 0
+        for y in range(0, height, self.tile_size):
+            for x in range(0, width, self.tile_size):
+                tile = cairo.ImageSurface(
+                    cairo.FORMAT_ARGB32, min(self.tile_size, width - x), min(self.tile_size, height - y)
+                )
+                context = cairo.Context(tile)
+                context.set_source_surface(surface, -x, -y)
+                context.paint()
+                tile.write_to_png(
+                    os.path.join(folder, f'{column + x // self.tile_size}_{row + y // self.tile_size}.png')
+                )
+                number += 1
+        return number
+
+    def shrink(self, larger: str, folder: str, width: int, height: int) -> int:
+        """
+        Func makes tiles of a level from tiles of the next level in the folder 'larger': every tile is four tiles
+        of the next level reduced two times. width, height: size of the level. return: the number of tiles.
+        """
+        number = 0
+        for row in range(math.ceil(height / self.tile_size)):
+            for column in range(math.ceil(width / self.tile_size)):
+                tile = cairo.ImageSurface(
+                    cairo.FORMAT_ARGB32, min(self.tile_size, width - column * self.tile_size),
+                    min(self.tile_size, height - row * self.tile_size)
+                )
+                context = cairo.Context(tile)
+                context.set_source_rgb(1, 1, 1)
+                context.paint()
+                context.scale(0.5, 0.5)
+                for y in (0, 1):
+                    for x in (0, 1):
+                        path = os.path.join(larger, f'{2 * column + x}_{2 * row + y}.png')
+                        if not os.path.exists(path):
+                            continue
+                        context.set_source_surface(
+                            cairo.ImageSurface.create_from_png(path), x * self.tile_size, y * self.tile_size
+                        )
+                        context.get_source().set_filter(cairo.FILTER_GOOD)
+                        context.paint()
+                tile.write_to_png(os.path.join(folder, f'{column}_{row}.png'))
+                number += 1
+        return number
+
+    def descriptor(self) -> str:
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{self.tile_size}" '
+            'Overlap="0" Format="png">\n'
+            f'  <Size Width="{self.width}" Height="{self.height}"/>\n'
+            '</Image>\n'
+        )
+
+    def save(self, output_path: str, name: str) -> bool:
+        """
+        Func saves the pyramid in 'output_path': 'name.dzi', tiles in 'name_files/LEVEL/COLUMN_ROW.png'
+        and the viewer 'name.html'.
+        """
+        source = f'{name}_files'
+        tiles_path = os.path.join(output_path, source)
+        if os.path.exists(tiles_path):
+            print(f'Incorrect path to output or "{source}" already exist.')
+            return False
+        number = 0
+        try:
+            with metrics.stage('tiles', width=self.width, height=self.height, levels=self.max_level + 1):
+                folder = os.path.join(tiles_path, str(self.max_level))
+                os.makedirs(folder)
+                for y in range(0, self.height, self.block):
+                    for x in range(0, self.width, self.block):
+                        block_width, block_height = min(self.block, self.width - x), min(self.block, self.height - y)
+                        surface = self.render_block(x, y, block_width, block_height)
+                        number += self.cut(
+                            surface, folder, x // self.tile_size, y // self.tile_size, block_width, block_height
+                        )
+                        surface.finish()
+                for level in range(self.max_level - 1, -1, -1):
+                    larger, folder = folder, os.path.join(tiles_path, str(level))
+                    os.makedirs(folder)
+                    number += self.shrink(larger, folder, *self.level_size(level))
+            with open(os.path.join(output_path, f'{name}.dzi'), 'w') as f:
+                f.write(self.descriptor())
+            with open(os.path.join(output_path, f'{name}.html'), 'w') as f:
+                f.write(VIEWER.format(
+                    title=name, width=self.width, height=self.height, tile_size=self.tile_size,
+                    max_level=self.max_level, source=source
+                ))
+        except (OSError, ValueError, SyntaxError, MemoryError, cairo.CairoError) as e:
+            print(f'Failed to cut the diagram into tiles: {e}')
+            return False
+        print(f'The diagram is cut into {number} tiles, open "{os.path.join(output_path, name)}.html".')
+        return True